@@ -0,0 +1,118 @@
+"""Пакетное распределение тем по пожеланиям участников.
+
+Каждый участник присылает темы в порядке желания. Распределение - это
+назначение минимальной стоимости в двудольном графе «участник - тема»:
+
+1. минимальна сумма мест полученных тем в списках (первое желание - 1);
+   остаться без темы из списка стоит как место сразу за последним - такой
+   участник потом занимает одну из оставшихся тем обычным порядком;
+2. при равной сумме лучшие места достаются тем, кто прислал список раньше.
+
+Второй уровень добавлен в стоимость ребра с таким весом, что в сумме не
+перевешивает и одного места первого уровня.
+
+Граф разреженный: у участника ребра только к темам из его списка и к
+собственной «пустой» теме. Участники добавляются по одному; для каждого
+кратчайший увеличивающий путь ищется алгоритмом Дейкстры по приведенным
+стоимостям с потенциалами тем (как в алгоритме Джонкера - Волгенанта), и
+поиск останавливается на первой свободной теме. Пока темы в списках не
+пересекаются, путь - одно ребро; цепочки перестановок строятся только
+вокруг спорных тем, и их длина ограничена ценой «пустой» темы.
+"""
+import heapq
+
+
+def assign(preferences, available):
+    """Оптимальное распределение: {ключ участника: тема}.
+
+    preferences - пары (ключ, темы по убыванию желания) в порядке времени
+    подачи; available - темы, которые можно раздать. Темы не из available и
+    повторы в списке пропускаются. Участник, которому не досталось ни одной
+    темы из его списка, в результат не попадает.
+    """
+    count = len(preferences)
+    depth = max((len(topics) for _, topics in preferences), default=0)
+    # Очередность подачи на всех вместе весит меньше одного места в списке
+    rank_cost = count * count * (depth + 1) + 1
+    skip_cost = rank_cost * (depth + 1)
+
+    columns = {}
+    edges = []
+    for row, (_, topics) in enumerate(preferences):
+        weight = count - row
+        row_edges = {}
+        for rank, topic in enumerate(topics, 1):
+            if topic in available and topic not in row_edges:
+                row_edges[topic] = rank * rank_cost + weight * rank
+        edges.append([(columns.setdefault(topic, len(columns)), cost) for topic, cost in row_edges.items()])
+    # Столбцы: сначала темы, затем у каждого участника своя «пустая» тема
+    topic_count = len(columns)
+    size = topic_count + count
+    skips = [skip_cost + (count - row) * (depth + 1) for row in range(count)]
+    # Потенциалы тем: у свободных всегда 0, у занятых не больше 0
+    price = [0] * size
+    holder = [None] * size
+    matched = [None] * count
+    matched_cost = [0] * count
+    # Расстояния поиска текущего участника; seen[column] == root - значение best[column] относится к нему
+    best = [0] * size
+    seen = [-1] * size
+    came_from = [None] * size
+
+    for root in range(count):
+        done = {}
+        heap = []
+        # Лучший из вариантов «кто-то из дерева поиска остается без темы»
+        skip_distance, skip_row = None, None
+        row, base = root, 0
+        while True:
+            for column, cost in edges[row]:
+                distance = base + cost - price[column]
+                if seen[column] != root:
+                    seen[column] = root
+                elif distance >= best[column] or column in done:
+                    continue
+                best[column] = distance
+                came_from[column] = (row, cost)
+                heapq.heappush(heap, (distance, column))
+            distance = base + skips[row]
+            if skip_distance is None or distance < skip_distance:
+                skip_distance, skip_row = distance, row
+            while heap:
+                distance, column = heapq.heappop(heap)
+                if distance == best[column] and column not in done:
+                    break
+            else:
+                distance = None
+            if distance is None or distance >= skip_distance:
+                column = topic_count + skip_row
+                distance = skip_distance
+                came_from[column] = (skip_row, skips[skip_row])
+                break
+            done[column] = distance
+            if holder[column] is None:
+                break
+            row = holder[column]
+            # Ребро участника к его текущей теме приведено к нулю
+            base = distance - (matched_cost[row] - price[column])
+
+        # Потенциалы сохраняют неотрицательность приведенных стоимостей
+        for finished, finished_distance in done.items():
+            price[finished] += finished_distance - distance
+        # Сдвигаем участников вдоль найденного пути
+        while True:
+            row, cost = came_from[column]
+            previous = matched[row]
+            matched[row] = column
+            matched_cost[row] = cost
+            holder[column] = row
+            if row == root:
+                break
+            column = previous
+
+    topics = list(columns)
+    return {
+        preferences[row][0]: topics[column]
+        for row, column in enumerate(matched)
+        if column < topic_count
+    }
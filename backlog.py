@@ -0,0 +1,62 @@
+"""Разбор обновлений, накопившихся за время простоя бота, до начала опроса"""
+import logging
+
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import ConversationHandler
+
+from throttle import CLAIM_FILTER
+
+# Сколько обновлений забирать за один getUpdates при разборе накопившихся после перезапуска (максимум Telegram)
+BACKLOG_BATCH_SIZE = 100
+
+
+async def fetch_backlog(bot, batch_size=BACKLOG_BATCH_SIZE):
+    """Все обновления, которые Telegram накопил для бота, и подтверждение их получения"""
+    updates = []
+    offset = None
+    while True:
+        try:
+            batch = await bot.get_updates(
+                offset=offset, limit=batch_size, timeout=0, allowed_updates=Update.ALL_TYPES
+            )
+        except TelegramError as e:
+            # Подтвержденное раньше уже не придет снова - разбираем то, что успели забрать
+            logging.error(f"Ошибка при получении накопившихся обновлений: {e}")
+            break
+        if not batch:
+            # Запрос с offset после последнего обновления подтвердил все предыдущие
+            break
+        updates.extend(batch)
+        offset = batch[-1].update_id + 1
+    return updates
+
+
+async def drain_pending_updates(application, bot):
+    """Разбирает накопившиеся номера тем одним проходом, остальное ставит в очередь приложения по порядку"""
+    await application.bot.delete_webhook()
+    updates = await fetch_backlog(application.bot)
+    if not updates:
+        return
+    conversations = [
+        handler for handlers in application.handlers.values() for handler in handlers
+        if isinstance(handler, ConversationHandler)
+    ]
+    claims, rest, seen = [], [], set()
+    for update in updates:
+        if (update.message is None or update.effective_user is None or not CLAIM_FILTER.check_update(update)
+                or any(handler.check_update(update) for handler in conversations)):
+            rest.append(update)
+            continue
+        key = (update.effective_chat.id, update.effective_user.id, update.message.text)
+        if key not in seen:
+            seen.add(key)
+            claims.append(update)
+    claims.sort(key=lambda update: (update.message.date, update.update_id))
+    won = await bot.drain_claims(claims, application.bot)
+    for update in rest:
+        await application.update_queue.put(update)
+    logging.info(
+        f"Разобрано накопившихся обновлений: {len(updates)}; заявок {len(claims)} "
+        f"(повторов {len(updates) - len(rest) - len(claims)}), занято тем {won}, остальных {len(rest)}"
+    )
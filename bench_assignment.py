@@ -0,0 +1,75 @@
+"""Пакетное распределение по пожеланиям против очереди «кто первый».
+
+Генерирует пожелания участников (популярность тем - по закону Ципфа:
+несколько тем хотят все, хвост - почти никто), затем раздает темы двумя
+способами: assignment.assign (как в режиме /preference_mode) и жадно в
+порядке подачи - каждый берет первую свободную тему из своего списка, как
+при гонке за номерами. Печатает время распределения и качество: сколько
+участников получили тему из списка, сколько - первое желание, среднее
+место полученной темы.
+
+Запуск:
+    python bench_assignment.py --students 5000 --topics 5000 --choices 5 --skew 0.8
+"""
+import argparse
+import itertools
+import random
+import time
+
+from assignment import assign
+
+
+def generate_preferences(args):
+    rng = random.Random(args.seed)
+    weights = list(itertools.accumulate(1 / rank ** args.skew for rank in range(1, args.topics + 1)))
+    preferences = []
+    for user_id in range(args.students):
+        wishes = {}
+        while len(wishes) < min(args.choices, args.topics):
+            wishes.setdefault(rng.choices(range(1, args.topics + 1), cum_weights=weights)[0])
+        preferences.append((user_id, list(wishes)))
+    return preferences
+
+
+def first_come(preferences, available):
+    """Каждый в порядке подачи берет первую свободную тему из своего списка"""
+    free = set(available)
+    result = {}
+    for user_id, topics in preferences:
+        for topic in topics:
+            if topic in free:
+                free.discard(topic)
+                result[user_id] = topic
+                break
+    return result
+
+
+def report(title, preferences, result, elapsed):
+    ranks = [topics.index(result[user_id]) + 1 for user_id, topics in preferences if user_id in result]
+    print(f"{title:<22} {elapsed * 1000:8.1f} мс  по списку {len(ranks):>6} из {len(preferences)}, "
+          f"первое желание {sum(rank == 1 for rank in ranks):>6}, "
+          f"среднее место {sum(ranks) / max(len(ranks), 1):.2f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Распределение тем по пожеланиям")
+    parser.add_argument('--students', type=int, default=5000)
+    parser.add_argument('--topics', type=int, default=5000)
+    parser.add_argument('--choices', type=int, default=5, help="тем в списке участника (в боте не больше 5)")
+    parser.add_argument('--skew', type=float, default=0.8, help="показатель Ципфа для популярности тем, 0 - равномерно")
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args(argv)
+
+
+def main(args):
+    preferences = generate_preferences(args)
+    available = set(range(1, args.topics + 1))
+    print(f"Участников: {args.students}, тем: {args.topics}, в списке: {args.choices}, skew {args.skew}")
+    for title, method in (("Оптимально (assign)", assign), ("Кто первый", first_come)):
+        started = time.perf_counter()
+        result = method(preferences, available)
+        report(title, preferences, result, time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    main(parse_args())
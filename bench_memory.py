@@ -0,0 +1,118 @@
+"""Сколько памяти занимает состояние SeminarBot при множестве предметов.
+
+Восстанавливает одно и то же состояние (предметы, темы, заявки) из строк
+журнала дважды: в прежнем виде - словари {номер: название} и {номер:
+(user_id, username, datetime)} - и в TopicTable/ClaimTable. Для сравнения
+отдельно меряется все состояние SeminarBot вместе с индексами для досок.
+Память меряется tracemalloc как прирост занятых байт после построения.
+
+Запуск:
+    python bench_memory.py --subjects 2000 --topics 40 --claimed 0.8
+"""
+import argparse
+import datetime
+import gc
+import json
+import random
+import sys
+import tracemalloc
+
+import gspd
+from claim_table import ClaimTable, TopicTable
+
+
+def generate_journal(args):
+    """Строки журнала: предметы с темами и заявки на часть тем"""
+    rng = random.Random(args.seed)
+    start = datetime.datetime(2025, 9, 1, 10, 0)
+    users = [(100_000 + i, f'student{i}') for i in range(args.users)]
+    events = []
+    for s in range(args.subjects):
+        subject = f'Предмет {s} группы {s % 50}'
+        topics = [[n, f'Тема номер {n} по предмету {s}'] for n in range(1, args.topics + 1)]
+        events.append({'op': 'subject', 'subject': subject, 'topics': topics})
+        for n in rng.sample(range(1, args.topics + 1), int(args.topics * args.claimed)):
+            user_id, username = rng.choice(users)
+            at = start + datetime.timedelta(microseconds=rng.randrange(600_000_000))
+            events.append({'op': 'claim', 'subject': subject, 'topic': n,
+                           'user_id': user_id, 'username': username, 'at': at.isoformat()})
+    return [json.dumps(event, ensure_ascii=False) for event in events]
+
+
+def build_legacy(lines):
+    """Прежнее представление: вложенные словари с кортежами и datetime"""
+    topics, registrations = {}, {}
+    for line in lines:
+        event = json.loads(line)
+        if event['op'] == 'subject':
+            topics[event['subject']] = dict(event['topics'])
+            registrations[event['subject']] = {}
+        else:
+            registrations[event['subject']][event['topic']] = (
+                event['user_id'], event['username'], datetime.datetime.fromisoformat(event['at'])
+            )
+    return topics, registrations
+
+
+def build_tables(lines):
+    """Те же данные в TopicTable/ClaimTable, с интернированными названиями предметов"""
+    topics, registrations = {}, {}
+    for line in lines:
+        event = json.loads(line)
+        subject = sys.intern(event['subject'])
+        if event['op'] == 'subject':
+            topics[subject] = TopicTable(event['topics'])
+            registrations[subject] = ClaimTable(topics[subject].index)
+        else:
+            registrations[subject][event['topic']] = (
+                event['user_id'], event['username'], datetime.datetime.fromisoformat(event['at'])
+            )
+    return topics, registrations
+
+
+def build_bot(lines):
+    bot = gspd.SeminarBot()
+    for line in lines:
+        bot.apply_event(json.loads(line))
+    return bot
+
+
+def measure(build, lines):
+    """Байт, которые остаются занятыми результатом build(lines)"""
+    gc.collect()
+    tracemalloc.start()
+    state = build(lines)
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del state
+    return size
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Память под темы и заявки")
+    parser.add_argument('--subjects', type=int, default=2000, help="число предметов")
+    parser.add_argument('--topics', type=int, default=40, help="тем в каждом предмете")
+    parser.add_argument('--claimed', type=float, default=0.8, help="доля занятых тем")
+    parser.add_argument('--users', type=int, default=5000, help="число разных участников")
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args(argv)
+
+
+def main(args):
+    lines = generate_journal(args)
+    claims = sum(1 for line in lines if '"op": "claim"' in line)
+    legacy_size = measure(build_legacy, lines)
+    tables_size = measure(build_tables, lines)
+    bot_size = measure(build_bot, lines)
+
+    print(f"Предметов: {args.subjects}, тем: {args.subjects * args.topics}, заявок: {claims}")
+    for title, size in (("Словари и кортежи (прежде)", legacy_size),
+                        ("TopicTable и ClaimTable", tables_size),
+                        ("Все состояние SeminarBot", bot_size)):
+        print(f"{title:<28} {size / 2**20:7.1f} МБ, {size / claims:5.0f} байт на заявку")
+    print(f"Темы и заявки занимают на {1 - tables_size / legacy_size:.0%} меньше")
+
+
+if __name__ == "__main__":
+    main(parse_args())
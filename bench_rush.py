@@ -0,0 +1,329 @@
+"""Офлайн-бенчмарк «открытия распределения» для SeminarBot.
+
+Воспроизводит пик в первую секунду распределения: сотни студентов
+одновременно отправляют номера тем, параллельно часть участников
+вызывает /view_topics и /results. Обновления проходят через настоящий
+Application и обработчики из gspd.setup_handlers, а запросы к Bot API
+подменяются FakeRequest, поэтому в сеть ничего не уходит.
+
+Запуск:
+    python bench_rush.py --students 500 --topics 60 --viewers 40 --latency 0.02
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import tempfile
+import time
+
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+from telegram.request import BaseRequest
+
+import gspd
+import throttle
+from claim_store import SharedStore
+from journal import Journal
+from outbox import Outbox
+from persistence import SQLitePersistence
+from update_processing import PerUserUpdateProcessor
+
+BENCH_TOKEN = "123456:BENCHMARK"
+CHAT = {'id': -1001000000000, 'type': 'supergroup', 'title': 'Семинар'}
+SUBJECT = 'Бенчмарк'
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'SeminarBot', 'username': 'seminar_bot'}
+
+
+class FakeRequest(BaseRequest):
+    """Подмена HTTP-транспорта: отвечает как Bot API и записывает все вызовы"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = []
+        self._message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.calls.append((api_method, params, time.perf_counter()))
+        payload = {'ok': True, 'result': self._result(api_method, params)}
+        return 200, json.dumps(payload).encode('utf-8')
+
+    def _result(self, api_method, params):
+        if api_method == 'getMe':
+            return BOT_USER
+        if api_method in ('sendMessage', 'editMessageText', 'sendDocument'):
+            self._message_id += 1
+            return {
+                'message_id': params.get('message_id', self._message_id),
+                'date': int(time.time()),
+                'chat': {'id': params.get('chat_id', CHAT['id']), 'type': CHAT['type']},
+                'text': params.get('text', ''),
+            }
+        return True
+
+
+class UpdateFactory:
+    """Собирает JSON-обновления так, как их прислал бы Telegram"""
+
+    def __init__(self, private=False):
+        self.private = private
+        self.update_id = 0
+        self.message_id = 0
+
+    def message(self, user_id, text, date=None):
+        self.update_id += 1
+        self.message_id += 1
+        message = {
+            'message_id': self.message_id,
+            'date': int(date if date is not None else time.time()),
+            'chat': {'id': user_id, 'type': 'private'} if self.private else CHAT,
+            'from': {'id': user_id, 'is_bot': False,
+                     'first_name': f'Student{user_id}', 'username': f'student{user_id}'},
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0,
+                                    'length': len(text.split()[0])}]
+        return {'update_id': self.update_id, 'message': message}
+
+    def callback(self, user_id, data, message_id=1):
+        """Нажатие inline-кнопки под сообщением бота message_id"""
+        self.update_id += 1
+        return {'update_id': self.update_id, 'callback_query': {
+            'id': str(self.update_id),
+            'from': {'id': user_id, 'is_bot': False,
+                     'first_name': f'Student{user_id}', 'username': f'student{user_id}'},
+            'chat_instance': 'bench',
+            'data': data,
+            'message': {
+                'message_id': message_id, 'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'} if self.private else CHAT,
+                'from': BOT_USER, 'text': '',
+            },
+        }}
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def build_rush(factory, args, rng, subject_id):
+    """Готовит поток обновлений: номера тем от студентов вперемешку с просмотрами"""
+    weights = [1 / (rank + 1) ** args.skew for rank in range(args.topics)]
+    now = time.time()
+    rush = []
+    for i in range(args.students):
+        topic = rng.choices(range(1, args.topics + 1), weights=weights)[0]
+        rush.append((10_000 + i, f"c|{subject_id}|{topic}" if args.buttons else str(topic)))
+    for i in range(args.viewers):
+        rush.append((20_000 + i, rng.choice(['/view_topics', '/results'])))
+    # Участники, которые шлют номера очередью, пытаясь занять несколько тем
+    for i in range(args.spammers):
+        for _ in range(args.spam):
+            rush.append((30_000 + i, str(rng.randint(1, args.topics))))
+    rng.shuffle(rush)
+    return [
+        factory.callback(user_id, text) if text.startswith('c|') else factory.message(user_id, text, date=now)
+        for user_id, text in rush
+    ]
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    request = FakeRequest(latency=args.latency)
+    builder = (
+        Application.builder()
+        .token(BENCH_TOKEN)
+        .request(request)
+        .get_updates_request(FakeRequest())
+        .updater(None)
+        .concurrent_updates(PerUserUpdateProcessor(args.concurrency))
+    )
+    if args.dialogs:
+        builder = builder.persistence(SQLitePersistence(
+            os.path.join(tempfile.mkdtemp(prefix='bench_rush_'), 'dialogs.sqlite'), update_interval=0.5
+        ))
+    application = builder.build()
+    window = args.window
+    if window is None:
+        # При последовательной обработке переупорядочивания нет, и окно только добавило бы задержку
+        window = gspd.ARBITRATION_WINDOW if args.concurrency > 1 else 0.0
+    journal = None
+    if args.journal:
+        journal = Journal(os.path.join(tempfile.mkdtemp(prefix='bench_rush_'), 'journal.jsonl'))
+    elif args.store:
+        journal = SharedStore(os.path.join(tempfile.mkdtemp(prefix='bench_rush_'), 'store.sqlite'))
+    outbox = None
+    if args.outbox:
+        outbox = Outbox(global_rate=args.global_rate, chat_rate=args.chat_rate)
+    bot = gspd.SeminarBot(arbitration_window=window, journal=journal, outbox=outbox)
+    gspd.setup_handlers(application, bot)
+
+    enqueued, started, finished = {}, {}, {}
+
+    async def mark_started(update, context):
+        started[update.update_id] = time.perf_counter()
+
+    async def mark_finished(update, context):
+        finished[update.update_id] = time.perf_counter()
+
+    application.add_handler(TypeHandler(Update, mark_started), group=-100)
+    application.add_handler(TypeHandler(Update, mark_finished), group=100)
+
+    factory = UpdateFactory(private=args.private)
+    topics_list = "\n".join(f"{n}. Тема {n}" for n in range(1, args.topics + 1))
+    setup = [
+        factory.message(bot.admin_id, '/new_subject'),
+        factory.message(bot.admin_id, SUBJECT),
+        factory.message(bot.admin_id, topics_list),
+    ]
+    rush = build_rush(factory, args, rng, bot.subject_id(SUBJECT))
+
+    async with application:
+        await bot.post_init(application)
+        await application.start()
+
+        # Подготовка предмета проходит через обычный диалог администратора
+        for data in setup:
+            await application.update_queue.put(Update.de_json(data, application.bot))
+            await application.update_queue.join()
+        request.calls.clear()
+
+        rush_updates = [Update.de_json(data, application.bot) for data in rush]
+        t0 = time.perf_counter()
+        for update in rush_updates:
+            enqueued[update.update_id] = time.perf_counter()
+            await application.update_queue.put(update)
+        await application.update_queue.join()
+        if args.settle:
+            await asyncio.sleep(args.settle)
+        elapsed = time.perf_counter() - t0
+
+        # Отложенные обновления живых досок и очередь исходящих тоже входят в трафик
+        max_depth = {}
+        while True:
+            tasks = [board.task for boards in bot.live_boards.values()
+                     for board in boards.values() if board.task]
+            depth = outbox.depth() if outbox else {}
+            for name, value in depth.items():
+                max_depth[name] = max(max_depth.get(name, 0), value)
+            if not tasks and not sum(depth.values()):
+                break
+            await asyncio.sleep(0.05)
+        drained = time.perf_counter() - t0
+
+        await application.stop()
+        await bot.post_shutdown(application)
+
+    rush_ids = [u.update_id for u in rush_updates]
+    end_to_end = [(finished[i] - enqueued[i]) * 1000 for i in rush_ids if i in finished]
+    handler = [(finished[i] - started[i]) * 1000 for i in rush_ids if i in finished]
+    registrations = sum(len(regs) for regs in bot.registrations.values())
+    sent = [params for method, params, _ in request.calls
+            if method in ('sendMessage', 'answerCallbackQuery')]
+    conflicts = sum('уже занята' in params.get('text', '') for params in sent)
+
+    # Честность: тему должен получить самый ранний по update_id претендент, у которого
+    # еще нет темы и чья заявка не отброшена ограничением частоты (приближенно - первые CLAIM_BURST)
+    first_claimant = {}
+    claimed, attempts = set(), collections.Counter()
+    for data in rush:
+        if 'callback_query' in data:
+            user_id = data['callback_query']['from']['id']
+            topic = int(data['callback_query']['data'].rsplit('|', 1)[1])
+        elif data['message']['text'].isdigit():
+            user_id = data['message']['from']['id']
+            topic = int(data['message']['text'])
+        else:
+            continue
+        attempts[user_id] += 1
+        if user_id in claimed or attempts[user_id] > throttle.CLAIM_BURST or topic in first_claimant:
+            continue
+        first_claimant[topic] = user_id
+        claimed.add(user_id)
+    unfair = sum(
+        1 for topic, (user_id, _, _) in bot.registrations.get(SUBJECT, {}).items()
+        if first_claimant.get(topic) != user_id
+    )
+    outbound_chars = sum(len(params.get('text', '')) for _, params, _ in request.calls)
+
+    print(f"Обновлений: {len(rush_updates)} (студентов {args.students}, "
+          f"просмотров {args.viewers}), тем: {args.topics}")
+    print(f"Время обработки пика: {elapsed:.3f} с, "
+          f"пропускная способность: {len(rush_updates) / elapsed:.1f} обн/с")
+    for title, values in (("От постановки в очередь", end_to_end), ("Время обработчика", handler)):
+        print(f"{title}, мс: p50={percentile(values, 50):.1f} "
+              f"p95={percentile(values, 95):.1f} p99={percentile(values, 99):.1f} "
+              f"max={max(values, default=0):.1f}")
+    print(f"Регистраций: {registrations}, конфликтов ('уже занята'): {conflicts}, "
+          f"нарушений порядка: {unfair}")
+    print(f"Все отправки завершены через {drained:.3f} с")
+    if args.spammers:
+        throttled = next(throttle.THROTTLED.samples(), (None, None, None, 0))[3]
+        print(f"Отброшено ограничением частоты: {throttled} "
+              f"из {args.spammers * args.spam} сообщений {args.spammers} флудеров")
+    if outbox:
+        print(f"Очередь исходящих: макс. глубина {max_depth}, {dict(outbox.stats)}")
+    print(f"Исходящих вызовов: {len(request.calls)} "
+          f"({len(request.calls) / max(registrations, 1):.1f} на регистрацию), "
+          f"символов: {outbound_chars}")
+    by_method = collections.Counter(method for method, _, _ in request.calls)
+    print("По методам: " + ", ".join(f"{method} {count}" for method, count in by_method.most_common()))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк пика при открытии распределения")
+    parser.add_argument('--students', type=int, default=300, help="число студентов в пике")
+    parser.add_argument('--topics', type=int, default=40, help="число тем в предмете")
+    parser.add_argument('--viewers', type=int, default=30, help="число /view_topics и /results")
+    parser.add_argument('--spammers', type=int, default=0,
+                        help="число участников, присылающих номера очередью")
+    parser.add_argument('--spam', type=int, default=20, help="сколько номеров присылает каждый из них")
+    parser.add_argument('--skew', type=float, default=1.0,
+                        help="перекос популярности тем (0 - равномерно)")
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help="имитируемая задержка одного вызова Bot API, с")
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help="сколько обновлений обрабатывается одновременно")
+    parser.add_argument('--window', type=float, default=None,
+                        help="окно арбитража заявок, с (по умолчанию как в боте)")
+    parser.add_argument('--settle', type=float, default=0.0,
+                        help="сколько секунд ждать фоновые отправки после пика")
+    parser.add_argument('--private', action='store_true',
+                        help="каждый студент пишет боту в личку, а не в общую группу")
+    parser.add_argument('--buttons', action='store_true',
+                        help="студенты выбирают темы кнопками под доской, а не номером")
+    parser.add_argument('--outbox', action='store_true',
+                        help="отправлять через очередь исходящих с лимитами Telegram")
+    parser.add_argument('--global-rate', type=float, default=30.0,
+                        help="общий лимит очереди исходящих, сообщений/с")
+    parser.add_argument('--chat-rate', type=float, default=1.0,
+                        help="лимит очереди исходящих на один чат, сообщений/с")
+    parser.add_argument('--journal', action='store_true',
+                        help="писать журнал изменений на диск (во временный каталог)")
+    parser.add_argument('--store', action='store_true',
+                        help="хранить заявки в общем SQLite-хранилище, как при нескольких процессах")
+    parser.add_argument('--dialogs', action='store_true',
+                        help="сохранять диалоги и user_data в SQLite, как в build_application")
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
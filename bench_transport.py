@@ -0,0 +1,110 @@
+"""Бенчмарк HTTP-клиента Bot API: задержка отправки при одновременных вызовах.
+
+Поднимает заглушку fake_bot_api в соседнем процессе (с задержкой каждого
+ответа, как у настоящего Telegram) и для нескольких размеров пула
+соединений одновременно отправляет calls сообщений через telegram.Bot -
+так же, как ответы обработчиков в пике распределения. Вызов, который не
+дождался свободного соединения за pool_timeout, считается потерянным
+(в боте это TimedOut и повторная отправка).
+
+Запуск:
+    python bench_transport.py --calls 200 --latency 0.05 --pools 1,8,32,128
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import time
+
+from telegram import Bot
+from telegram.error import TimedOut
+from telegram.request import HTTPXRequest
+
+from fake_bot_api import FakeBotApi, UpdateStream, make_api_server
+
+BENCH_TOKEN = "123456:BENCHMARK"
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q / 100))]
+
+
+async def measure(base_url, pool_size, http_version, args):
+    """Отправляет args.calls сообщений разом; возвращает (задержки в мс, таймауты, секунды на все)"""
+    request = HTTPXRequest(
+        connection_pool_size=pool_size,
+        pool_timeout=args.pool_timeout,
+        read_timeout=args.read_timeout,
+        http_version=http_version,
+    )
+    latencies, timeouts = [], 0
+
+    async def send(i):
+        nonlocal timeouts
+        started = time.perf_counter()
+        try:
+            await bot.send_message(chat_id=-1001000000000 - i % args.chats, text=f"Ответ {i}")
+        except TimedOut:
+            timeouts += 1
+            return
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    async with Bot(BENCH_TOKEN, base_url=base_url, request=request) as bot:
+        # Прогрев: соединения пула уже открыты, как в работающем боте
+        await asyncio.gather(*(bot.get_me() for _ in range(min(pool_size, args.calls))))
+        t0 = time.perf_counter()
+        await asyncio.gather(*(send(i) for i in range(args.calls)))
+        elapsed = time.perf_counter() - t0
+    return latencies, timeouts, elapsed
+
+
+async def run(args, base_url):
+    versions = ['1.1'] + (['2'] if args.http2 else [])
+    print(f"Вызовов: {args.calls} одновременно, задержка ответа {args.latency * 1000:.0f} мс, "
+          f"pool_timeout {args.pool_timeout} с")
+    for http_version in versions:
+        for pool_size in args.pools:
+            latencies, timeouts, elapsed = await measure(base_url, pool_size, http_version, args)
+            print(f"HTTP/{http_version} пул {pool_size:>4}: "
+                  f"p50={percentile(latencies, 50):7.1f} p95={percentile(latencies, 95):7.1f} "
+                  f"p99={percentile(latencies, 99):7.1f} мс, "
+                  f"{len(latencies) / elapsed:6.1f} выз/с, таймаутов пула {timeouts}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Задержка отправки при разных пулах соединений")
+    parser.add_argument('--calls', type=int, default=200, help="сколько вызовов отправляется одновременно")
+    parser.add_argument('--chats', type=int, default=50, help="по скольким чатам они распределены")
+    parser.add_argument('--latency', type=float, default=0.05, help="задержка ответа заглушки, с")
+    parser.add_argument('--pools', type=lambda value: [int(size) for size in value.split(',')],
+                        default=[1, 8, 32, 128], help="размеры пула через запятую")
+    parser.add_argument('--pool-timeout', type=float, default=3.0,
+                        help="сколько ждать свободного соединения, с")
+    parser.add_argument('--read-timeout', type=float, default=10.0)
+    parser.add_argument('--http2', action='store_true', help="сравнить и с HTTP/2 (нужен пакет h2)")
+    return parser.parse_args(argv)
+
+
+def serve(server):
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server.serve_forever()
+
+
+def main(args):
+    api = FakeBotApi(UpdateStream(students=0, chats=0), latency=args.latency)
+    server = make_api_server(api)
+    # Сервер в отдельном процессе, чтобы он не делил GIL с измеряемым клиентом
+    process = multiprocessing.get_context('fork').Process(target=serve, args=(server,), daemon=True)
+    process.start()
+    server.socket.close()
+    try:
+        asyncio.run(run(args, f"http://127.0.0.1:{server.server_port}/bot"))
+    finally:
+        process.terminate()
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,314 @@
+"""Состояние бота по чатам с выгрузкой давно не использованных чатов на диск"""
+import asyncio
+import collections
+import datetime
+import functools
+import json
+import logging
+import os
+import time
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+import metrics
+from backlog import drain_pending_updates
+from claim_store import SharedStore
+from journal import Journal
+from update_processing import register_metrics
+
+# Сколько чатов держать в памяти и через сколько секунд без обновлений выгружать чат на диск
+MAX_LOADED_CHATS = 200
+CHAT_IDLE_TIMEOUT = 30 * 60
+# Как часто искать простаивающие чаты
+CHAT_SWEEP_INTERVAL = 60
+# Как часто лидер проверяет, не писали ли другие процессы в хранилища чатов, которых у него нет в памяти
+STORE_WATCH_INTERVAL = 1.0
+# За сколько до открытия распределения или напоминания выгруженный чат загружается обратно
+CHAT_WAKE_LEAD = datetime.timedelta(minutes=1)
+
+LOADED_CHATS = metrics.Gauge('seminar_loaded_chats', 'Чаты, состояние которых сейчас в памяти')
+CHAT_SWAPS = metrics.Counter('seminar_chat_swaps_total', 'Загрузки чатов с диска и выгрузки на диск', ['op'])
+
+
+class ChatRouter:
+    """Состояние бота по чатам: обработчик вызывается у SeminarBot чата, из которого пришло обновление"""
+    # Чаты, простаивающие дольше idle_timeout, и самые давние сверх max_loaded выгружаются на диск
+
+    # Класс состояния одного чата (SeminarBot); передается снаружи, потому что gspd импортирует этот модуль
+    chat_class = None
+
+    def __init__(self, chat_class, state_dir, shared=False, outbox=None, leader=True,
+                 arbitration_window=None, max_loaded=MAX_LOADED_CHATS,
+                 idle_timeout=CHAT_IDLE_TIMEOUT, metrics_address=None, drain_backlog=False):
+        self.chat_class = chat_class
+        self.state_dir = state_dir
+        os.makedirs(state_dir, exist_ok=True)
+        # Общее для нескольких процессов хранилище (SQLite) вместо журнала на чат
+        self.shared = shared
+        self.outbox = outbox
+        self.leader = leader
+        # None - окно арбитража по умолчанию у chat_class
+        self.arbitration_window = arbitration_window
+        self.max_loaded = max_loaded
+        self.idle_timeout = idle_timeout
+        self.metrics_address = metrics_address
+        self._metrics_server = None
+        self.drain_backlog = drain_backlog
+        self.bot = None
+        # Загруженные чаты от давно использованных к недавним и время последнего обращения
+        self.chats = collections.OrderedDict()
+        self.last_used = {}
+        # Обновления, которые сейчас обрабатываются в чате: такой чат не выгружается
+        self.busy = collections.Counter()
+        self._loading = {}
+        self._unloading = {}
+        # Выгруженные чаты с запланированными событиями: chat_id -> когда загрузить
+        self.wake_path = os.path.join(state_dir, 'wake.json')
+        self.wake_times = self._read_wake_times()
+        self._wake_lock = asyncio.Lock()
+        self._sweeper_task = None
+        # Лидер при общих хранилищах: chat_id -> подпись файлов хранилища при прошлой проверке
+        self._store_seen = None
+        self._watch_task = None
+
+    def __getattr__(self, name):
+        method = getattr(self.chat_class, name, None)
+        if name.startswith('_') or not asyncio.iscoroutinefunction(method):
+            raise AttributeError(name)
+
+        @functools.wraps(method)
+        async def handler(update, context):
+            return await self.dispatch(name, update, context)
+        setattr(self, name, handler)
+        return handler
+
+    async def dispatch(self, name, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Вызывает обработчик name у состояния чата, из которого пришло обновление"""
+        chat_id = update.effective_chat.id if update.effective_chat else update.effective_user.id
+        self.busy[chat_id] += 1
+        try:
+            chat = await self.get_chat(chat_id)
+            return await getattr(chat, name)(update, context)
+        finally:
+            self.busy[chat_id] -= 1
+            if not self.busy[chat_id]:
+                del self.busy[chat_id]
+
+    def journal_path(self, chat_id):
+        return os.path.join(self.state_dir, f'{chat_id}.sqlite' if self.shared else f'{chat_id}.jsonl')
+
+    async def get_chat(self, chat_id):
+        """Состояние чата; если его нет в памяти - загружает с диска"""
+        chat = self.chats.get(chat_id)
+        if chat is None:
+            loading = self._loading.get(chat_id)
+            if loading is None:
+                loading = self._loading[chat_id] = asyncio.ensure_future(self._load_chat(chat_id))
+                loading.add_done_callback(lambda _: self._loading.pop(chat_id, None))
+            chat = await asyncio.shield(loading)
+        self.chats.move_to_end(chat_id)
+        self.last_used[chat_id] = time.monotonic()
+        return chat
+
+    async def _load_chat(self, chat_id):
+        unloading = self._unloading.get(chat_id)
+        if unloading is not None:
+            # Сначала дожидаемся, пока прежняя копия допишет журнал
+            await unloading
+        path = self.journal_path(chat_id)
+        options = {} if self.arbitration_window is None else {'arbitration_window': self.arbitration_window}
+        chat = self.chat_class(
+            journal=SharedStore(path) if self.shared else Journal(path),
+            outbox=self.outbox,
+            leader=self.leader,
+            chat_id=chat_id,
+            **options,
+        )
+        snapshot, events = await asyncio.to_thread(chat.journal.load)
+        chat.load_state(snapshot, events)
+        chat.start_tasks(self.bot)
+        self.chats[chat_id] = chat
+        self.last_used[chat_id] = time.monotonic()
+        self.wake_times.pop(chat_id, None)
+        CHAT_SWAPS.labels('load').inc()
+        if chat.topics:
+            logging.info(f"Чат {chat_id} загружен: предметов {len(chat.topics)}, событий журнала {len(events)}")
+        self.unload_overflow(keep=chat_id)
+        return chat
+
+    def can_unload(self, chat_id):
+        chat = self.chats[chat_id]
+        if self.busy.get(chat_id) or not chat.is_idle():
+            return False
+        # Чат, у которого скоро откроется распределение, держим в памяти ради планировщика
+        wake = chat.next_scheduled()
+        return wake is None or wake - 2 * CHAT_WAKE_LEAD > self.chat_class.get_local_time()
+
+    def unload_overflow(self, keep=None):
+        """Выгружает самые давние из простаивающих чатов (кроме keep), пока загружено больше max_loaded"""
+        excess = len(self.chats) - self.max_loaded
+        if excess <= 0:
+            return
+        candidates = [chat_id for chat_id in self.chats if chat_id != keep and self.can_unload(chat_id)]
+        for chat_id in candidates[:excess]:
+            self.unload_chat(chat_id)
+
+    def unload_chat(self, chat_id):
+        chat = self.chats.pop(chat_id)
+        self.last_used.pop(chat_id, None)
+        chat.stop_tasks()
+        wake = chat.next_scheduled() if self.leader else None
+        if wake is not None:
+            self.wake_times[chat_id] = wake
+        task = self._unloading[chat_id] = asyncio.ensure_future(self._close_chat(chat_id, chat, wake is not None))
+        task.add_done_callback(
+            lambda _: self._unloading.pop(chat_id) if self._unloading.get(chat_id) is task else None
+        )
+
+    async def _close_chat(self, chat_id, chat, save_wake_times):
+        try:
+            await chat.journal.close()
+            if self._store_seen is not None:
+                # Файлы меняет и само закрытие - это не чужие изменения
+                self._store_seen[chat_id] = await asyncio.to_thread(self._store_signature, chat_id)
+            if save_wake_times:
+                await self.save_wake_times()
+        except Exception as e:
+            logging.error(f"Ошибка при выгрузке чата {chat_id}: {e}")
+        CHAT_SWAPS.labels('unload').inc()
+        logging.info(f"Чат {chat_id} выгружен на диск")
+
+    def _read_wake_times(self):
+        if not os.path.exists(self.wake_path):
+            return {}
+        with open(self.wake_path, encoding='utf-8') as f:
+            return {int(chat_id): datetime.datetime.fromisoformat(at) for chat_id, at in json.load(f).items()}
+
+    async def save_wake_times(self):
+        data = {str(chat_id): at.isoformat() for chat_id, at in self.wake_times.items()}
+
+        def write():
+            tmp_path = self.wake_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.wake_path)
+
+        async with self._wake_lock:
+            await asyncio.to_thread(write)
+
+    async def sweep(self):
+        """Выгружает простаивающие чаты и загружает те, у которых скоро событие расписания"""
+        now = time.monotonic()
+        for chat_id in list(self.chats):
+            if now - self.last_used[chat_id] > self.idle_timeout and self.can_unload(chat_id):
+                self.unload_chat(chat_id)
+        local_now = self.chat_class.get_local_time()
+        for chat_id, wake in list(self.wake_times.items()):
+            if wake - CHAT_WAKE_LEAD <= local_now and chat_id not in self.chats:
+                await self.get_chat(chat_id)
+
+    async def run_sweeper(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logging.error(f"Ошибка при выгрузке и загрузке чатов: {e}")
+            await asyncio.sleep(CHAT_SWEEP_INTERVAL)
+
+    def _store_signature(self, chat_id):
+        """Размеры и время изменения файлов общего хранилища чата (база и WAL)"""
+        path = self.journal_path(chat_id)
+        signature = []
+        for name in (path, path + '-wal'):
+            try:
+                stat = os.stat(name)
+            except FileNotFoundError:
+                continue
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def _store_signatures(self):
+        signatures = {}
+        for entry in os.scandir(self.state_dir):
+            name, ext = os.path.splitext(entry.name)
+            if ext == '.sqlite' and name.lstrip('-').isdigit():
+                signatures[int(name)] = self._store_signature(int(name))
+        return signatures
+
+    async def watch_stores(self):
+        """Лидер загружает чаты, в общие хранилища которых пишут другие процессы, и обновляет их доски"""
+        # У загруженных чатов изменения подтягивает их собственная синхронизация
+        signatures = await asyncio.to_thread(self._store_signatures)
+        if self._store_seen is None:
+            self._store_seen = signatures
+            return
+        for chat_id, signature in signatures.items():
+            if chat_id in self._unloading or chat_id in self._loading:
+                continue
+            changed = self._store_seen.get(chat_id) != signature
+            self._store_seen[chat_id] = signature
+            if changed and chat_id not in self.chats:
+                chat = await self.get_chat(chat_id)
+                chat.refresh_boards(self.bot)
+
+    async def run_store_watch(self):
+        while True:
+            try:
+                await self.watch_stores()
+            except Exception as e:
+                logging.error(f"Ошибка при проверке общих хранилищ чатов: {e}")
+            await asyncio.sleep(STORE_WATCH_INTERVAL)
+
+    async def post_init(self, application):
+        self.bot = application.bot
+        if self.outbox is not None:
+            self.outbox.start(application.bot)
+        register_metrics(
+            application, self.outbox, lambda: sum(len(chat.pending_claims) for chat in self.chats.values())
+        )
+        LOADED_CHATS.set_function(lambda: len(self.chats))
+        loop = asyncio.get_running_loop()
+        self._sweeper_task = loop.create_task(self.run_sweeper())
+        if self.shared and self.leader:
+            self._watch_task = loop.create_task(self.run_store_watch())
+        if self.metrics_address is not None:
+            self._metrics_server = await metrics.serve(*self.metrics_address)
+        if self.drain_backlog:
+            await drain_pending_updates(application, self)
+
+    async def post_stop(self, application):
+        if self.outbox is not None:
+            await self.outbox.stop()
+
+    async def drain_claims(self, updates, bot):
+        """Раздает накопившиеся заявки по состояниям их чатов; возвращает число занятых тем"""
+        by_chat = {}
+        for update in updates:
+            by_chat.setdefault(update.effective_chat.id, []).append(update)
+        won = 0
+        for chat_id, chat_updates in by_chat.items():
+            self.busy[chat_id] += 1
+            try:
+                chat = await self.get_chat(chat_id)
+                won += await chat.drain_claims(chat_updates, bot)
+            finally:
+                self.busy[chat_id] -= 1
+                if not self.busy[chat_id]:
+                    del self.busy[chat_id]
+        return won
+
+    async def post_shutdown(self, application):
+        if self._metrics_server is not None:
+            self._metrics_server.close()
+            self._metrics_server = None
+        for task in (self._sweeper_task, self._watch_task):
+            if task is not None:
+                task.cancel()
+        self._sweeper_task = self._watch_task = None
+        for chat_id in list(self.chats):
+            self.unload_chat(chat_id)
+        if self._unloading:
+            await asyncio.gather(*self._unloading.values())
+        if self.outbox is not None:
+            await self.outbox.stop()
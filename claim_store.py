@@ -0,0 +1,268 @@
+"""Общее хранилище состояния для нескольких процессов бота.
+
+SQLite в режиме WAL хранит предметы, занятые темы и ленту событий. Заявка
+на тему - атомарный compare-and-set: INSERT в claims с первичным ключом
+(предмет, тема). Если строка уже есть, заявка проигрывает и возвращается
+событие текущего владельца. Поэтому двойной захват темы невозможен даже
+при гонке между процессами: побеждает заявка, зафиксированная первой.
+Внутри процесса порядок заявок по-прежнему решает окно арбитража
+SeminarBot.claim_topic.
+
+Все изменения пишутся в ленту events в той же транзакции. Остальные
+процессы читают её по seq и применяют те же события, что и журнал
+одного процесса. Свои изменения процесс применяет сразу после коммита,
+поэтому /results в нем видит собственные записи (read-your-writes).
+"""
+import json
+import logging
+import sqlite3
+import threading
+
+from journal import Journal
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS subjects (
+    subject TEXT PRIMARY KEY,
+    topics TEXT NOT NULL,
+    start_time TEXT,
+    announce_chats TEXT NOT NULL DEFAULT '[]'
+);
+CREATE TABLE IF NOT EXISTS claims (
+    subject TEXT NOT NULL,
+    topic INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    username TEXT NOT NULL,
+    claimed_at TEXT NOT NULL,
+    PRIMARY KEY (subject, topic)
+);
+CREATE TABLE IF NOT EXISTS preference_modes (
+    subject TEXT PRIMARY KEY,
+    minutes INTEGER NOT NULL,
+    assigned INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS preferences (
+    subject TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    username TEXT NOT NULL,
+    topics TEXT NOT NULL,
+    submitted_at TEXT NOT NULL,
+    PRIMARY KEY (subject, user_id)
+);
+CREATE TABLE IF NOT EXISTS subscriptions (
+    subject TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    PRIMARY KEY (subject, user_id)
+);
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    event TEXT NOT NULL
+);
+'''
+
+
+class SharedStore(Journal):
+    """Хранилище в SQLite с тем же интерфейсом, что и Journal"""
+
+    shared = True
+
+    def __init__(self, path, keep_events=100_000, trim_every=1000):
+        super().__init__(path)
+        self.keep_events = keep_events
+        self.trim_every = trim_every
+        self.last_seq = 0
+        # seq событий, записанных этим процессом: он применил их у себя, poll их пропускает
+        self._own_seqs = set()
+        self._batches = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=FULL')
+        self._conn.executescript(SCHEMA)
+
+    def load(self):
+        """Текущее состояние из таблиц в формате снимка SeminarBot.export_state"""
+        with self._lock:
+            return self._read_state(), []
+
+    def _read_state(self):
+        conn = self._conn
+        conn.execute('BEGIN')
+        try:
+            state = {
+                'topics': {}, 'start_times': {}, 'registrations': {}, 'announce_chats': {},
+                'preference_windows': {}, 'preferences': {}, 'assigned': [], 'subscribers': {},
+            }
+            rows = conn.execute(
+                'SELECT subject, topics, start_time, announce_chats FROM subjects ORDER BY rowid'
+            )
+            for subject, topics, start_time, announce_chats in rows:
+                state['topics'][subject] = json.loads(topics)
+                if start_time:
+                    state['start_times'][subject] = start_time
+                state['announce_chats'][subject] = json.loads(announce_chats)
+                state['registrations'][subject] = []
+            rows = conn.execute('SELECT subject, topic, user_id, username, claimed_at FROM claims')
+            for subject, topic, user_id, username, claimed_at in rows:
+                state['registrations'].setdefault(subject, []).append(
+                    [topic, user_id, username, claimed_at]
+                )
+            for subject, minutes, assigned in conn.execute('SELECT subject, minutes, assigned FROM preference_modes'):
+                state['preference_windows'][subject] = minutes
+                if assigned:
+                    state['assigned'].append(subject)
+            rows = conn.execute('SELECT subject, user_id, username, topics, submitted_at FROM preferences')
+            for subject, user_id, username, topics, submitted_at in rows:
+                state['preferences'].setdefault(subject, []).append(
+                    [user_id, username, json.loads(topics), submitted_at]
+                )
+            for subject, user_id in conn.execute('SELECT subject, user_id FROM subscriptions'):
+                state['subscribers'].setdefault(subject, []).append(user_id)
+            self.last_seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM events').fetchone()[0]
+            self._own_seqs.clear()
+        finally:
+            conn.execute('COMMIT')
+        return state
+
+    def poll(self):
+        """Новые события других процессов (свои пропускаются): (снимок или None, события).
+
+        Если процесс отстал настолько, что его события уже вычищены из ленты,
+        вместо них возвращается полный снимок.
+        """
+        with self._lock:
+            min_seq = self._conn.execute('SELECT MIN(seq) FROM events').fetchone()[0]
+            if min_seq is not None and self.last_seq < min_seq - 1:
+                logging.warning("Лента событий ушла вперед, перечитываем состояние целиком")
+                return self._read_state(), []
+            rows = self._conn.execute(
+                'SELECT seq, event FROM events WHERE seq > ? ORDER BY seq', (self.last_seq,)
+            ).fetchall()
+            if rows:
+                self.last_seq = rows[-1][0]
+            events = [json.loads(event) for seq, event in rows if seq not in self._own_seqs]
+            self._own_seqs.difference_update(seq for seq, _ in rows)
+            return None, events
+
+    def _write_batch(self, batch):
+        """Одна транзакция на пачку: заявки через compare-and-set, остальное - обычной записью"""
+        results = []
+        with self._lock:
+            conn = self._conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                own_seqs = []
+                for event, is_claim in batch:
+                    if is_claim:
+                        results.append(self._claim(conn, event, own_seqs))
+                    else:
+                        self._apply(conn, event, own_seqs)
+                        results.append(None)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            self._own_seqs.update(own_seqs)
+
+            self._batches += 1
+            if self._batches % self.trim_every == 0:
+                conn.execute(
+                    'DELETE FROM events WHERE seq <= (SELECT MAX(seq) FROM events) - ?',
+                    (self.keep_events,)
+                )
+        return results
+
+    def _claim(self, conn, event, own_seqs):
+        cursor = conn.execute(
+            'INSERT INTO claims (subject, topic, user_id, username, claimed_at) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT (subject, topic) DO NOTHING',
+            (event['subject'], event['topic'], event['user_id'], event['username'], event['at'])
+        )
+        if cursor.rowcount == 1:
+            own_seqs.append(self._log(conn, event))
+            return event
+        user_id, username, claimed_at = conn.execute(
+            'SELECT user_id, username, claimed_at FROM claims WHERE subject = ? AND topic = ?',
+            (event['subject'], event['topic'])
+        ).fetchone()
+        return {
+            'op': 'claim', 'subject': event['subject'], 'topic': event['topic'],
+            'user_id': user_id, 'username': username, 'at': claimed_at,
+        }
+
+    def _apply(self, conn, event, own_seqs):
+        op = event['op']
+        subject = event['subject']
+        if op == 'subject':
+            conn.execute(
+                'INSERT INTO subjects (subject, topics) VALUES (?, ?) '
+                'ON CONFLICT (subject) DO UPDATE SET topics = excluded.topics',
+                (subject, json.dumps(event['topics'], ensure_ascii=False))
+            )
+            conn.execute('DELETE FROM claims WHERE subject = ?', (subject,))
+            conn.execute('DELETE FROM preferences WHERE subject = ?', (subject,))
+            conn.execute('UPDATE preference_modes SET assigned = 0 WHERE subject = ?', (subject,))
+        elif op == 'start_time':
+            conn.execute('UPDATE subjects SET start_time = ? WHERE subject = ?', (event['at'], subject))
+        elif op == 'release':
+            cursor = conn.execute(
+                'DELETE FROM claims WHERE subject = ? AND topic = ? AND user_id = ?',
+                (subject, event['topic'], event['user_id'])
+            )
+            if cursor.rowcount == 0:
+                # Тему уже освободили или заняли заново в другом процессе
+                return
+        elif op == 'preference_mode':
+            if event['minutes']:
+                conn.execute(
+                    'INSERT INTO preference_modes (subject, minutes) VALUES (?, ?) '
+                    'ON CONFLICT (subject) DO UPDATE SET minutes = excluded.minutes',
+                    (subject, event['minutes'])
+                )
+            else:
+                conn.execute('DELETE FROM preference_modes WHERE subject = ?', (subject,))
+                conn.execute('DELETE FROM preferences WHERE subject = ?', (subject,))
+        elif op == 'preferences':
+            conn.execute(
+                'INSERT OR REPLACE INTO preferences (subject, user_id, username, topics, submitted_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (subject, event['user_id'], event['username'], json.dumps(event['topics']), event['at'])
+            )
+        elif op == 'assigned':
+            conn.execute('UPDATE preference_modes SET assigned = 1 WHERE subject = ?', (subject,))
+            conn.execute('DELETE FROM preferences WHERE subject = ?', (subject,))
+        elif op == 'subscribe':
+            conn.execute(
+                'INSERT OR IGNORE INTO subscriptions (subject, user_id) VALUES (?, ?)', (subject, event['user_id'])
+            )
+        elif op == 'unsubscribe':
+            conn.execute(
+                'DELETE FROM subscriptions WHERE subject = ? AND user_id = ?', (subject, event['user_id'])
+            )
+        if event.get('chat_id') is not None:
+            row = conn.execute(
+                'SELECT announce_chats FROM subjects WHERE subject = ?', (subject,)
+            ).fetchone()
+            if row is not None:
+                chats = set(json.loads(row[0]))
+                chats.add(event['chat_id'])
+                conn.execute(
+                    'UPDATE subjects SET announce_chats = ? WHERE subject = ?',
+                    (json.dumps(sorted(chats)), subject)
+                )
+        own_seqs.append(self._log(conn, event))
+
+    @staticmethod
+    def _log(conn, event):
+        """Добавляет событие в ленту; возвращает его seq"""
+        cursor = conn.execute('INSERT INTO events (event) VALUES (?)', (json.dumps(event, ensure_ascii=False),))
+        return cursor.lastrowid
+
+    async def compact(self):
+        # Снимки не нужны: таблицы и так хранят текущее состояние, а ленту чистит _write_batch
+        self.events_since_snapshot = 0
+
+    async def close(self):
+        if self._flusher is not None:
+            await self._flusher
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,164 @@
+"""Компактное хранение тем и заявок одного предмета.
+
+Вместо словаря {номер: название} и словаря {номер: (user_id, username,
+datetime)} с кортежем и datetime на каждую заявку предмет хранит один
+общий индекс «номер темы -> позиция» и по позиции - плоские массивы:
+названия тем, user_id, время выбора в микросекундах от эпохи и флаг
+занятости. Имена пользователей интернируются, поэтому участник, выбравший
+темы в нескольких предметах, хранится одной строкой.
+
+Наружу обе таблицы выглядят как обычные словари с прежними значениями,
+так что код бота обращается к ним так же, как раньше.
+"""
+import bisect
+import datetime
+import sys
+from array import array
+from collections.abc import Mapping, MutableMapping
+
+# Время заявок хранится как наивное московское время, отсчитанное от этой точки
+EPOCH = datetime.datetime(1970, 1, 1)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def to_micros(timestamp):
+    return (timestamp - EPOCH) // MICROSECOND
+
+
+class TopicTable(Mapping):
+    """Темы предмета: номер -> название, в порядке добавления"""
+
+    __slots__ = ('index', 'titles')
+
+    def __init__(self, items=()):
+        self.index = {}
+        self.titles = []
+        for number, title in items:
+            if number in self.index:
+                self.titles[self.index[number]] = title
+                continue
+            self.index[number] = len(self.titles)
+            self.titles.append(title)
+
+    def __getitem__(self, number):
+        return self.titles[self.index[number]]
+
+    def __contains__(self, number):
+        return number in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({list(self.items())!r})"
+
+
+class ClaimTable(MutableMapping):
+    """Заявки предмета: номер темы -> (user_id, username, datetime).
+
+    Места в массивах заранее выделены под все темы по общему с TopicTable
+    индексу; заявка на тему вне индекса - KeyError.
+    """
+
+    __slots__ = ('index', 'taken', 'user_ids', 'usernames', 'times', 'count')
+
+    def __init__(self, index):
+        size = len(index)
+        self.index = index
+        self.taken = bytearray(size)
+        self.user_ids = array('q', bytes(8 * size))
+        self.usernames = [None] * size
+        self.times = array('q', bytes(8 * size))
+        self.count = 0
+
+    def __getitem__(self, number):
+        position = self.index[number]
+        if not self.taken[position]:
+            raise KeyError(number)
+        return (
+            self.user_ids[position],
+            self.usernames[position],
+            EPOCH + self.times[position] * MICROSECOND,
+        )
+
+    def __contains__(self, number):
+        position = self.index.get(number)
+        return position is not None and bool(self.taken[position])
+
+    def __setitem__(self, number, value):
+        user_id, username, timestamp = value
+        position = self.index[number]
+        if not self.taken[position]:
+            self.taken[position] = 1
+            self.count += 1
+        self.user_ids[position] = user_id
+        self.usernames[position] = sys.intern(username)
+        self.times[position] = to_micros(timestamp)
+
+    def __delitem__(self, number):
+        position = self.index[number]
+        if not self.taken[position]:
+            raise KeyError(number)
+        self.taken[position] = 0
+        self.usernames[position] = None
+        self.count -= 1
+
+    def __iter__(self):
+        taken = self.taken
+        return (number for number, position in self.index.items() if taken[position])
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self.items())!r})"
+
+    def timestamp_key(self, number):
+        """Время выбора темы в микросекундах от эпохи - для сортировки без datetime"""
+        return self.times[self.index[number]]
+
+
+class ClaimOrder:
+    """Темы предмета в порядке времени выбора: два параллельных массива (время, тема).
+
+    При равном времени темы идут в порядке добавления.
+    """
+
+    __slots__ = ('times', 'topics')
+
+    def __init__(self, entries=()):
+        self.times = array('q')
+        self.topics = array('q')
+        for micros, topic_number in sorted(entries):
+            self.times.append(micros)
+            self.topics.append(topic_number)
+
+    def add(self, micros, topic_number):
+        """Вставляет тему и возвращает ее позицию"""
+        i = bisect.bisect_right(self.times, micros)
+        self.times.insert(i, micros)
+        self.topics.insert(i, topic_number)
+        return i
+
+    def remove(self, micros, topic_number):
+        """Удаляет тему и возвращает ее бывшую позицию или None, если ее не было"""
+        i = bisect.bisect_left(self.times, micros)
+        while i < len(self.times) and self.times[i] == micros:
+            if self.topics[i] == topic_number:
+                del self.times[i]
+                del self.topics[i]
+                return i
+            i += 1
+        return None
+
+    def __len__(self):
+        return len(self.topics)
+
+    def __iter__(self):
+        return iter(self.topics)
+
+    def __getitem__(self, item):
+        return self.topics[item]
@@ -0,0 +1,421 @@
+"""Заглушка Telegram Bot API для нагрузочных тестов всего HTTP-пути.
+
+Бот запускается как обычно (long polling или вебхук), только его
+Application.builder() направлен сюда через base_url (BOT_API_URL).
+Сервер сам порождает поток обновлений: в каждом чате администратор
+заводит предмет, а через setup_delay секунд тысячи студентов начинают
+присылать номера тем (или нажимать кнопки) с заданной суммарной
+частотой. Каждому вызову Bot API можно добавить задержку, часть
+отправок - отклонить ответом 429, а все вызовы записываются. По ответам
+бота считаются задержка «обновление -> ответ», пропускная способность
+и честность: досталась ли тема тому, кто первым ее попросил.
+
+Запуск:
+    python fake_bot_api.py --students 2000 --chats 4 --topics 60 --rate 400 --latency 0.02
+    BOT_API_URL=http://127.0.0.1:8081/bot BOT_TOKEN=123456:FAKE python gspd.py
+
+Сводка печатается по Ctrl+C и доступна в JSON на GET /_stats.
+"""
+import argparse
+import collections
+import json
+import logging
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask, jsonify, request
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'SeminarBot', 'username': 'seminar_bot'}
+SUBJECT = 'Нагрузочный тест'
+# Параметры, которые PTB передает строкой без JSON-кодирования
+STRING_PARAMS = {'text', 'caption', 'callback_query_id', 'url', 'secret_token', 'parse_mode', 'file_name'}
+# Отправки, которые учитываются в лимитах и могут получить 429
+SEND_METHODS = {'sendMessage', 'editMessageText', 'sendDocument', 'answerCallbackQuery'}
+TOPIC_RE = re.compile(r'📖 (\d+)\.')
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q / 100))]
+
+
+class UpdateStream:
+    """Расписание обновлений: (секунды от подключения бота, chat_id, пользователь, текст или кнопка)"""
+
+    def __init__(self, students=1000, chats=1, topics=40, rate=200.0, skew=1.0, buttons=False,
+                 setup_delay=3.0, seed=1):
+        rng = random.Random(seed)
+        self.events = []
+        chat_ids = [-1001000000000 - i for i in range(chats)]
+        subject_id = format(zlib.crc32(SUBJECT.encode('utf-8')), 'x')
+        topics_list = "\n".join(f"{n}. Тема {n}" for n in range(1, topics + 1))
+        for i, chat_id in enumerate(chat_ids):
+            admin = self.user(1000 + i)
+            for step, text in enumerate(('/new_subject', SUBJECT, topics_list)):
+                self.events.append((0.2 * step, chat_id, admin, text, None))
+
+        weights = [1 / (rank + 1) ** skew for rank in range(topics)]
+        at = setup_delay
+        for i in range(students):
+            # Пуассоновский поток заявок суммарной частоты rate
+            at += rng.expovariate(rate)
+            topic = rng.choices(range(1, topics + 1), weights=weights)[0]
+            chat_id = chat_ids[i % chats]
+            if buttons:
+                self.events.append((at, chat_id, self.user(100_000 + i), None, f"c|{subject_id}|{topic}"))
+            else:
+                self.events.append((at, chat_id, self.user(100_000 + i), str(topic), None))
+        self.events.sort(key=lambda event: event[0])
+
+    @staticmethod
+    def user(user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f'Student{user_id}', 'username': f'student{user_id}'}
+
+
+class FakeBotApi:
+    """Состояние заглушки: выданные обновления, отправленные сообщения, журнал вызовов"""
+
+    def __init__(self, stream, latency=0.0, error_rate=0.0, retry_after=1, chat_rate=None,
+                 global_rate=None, record_path=None, seed=1):
+        self.stream = stream
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        # Лимиты Telegram (сообщений в секунду); None - не проверять
+        self.chat_rate = chat_rate
+        self.global_rate = global_rate
+        self.rng = random.Random(seed)
+        self.record_file = open(record_path, 'a', encoding='utf-8') if record_path else None
+        self.lock = threading.Lock()
+        self.new_updates = threading.Condition(self.lock)
+        self.started = None
+        self.next_event = 0
+        self.updates = []
+        self.update_id = 0
+        self.message_ids = collections.Counter()
+        # Что и когда выдано боту: (chat_id, message_id) или id нажатия -> (время, chat_id, user_id, номер темы),
+        # и кто в каком порядке просил каждую тему: (chat_id, тема) -> [user_id]
+        self.delivered = {}
+        self.claim_order = collections.defaultdict(list)
+        self.calls = []
+        self.counts = collections.Counter()
+        self.rejected = collections.Counter()
+        self.sent_times = collections.defaultdict(collections.deque)
+        self.webhook = None
+
+    def start_clock(self):
+        if self.started is None:
+            self.started = time.monotonic()
+            logging.info("Бот подключился, поток обновлений запущен")
+
+    def release_due(self):
+        """Превращает наступившие события расписания в обновления; вызывается под lock"""
+        if self.started is None:
+            return
+        now = time.monotonic()
+        events = self.stream.events
+        released = False
+        while self.next_event < len(events) and events[self.next_event][0] <= now - self.started:
+            _, chat_id, user, text, data = events[self.next_event]
+            self.next_event += 1
+            self.updates.append(self.make_update(chat_id, user, text, data, now))
+            released = True
+        if released:
+            self.new_updates.notify_all()
+
+    def make_update(self, chat_id, user, text, data, now):
+        self.update_id += 1
+        chat = {'id': chat_id, 'type': 'supergroup', 'title': f'Группа {-chat_id % 1000}'}
+        if data is not None:
+            query_id = str(self.update_id)
+            topic = int(data.rsplit('|', 1)[1])
+            self.delivered[query_id] = (now, chat_id, user['id'], topic)
+            self.claim_order[(chat_id, topic)].append(user['id'])
+            return {'update_id': self.update_id, 'callback_query': {
+                'id': query_id, 'from': user, 'chat_instance': str(chat_id), 'data': data,
+                'message': {'message_id': 1, 'date': int(time.time()), 'chat': chat, 'from': BOT_USER, 'text': ''},
+            }}
+        self.message_ids[chat_id] += 1
+        message_id = self.message_ids[chat_id]
+        message = {'message_id': message_id, 'date': int(time.time()), 'chat': chat, 'from': user, 'text': text}
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+        topic = int(text) if text.isdigit() else None
+        self.delivered[(chat_id, message_id)] = (now, chat_id, user['id'], topic)
+        if topic is not None:
+            self.claim_order[(chat_id, topic)].append(user['id'])
+        return {'update_id': self.update_id, 'message': message}
+
+    def get_updates(self, offset, limit, timeout):
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            self.start_clock()
+            if offset:
+                # Как в Telegram: offset подтверждает все обновления до него
+                self.updates = [update for update in self.updates if update['update_id'] >= offset]
+            while True:
+                self.release_due()
+                if self.updates or time.monotonic() >= deadline:
+                    return self.updates[:limit]
+                # Ждем новых обновлений, но не дольше, чем до следующего события расписания
+                wait = deadline - time.monotonic()
+                if self.next_event < len(self.stream.events):
+                    wait = min(wait, self.stream.events[self.next_event][0] - (time.monotonic() - self.started))
+                self.new_updates.wait(max(wait, 0.001))
+
+    def should_reject(self, method, chat_id):
+        """Решает, ответить ли на отправку 429; вызывается под lock"""
+        if method not in SEND_METHODS:
+            return False
+        if self.error_rate and self.rng.random() < self.error_rate:
+            return True
+        now = time.monotonic()
+        for key, rate in ((chat_id, self.chat_rate), ('*', self.global_rate)):
+            if rate is None or key is None:
+                continue
+            sent = self.sent_times[key]
+            while sent and sent[0] <= now - 1:
+                sent.popleft()
+            if len(sent) >= rate:
+                return True
+        for key in (chat_id, '*'):
+            if key is not None:
+                self.sent_times[key].append(now)
+        return False
+
+    def call(self, method, params, files):
+        if self.latency:
+            time.sleep(self.latency)
+        chat_id = params.get('chat_id')
+        with self.lock:
+            now = time.monotonic()
+            if self.should_reject(method, chat_id):
+                self.rejected[method] += 1
+                self.record(now, method, params, files, 429)
+                return 429, {
+                    'ok': False, 'error_code': 429,
+                    'description': f"Too Many Requests: retry after {self.retry_after}",
+                    'parameters': {'retry_after': self.retry_after},
+                }
+            self.counts[method] += 1
+            self.record(now, method, params, files, 200)
+            result = self.result(method, params, files)
+        return 200, {'ok': True, 'result': result}
+
+    def record(self, now, method, params, files, status):
+        entry = {'t': now, 'method': method, 'params': params, 'status': status}
+        if files:
+            entry['files'] = files
+        self.calls.append(entry)
+        if self.record_file is not None:
+            self.record_file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def result(self, method, params, files):
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getChatAdministrators':
+            admin = UpdateStream.user(1000 + (-1001000000000 - params['chat_id']))
+            return [{'status': 'creator', 'user': admin, 'is_anonymous': False}]
+        if method == 'setWebhook':
+            self.webhook = (params['url'], params.get('secret_token'), params.get('max_connections', 40))
+            self.start_clock()
+            return True
+        if method == 'deleteWebhook':
+            self.webhook = None
+            return True
+        if method in ('sendMessage', 'editMessageText', 'sendDocument'):
+            chat_id = params['chat_id']
+            message_id = params.get('message_id')
+            if message_id is None:
+                self.message_ids[chat_id] += 1
+                message_id = self.message_ids[chat_id]
+            message = {
+                'message_id': message_id, 'date': int(time.time()), 'from': BOT_USER,
+                'chat': {'id': chat_id, 'type': 'supergroup' if chat_id < 0 else 'private'},
+            }
+            if method == 'sendDocument':
+                name = files.get('document', {}).get('filename', 'document')
+                message['document'] = {'file_id': f'doc{message_id}', 'file_unique_id': f'doc{message_id}',
+                                       'file_name': name}
+            else:
+                message['text'] = params.get('text', '')
+            return message
+        return True
+
+    def summary(self):
+        """Задержки ответов, пропускная способность и честность по записанным вызовам"""
+        with self.lock:
+            calls = list(self.calls)
+            delivered = dict(self.delivered)
+            claim_order = {key: list(users) for key, users in self.claim_order.items()}
+            counts, rejected = dict(self.counts), dict(self.rejected)
+            updates_released = self.update_id
+        latencies, winners = [], {}
+        for call in calls:
+            if call['status'] != 200:
+                continue
+            params = call['params']
+            if call['method'] == 'answerCallbackQuery':
+                source = delivered.get(params.get('callback_query_id'))
+            elif call['method'] == 'sendMessage':
+                reply_to = (params.get('reply_parameters') or {}).get('message_id') or params.get('reply_to_message_id')
+                source = delivered.get((params.get('chat_id'), reply_to))
+            else:
+                continue
+            if source is None:
+                continue
+            delivered_at, chat_id, user_id, topic = source
+            latencies.append((call['t'] - delivered_at) * 1000)
+            text = params.get('text', '')
+            if topic is not None and '🎉' in text and TOPIC_RE.search(text):
+                winners[(chat_id, topic)] = user_id
+        # Тема должна достаться тому, кто первым ее попросил
+        unfair = sum(1 for key, user_id in winners.items() if claim_order[key][0] != user_id)
+        claim_times = [delivered_at for delivered_at, _, _, topic in delivered.values() if topic is not None]
+        span = max((call['t'] for call in calls), default=0) - min(claim_times, default=0)
+        return {
+            'updates': updates_released,
+            'calls': counts,
+            'rejected_429': rejected,
+            'answered': len(latencies),
+            'throughput_per_s': round(len(latencies) / span, 1) if span > 0 else 0.0,
+            'latency_ms': {f'p{q}': round(percentile(latencies, q), 1) for q in (50, 95, 99)},
+            'topics_won': len(winners),
+            'unfair': unfair,
+        }
+
+    def push_webhook(self, stop):
+        """В режиме вебхука сам отправляет обновления боту, как Telegram"""
+        pool = None
+        while not stop.is_set():
+            with self.lock:
+                self.release_due()
+                webhook = self.webhook
+                batch, self.updates = (self.updates, []) if webhook else ([], self.updates)
+                if not batch:
+                    self.new_updates.wait(0.05)
+                    continue
+            url, secret, connections = webhook
+            if pool is None:
+                pool = ThreadPoolExecutor(max_workers=connections)
+            for update in batch:
+                pool.submit(self.post_update, url, secret, update)
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    def post_update(self, url, secret, update):
+        headers = {'Content-Type': 'application/json'}
+        if secret:
+            headers['X-Telegram-Bot-Api-Secret-Token'] = secret
+        data = json.dumps(update, ensure_ascii=False).encode('utf-8')
+        for attempt in range(5):
+            try:
+                with urllib.request.urlopen(urllib.request.Request(url, data, headers), timeout=30):
+                    return
+            except (urllib.error.URLError, OSError) as e:
+                logging.warning(f"Вебхук не принял обновление {update['update_id']}: {e}")
+                time.sleep(2 ** attempt)
+
+
+def parse_params(form):
+    params = {}
+    for key, value in form.items():
+        if key in STRING_PARAMS:
+            params[key] = value
+            continue
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return params
+
+
+def create_app(api):
+    app = Flask(__name__)
+
+    @app.route('/bot<token>/<method>', methods=['GET', 'POST'])
+    def bot_method(token, method):
+        params = parse_params(request.values)
+        if request.is_json:
+            params.update(request.get_json(silent=True) or {})
+        files = {name: {'filename': file.filename, 'size': len(file.read())} for name, file in request.files.items()}
+        if method == 'getUpdates':
+            with api.lock:
+                api.counts[method] += 1
+            updates = api.get_updates(params.get('offset'), params.get('limit', 100), params.get('timeout', 0))
+            return jsonify({'ok': True, 'result': updates})
+        status, body = api.call(method, params, files)
+        return jsonify(body), status
+
+    @app.route('/_stats')
+    def stats():
+        return jsonify(api.summary())
+
+    return app
+
+
+class KeepAliveHandler(WSGIRequestHandler):
+    # Как у настоящего Bot API: соединения не закрываются после каждого ответа
+    protocol_version = 'HTTP/1.1'
+
+
+def make_api_server(api, host='127.0.0.1', port=0):
+    """Многопоточный HTTP-сервер заглушки; порт 0 - любой свободный (server.server_port)"""
+    return make_server(host, port, create_app(api), threaded=True, request_handler=KeepAliveHandler)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Заглушка Telegram Bot API для нагрузочных тестов")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--students', type=int, default=1000, help="число студентов")
+    parser.add_argument('--chats', type=int, default=1, help="число групп, между которыми они делятся")
+    parser.add_argument('--topics', type=int, default=40, help="тем в предмете каждой группы")
+    parser.add_argument('--rate', type=float, default=200.0, help="суммарная частота заявок, в секунду")
+    parser.add_argument('--skew', type=float, default=1.0, help="перекос популярности тем (0 - равномерно)")
+    parser.add_argument('--buttons', action='store_true', help="заявки кнопками, а не номерами")
+    parser.add_argument('--setup-delay', type=float, default=3.0,
+                        help="через сколько секунд после подключения бота начинаются заявки")
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка каждого вызова Bot API, с")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="доля отправок, получающих 429")
+    parser.add_argument('--retry-after', type=int, default=1, help="retry_after в ответах 429, с")
+    parser.add_argument('--chat-rate', type=float, default=None, help="лимит отправок в один чат в секунду")
+    parser.add_argument('--global-rate', type=float, default=None, help="общий лимит отправок в секунду")
+    parser.add_argument('--record', default=None, help="дописывать все вызовы в этот JSONL-файл")
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args(argv)
+
+
+def main(args):
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    stream = UpdateStream(args.students, args.chats, args.topics, args.rate, args.skew, args.buttons,
+                          args.setup_delay, args.seed)
+    api = FakeBotApi(stream, args.latency, args.error_rate, args.retry_after, args.chat_rate,
+                     args.global_rate, args.record, args.seed)
+    server = make_api_server(api, args.host, args.port)
+    stop = threading.Event()
+    pusher = threading.Thread(target=api.push_webhook, args=(stop,), name='webhook-pusher', daemon=True)
+    pusher.start()
+    logging.info(f"Bot API: http://{args.host}:{args.port}/bot, обновлений в расписании: {len(stream.events)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+        print(json.dumps(api.summary(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -1,10 +1,46 @@
 import logging
 import os
 import asyncio
-from telegram import Update, ReplyKeyboardRemove
-from telegram.ext import Application, CommandHandler, MessageHandler, ContextTypes, filters, ConversationHandler
+from telegram import (
+    Chat, InlineKeyboardButton, InlineKeyboardMarkup, Message, ReplyKeyboardRemove, ReplyParameters,
+    Update
+)
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
+from telegram.ext import (
+    Application, CallbackQueryHandler, CommandHandler, MessageHandler, ContextTypes, TypeHandler, filters,
+    ConversationHandler
+)
+import bisect
+import collections
+import csv
 import datetime
+import heapq
+import importlib.util
+import io
+import itertools
 import re
+import sys
+import tempfile
+import time
+import zlib
+
+import metrics
+import profiling
+from assignment import assign
+from backlog import drain_pending_updates
+from chat_router import CHAT_IDLE_TIMEOUT, MAX_LOADED_CHATS, ChatRouter
+from claim_store import SharedStore
+from claim_table import ClaimOrder, ClaimTable, TopicTable, to_micros
+from journal import Journal
+from outbox import PRIORITY_BOARD, PRIORITY_BULK, PRIORITY_CLAIM, PRIORITY_REPLY, Outbox
+from persistence import SQLitePersistence
+from profiling import TRACER, TracedRequest
+from throttle import CLAIM_FILTER, ClaimThrottle
+from topic_import import parse_topic_rows, parse_topics_file, text_topic_rows
+from update_processing import (
+    HANDLER_LATENCY, PerUserUpdateProcessor, instrument_handlers, received_at, register_metrics, user_lock_released,
+)
 
 # Настройка логирования
 logging.basicConfig(
@@ -24,17 +60,529 @@ logging.basicConfig(
     SELECTING_TOPIC_FOR_REMOVAL
 ) = range(8)
 
+# Сколько секунд собираются почти одновременные заявки на одну тему перед выбором победителя
+ARBITRATION_WINDOW = 0.3
+# Живая доска тем редактируется не чаще одного раза за столько секунд
+BOARD_UPDATE_INTERVAL = 1.0
+# За сколько до начала распределения отправляется напоминание
+REMINDER_LEAD = datetime.timedelta(minutes=5)
+# Как часто процесс подтягивает изменения других процессов из общего хранилища, с
+SYNC_INTERVAL = 0.2
+# Сколько свободных тем показывать в /free по одному предмету
+FREE_LIST_LIMIT = 50
+# Сколько тем (или результатов) на одной странице доски и сколько предметов на странице списка
+PAGE_SIZE = 20
+SUBJECTS_PAGE_SIZE = 10
+# Кнопок выбора темы в одном ряду клавиатуры доски
+CLAIM_BUTTONS_PER_ROW = 5
+# Предел длины текста во всплывающем ответе на нажатие кнопки
+CALLBACK_ANSWER_LIMIT = 200
+# Длинные названия тем на досках обрезаются, чтобы страница гарантированно влезла в сообщение
+TOPIC_TITLE_LIMIT = 120
+# Предел длины сообщения Telegram
+MESSAGE_LIMIT = 4096
+# Бот может скачать файл не больше 20 МБ; сколько ошибок разбора показывать в отчете
+MAX_IMPORT_SIZE = 20 * 1024 * 1024
+IMPORT_ERRORS_SHOWN = 20
+# Столбцы выгрузки результатов; разделитель ';' - его ожидает Excel с русской локалью
+EXPORT_COLUMNS = ('Предмет', 'Номер', 'Тема', 'Участник', 'ID', 'Время выбора')
+EXPORT_DELIMITER = ';'
+# Пул соединений и таймауты (секунды) клиентов Bot API по умолчанию. Пул отправки рассчитан на
+# одновременные обработчики (CONCURRENT_UPDATES) и отправки очереди исходящих; ждать свободного
+# соединения дольше POOL_TIMEOUT бессмысленно - ответ все равно опоздает
+HTTP_SEND_DEFAULTS = {
+    'POOL_SIZE': '128', 'CONNECT_TIMEOUT': '5', 'READ_TIMEOUT': '10', 'WRITE_TIMEOUT': '10',
+    'POOL_TIMEOUT': '3', 'HTTP_VERSION': '1.1',
+}
+# Длинному опросу хватает одного соединения; к READ_TIMEOUT PTB сам добавляет timeout опроса
+HTTP_UPDATES_DEFAULTS = {
+    'POOL_SIZE': '2', 'CONNECT_TIMEOUT': '5', 'READ_TIMEOUT': '5', 'WRITE_TIMEOUT': '5',
+    'POOL_TIMEOUT': '5', 'HTTP_VERSION': '1.1',
+}
+# Сколько тем в порядке желания принимает /prefer
+PREFERENCE_LIMIT = 5
+# Уведомления подписчикам уходят пачками: следующая - после того, как отправлена предыдущая.
+# Без очереди исходящих пачки выравниваются по BROADCAST_RATE, а на 429 сообщение
+# повторяется не больше BROADCAST_RETRIES раз
+BROADCAST_BATCH_SIZE = 20
+BROADCAST_RATE = 20.0
+BROADCAST_RETRIES = 3
+# События, после которых доска предмета выглядит иначе
+BOARD_EVENTS = {'subject', 'start_time', 'claim', 'release', 'preference_mode', 'assigned'}
+# Сколько секунд верить списку администраторов чата
+CHAT_ADMINS_TTL = 10 * 60
+
+# Профилирование по /profile: длительность по умолчанию и предел, секунды
+PROFILE_SECONDS = 10
+PROFILE_MAX_SECONDS = 300
+
+# Метрики (см. metrics.py и METRICS_PORT в build_application)
+CLAIMS = metrics.Counter('seminar_claims_total', 'Заявки на темы по исходу арбитража', ['result'])
+CONFLICTS = metrics.Counter('seminar_conflicts_total', 'Ответы «Эта тема уже занята!»')
+BROADCAST_MESSAGES = metrics.Counter(
+    'seminar_broadcast_messages_total', 'Уведомления подписчикам по исходу', ['result']
+)
+BROADCAST_PENDING = metrics.Gauge('seminar_broadcast_pending', 'Уведомления подписчикам, которые еще не отправлены')
+ASSIGNMENT_LATENCY = metrics.Histogram(
+    'seminar_assignment_seconds', 'Время пакетного распределения тем по пожеланиям',
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+SEND_FAILURES = metrics.Counter(
+    'seminar_send_failures_total', 'Неудачные вызовы Bot API вне очереди исходящих', ['method']
+)
+
+
+class LiveBoard:
+    """Сообщение с доской тем в чате, которое редактируется вместо отправки новых"""
+
+    def __init__(self, subject, chat_id):
+        self.subject = subject
+        self.chat_id = chat_id
+        self.message_id = None
+        self.page = 0
+        self.text = None
+        self.dirty = False
+        self.task = None
+        self.last_update = float('-inf')
+
+
 class SeminarBot:
-    def __init__(self):
+    def __init__(self, arbitration_window=ARBITRATION_WINDOW, journal=None,
+                 board_update_interval=BOARD_UPDATE_INTERVAL, outbox=None, leader=True,
+                 sync_interval=SYNC_INTERVAL, metrics_address=None, chat_id=None, drain_backlog=False):
         self.topics = {}
         self.registrations = {}
         self.start_times = {}
         self.admin_id = 1074399585
+        # Чат, которому принадлежит состояние (None - одно состояние на все чаты),
+        # и кэш его администраторов из Telegram: (множество user_id, когда получено)
+        self.chat_id = chat_id
+        self.chat_admins = None
+        # Разобрать накопившиеся за время простоя обновления до начала опроса
+        self.drain_backlog = drain_backlog
+        self.arbitration_window = arbitration_window
+        # Критические секции по предметам и заявки, ожидающие арбитража: (предмет, тема) -> список
+        self.subject_locks = {}
+        self.pending_claims = {}
+        # Нерешенная заявка участника: (предмет, user_id) -> future с итогом
+        self.user_pending_claims = {}
+        # Журнал изменений для восстановления после перезапуска (None - только в памяти)
+        self.journal = journal
+        # Живые доски: предмет -> {chat_id: LiveBoard}
+        self.live_boards = {}
+        self.board_update_interval = board_update_interval
+        # Очередь исходящих с лимитами Telegram (None - отправлять напрямую)
+        self.outbox = outbox
+        # При нескольких процессах живые доски и напоминания ведет только один из них
+        self.leader = leader
+        self.sync_interval = sync_interval
+        self._sync_task = None
+        # (хост, порт) HTTP-сервера метрик; None - не запускать
+        self.metrics_address = metrics_address
+        self._metrics_server = None
+        # Активные предметы в порядке self.topics и куча отложенных событий (время, №, вид, предмет, начало)
+        self.active_subjects = []
+        self._active_set = set()
+        self._schedule = []
+        self._scheduled = set()
+        self._schedule_seq = itertools.count()
+        self._schedule_wakeup = asyncio.Event()
+        self._scheduler_task = None
+        # Чаты, куда отправляются напоминания по предмету
+        self.announce_chats = {}
+        # Отсортированные номера свободных тем по предметам
+        self.free_topics = {}
+        # Для страниц досок: темы в порядке времени выбора (ClaimOrder),
+        # кэш текста страниц {(вид, страница): текст} и короткие id предметов для кнопок (в обе стороны)
+        self.results_order = {}
+        self.page_cache = {}
+        self.subject_ids = {}
+        self.subject_id_by_name = {}
+        # Версии предметов растут при каждом изменении (state_version - при изменении любого);
+        # готовые страницы с клавиатурами: (вид, ...) -> (версия, результат)
+        self.versions = {}
+        self.state_version = 0
+        self.render_cache = {}
+        # Обратный индекс заявок: user_id -> {предмет: номер темы}; у участника одна тема на предмет
+        self.user_claims = {}
+        # Режим пожеланий: предмет -> длительность сбора от start_times; пожелания
+        # {user_id: (username, темы по порядку, время подачи)} и предметы, уже распределенные разом
+        self.preference_windows = {}
+        self.preferences = {}
+        self.assigned_subjects = set()
+        # Подписчики предметов (user_id) и идущие рассылки им
+        self.subscribers = {}
+        self._broadcasts = set()
+        # Задачи /profile, которые пришлют отчет по окончании
+        self._reports = set()
+        if journal is not None:
+            journal.snapshot_provider = self.export_state
+
+    def export_state(self):
+        """Состояние в виде JSON-совместимого словаря для снимка журнала"""
+        return {
+            'topics': {subject: list(topics.items()) for subject, topics in self.topics.items()},
+            'start_times': {subject: start.isoformat() for subject, start in self.start_times.items()},
+            'registrations': {
+                subject: [[num, user_id, username, timestamp.isoformat()]
+                          for num, (user_id, username, timestamp) in regs.items()]
+                for subject, regs in self.registrations.items()
+            },
+            'announce_chats': {subject: sorted(chats) for subject, chats in self.announce_chats.items()},
+            'preference_windows': {
+                subject: window // datetime.timedelta(minutes=1) for subject, window in self.preference_windows.items()
+            },
+            'preferences': {
+                subject: [[user_id, username, list(topics), submitted.isoformat()]
+                          for user_id, (username, topics, submitted) in wishes.items()]
+                for subject, wishes in self.preferences.items()
+            },
+            'assigned': sorted(self.assigned_subjects),
+            'subscribers': {subject: sorted(users) for subject, users in self.subscribers.items()},
+        }
+
+    def restore(self):
+        """Восстанавливает состояние из снимка и журнала"""
+        if self.journal is None:
+            return
+        snapshot, events = self.journal.load()
+        self.load_state(snapshot, events)
+        logging.info(f"Состояние восстановлено: предметов {len(self.topics)}, событий журнала {len(events)}")
+
+    def load_state(self, snapshot, events):
+        """Заменяет состояние снимком (если он есть) и применяет события после него"""
+        if snapshot:
+            self.topics = {
+                sys.intern(subject): TopicTable(topics) for subject, topics in snapshot['topics'].items()
+            }
+            self.start_times = {
+                subject: datetime.datetime.fromisoformat(start)
+                for subject, start in snapshot['start_times'].items()
+            }
+            self.registrations = {
+                subject: {num: (user_id, username, datetime.datetime.fromisoformat(timestamp))
+                          for num, user_id, username, timestamp in regs}
+                for subject, regs in snapshot['registrations'].items()
+            }
+            self.announce_chats = {
+                subject: set(chats) for subject, chats in snapshot.get('announce_chats', {}).items()
+            }
+            self.preference_windows = {
+                subject: datetime.timedelta(minutes=minutes)
+                for subject, minutes in snapshot.get('preference_windows', {}).items()
+            }
+            self.preferences = {
+                subject: {user_id: (username, tuple(topics), datetime.datetime.fromisoformat(submitted))
+                          for user_id, username, topics, submitted in wishes}
+                for subject, wishes in snapshot.get('preferences', {}).items()
+            }
+            self.assigned_subjects = set(snapshot.get('assigned', ()))
+            self.subscribers = {
+                subject: set(users) for subject, users in snapshot.get('subscribers', {}).items()
+            }
+            self.user_claims = {}
+            for subject, topics in self.topics.items():
+                taken = self.registrations.get(subject, {})
+                self.free_topics[subject] = sorted(num for num in topics if num not in taken)
+                self._index_subject(subject)
+                self.refresh_activation(subject)
+        for event in events:
+            self.apply_event(event)
+
+    def apply_event(self, event):
+        """Применяет событие журнала к состоянию в памяти"""
+        op = event['op']
+        # Одно название предмета на все словари состояния
+        subject = sys.intern(event['subject'])
+        self._touch(subject)
+        if event.get('chat_id') is not None:
+            self.announce_chats.setdefault(subject, set()).add(event['chat_id'])
+        if op == 'subject':
+            for num, (user_id, _, _) in self.registrations.get(subject, {}).items():
+                self._forget_user_claim(user_id, subject, num)
+            self.topics[subject] = TopicTable(event['topics'])
+            self.registrations[subject] = {}
+            self.free_topics[subject] = sorted(self.topics[subject])
+            # Пожелания ссылались на номера прежнего списка
+            self.preferences.pop(subject, None)
+            self.assigned_subjects.discard(subject)
+            self._index_subject(subject)
+            self.refresh_activation(subject)
+        elif op == 'start_time':
+            self.start_times[subject] = datetime.datetime.fromisoformat(event['at'])
+            self.refresh_activation(subject)
+        elif op == 'claim':
+            if event['topic'] not in self.topics.get(subject, ()):
+                # Заявка на тему из прежнего списка, который уже заменили
+                logging.warning(f"Пропущена заявка на несуществующую тему {event['topic']} ({subject})")
+                return
+            timestamp = datetime.datetime.fromisoformat(event['at'])
+            registrations = self.registrations.setdefault(subject, {})
+            previous = registrations.get(event['topic'])
+            if previous is not None:
+                self._forget_user_claim(previous[0], subject, event['topic'])
+            registrations[event['topic']] = (event['user_id'], event['username'], timestamp)
+            self.user_claims.setdefault(event['user_id'], {})[subject] = event['topic']
+            self._mark_taken(subject, event['topic'])
+            self._track_results(subject, event['topic'], previous, timestamp)
+        elif op == 'release':
+            registration = self.registrations.get(subject, {}).get(event['topic'])
+            # Освобождаем только тему того участника, которого освобождали
+            if registration is not None and event.get('user_id', registration[0]) == registration[0]:
+                del self.registrations[subject][event['topic']]
+                self._forget_user_claim(registration[0], subject, event['topic'])
+                self._mark_free(subject, event['topic'])
+                self._track_results(subject, event['topic'], registration, None)
+        elif op == 'preference_mode':
+            if event['minutes']:
+                self.preference_windows[subject] = datetime.timedelta(minutes=event['minutes'])
+            else:
+                self.preference_windows.pop(subject, None)
+                self.preferences.pop(subject, None)
+            self.refresh_activation(subject)
+        elif op == 'preferences':
+            if subject in self.topics:
+                self.preferences.setdefault(subject, {})[event['user_id']] = (
+                    event['username'], tuple(event['topics']), datetime.datetime.fromisoformat(event['at'])
+                )
+        elif op == 'assigned':
+            self.assigned_subjects.add(subject)
+            self.preferences.pop(subject, None)
+            self.refresh_activation(subject)
+        elif op == 'subscribe':
+            self.subscribers.setdefault(subject, set()).add(event['user_id'])
+        elif op == 'unsubscribe':
+            users = self.subscribers.get(subject)
+            if users is not None:
+                users.discard(event['user_id'])
+                if not users:
+                    del self.subscribers[subject]
+
+    def _touch(self, subject):
+        """Отмечает изменение предмета: готовые страницы с прежней версией больше не отдаются"""
+        self.versions[subject] = self.versions.get(subject, 0) + 1
+        self.state_version += 1
+
+    def _forget_user_claim(self, user_id, subject, topic_number):
+        claims = self.user_claims.get(user_id)
+        if claims is not None and claims.get(subject) == topic_number:
+            del claims[subject]
+            if not claims:
+                del self.user_claims[user_id]
+
+    def user_topic(self, user_id, subject):
+        """Номер темы, которую участник уже занял по предмету, или None"""
+        claims = self.user_claims.get(user_id)
+        return claims.get(subject) if claims else None
+
+    def claimed_reply(self, subject, topic_number):
+        timestamp = self.registrations[subject][topic_number][2]
+        return (
+            f"🎉 Тема выбрана!\n"
+            f"📖 {topic_number}. {self.topics[subject][topic_number]}\n"
+            f"📚 {subject}\n"
+            f"⏰ {timestamp.strftime('%H:%M:%S')}"
+        )
+
+    def already_claimed_reply(self, subject, topic_number):
+        return (
+            f"У вас уже есть тема по этому предмету:\n"
+            f"📖 {topic_number}. {self.topics[subject][topic_number]}\n"
+            f"Сменить ее может администратор (/cancel_registration)."
+        )
+
+    def _mark_taken(self, subject, topic_number):
+        free = self.free_topics.get(subject, [])
+        i = bisect.bisect_left(free, topic_number)
+        if i < len(free) and free[i] == topic_number:
+            del free[i]
+
+    def _mark_free(self, subject, topic_number):
+        if topic_number not in self.topics.get(subject, {}):
+            return
+        free = self.free_topics.setdefault(subject, [])
+        i = bisect.bisect_left(free, topic_number)
+        if i == len(free) or free[i] != topic_number:
+            free.insert(i, topic_number)
+
+    def subject_id(self, subject):
+        """Короткий стабильный id предмета для callback_data (одинаковый во всех процессах)"""
+        subject_id = self.subject_id_by_name.get(subject)
+        if subject_id is not None:
+            return subject_id
+        subject_id = crc_id = format(zlib.crc32(subject.encode('utf-8')), 'x')
+        salt = 0
+        while subject_id in self.subject_ids:
+            # CRC32 совпал с другим предметом: без соли кнопка заняла бы тему не в том предмете.
+            # Предметы заводятся в порядке журнала, поэтому соль во всех процессах одна
+            salt += 1
+            subject_id = format(zlib.crc32(f"{subject}\n{salt}".encode('utf-8')), 'x')
+        if salt:
+            logging.warning(f"id предмета {subject} совпал с id предмета {self.subject_ids[crc_id]}, выдан {subject_id}")
+        self.subject_ids[subject_id] = subject
+        self.subject_id_by_name[subject] = subject_id
+        return subject_id
+
+    def _index_subject(self, subject):
+        """Заново строит производные структуры предмета после замены его тем или снимка"""
+        self.subject_id(subject)
+        claims = ClaimTable(self.topics[subject].index)
+        claims.update(self.registrations.get(subject, {}))
+        self.registrations[subject] = claims
+        for num, (user_id, _, _) in claims.items():
+            self.user_claims.setdefault(user_id, {})[subject] = num
+        self.results_order[subject] = ClaimOrder((claims.timestamp_key(num), num) for num in claims)
+        self.page_cache[subject] = {}
+        self._touch(subject)
+
+    def _track_results(self, subject, topic_number, previous, timestamp):
+        """Обновляет порядок результатов и сбрасывает кэш страниц, которые изменились"""
+        order = self.results_order.setdefault(subject, ClaimOrder())
+        first = len(order)
+        if previous is not None:
+            i = order.remove(to_micros(previous[2]), topic_number)
+            if i is not None:
+                first = i
+        if timestamp is not None:
+            first = min(first, order.add(to_micros(timestamp), topic_number))
+
+        cache = self.page_cache.get(subject)
+        if not cache:
+            return
+        position = self.topics[subject].index.get(topic_number)
+        if position is not None:
+            cache.pop(('topics', position // PAGE_SIZE), None)
+            cache.pop(('buttons', position // PAGE_SIZE), None)
+        cache.pop(('csv', 0), None)
+        # Результаты после изменившейся позиции сдвигаются, их страницы тоже устарели
+        first_page = first // PAGE_SIZE
+        for key in [key for key in cache if key[0] == 'results' and key[1] >= first_page]:
+            del cache[key]
+
+    def nearest_free_topic(self, subject, topic_number):
+        """Ближайшая к topic_number свободная тема (при равенстве - меньшая) или None"""
+        free = self.free_topics.get(subject)
+        if not free:
+            return None
+        i = bisect.bisect_left(free, topic_number)
+        candidates = free[max(i - 1, 0):i + 1]
+        return min(candidates, key=lambda num: (abs(num - topic_number), num))
+
+    def taken_reply(self, subject, topic_number):
+        nearest = self.nearest_free_topic(subject, topic_number)
+        if nearest is None:
+            return "Эта тема уже занята! Свободных тем не осталось."
+        return (
+            f"Эта тема уже занята!\n"
+            f"Ближайшая свободная: {nearest}. {self.topics[subject][nearest]}"
+        )
+
+    def record(self, event):
+        """Применяет изменение и ставит его в журнал; результат можно ждать до записи на диск"""
+        self.apply_event(event)
+        if self.journal is not None:
+            return self.journal.append(event)
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(None)
+        return future
+
+    async def post_init(self, application):
+        if self.outbox is not None:
+            self.outbox.start(application.bot)
+        self.start_tasks(application.bot)
+        self.register_metrics(application)
+        if self.metrics_address is not None:
+            self._metrics_server = await metrics.serve(*self.metrics_address)
+        if self.drain_backlog:
+            await drain_pending_updates(application, self)
+
+    def register_metrics(self, application):
+        register_metrics(application, self.outbox, lambda: len(self.pending_claims))
+
+    async def post_stop(self, application):
+        # Очередь досылается, пока HTTP-клиент бота еще открыт: post_shutdown вызывается уже после его закрытия
+        if self.outbox is not None:
+            await self.outbox.stop()
+
+    async def post_shutdown(self, application):
+        if self._metrics_server is not None:
+            self._metrics_server.close()
+            self._metrics_server = None
+        self.stop_tasks()
+        if self.outbox is not None:
+            await self.outbox.stop()
+        if self.journal is not None:
+            await self.journal.close()
+
+    def start_tasks(self, bot):
+        """Запускает планировщик и, при общем хранилище, подтягивание чужих изменений"""
+        loop = asyncio.get_running_loop()
+        self._scheduler_task = loop.create_task(self.run_scheduler(bot))
+        if self.journal is not None and self.journal.shared:
+            self._sync_task = loop.create_task(self.run_shared_sync(bot))
+
+    def stop_tasks(self):
+        for task in (self._scheduler_task, self._sync_task):
+            if task is not None:
+                task.cancel()
+        self._scheduler_task = self._sync_task = None
+        for boards in self.live_boards.values():
+            for board in boards.values():
+                if board.task is not None:
+                    board.task.cancel()
+        for task in (*self._broadcasts, *self._reports):
+            task.cancel()
+
+    def is_idle(self):
+        """Нет заявок в окне арбитража и обновлений досок - состояние можно выгрузить"""
+        if self.pending_claims or self._broadcasts or self._reports or any(lock.locked() for lock in self.subject_locks.values()):
+            return False
+        return all(board.task is None for boards in self.live_boards.values() for board in boards.values())
 
-    def is_admin(self, user_id):
-        return user_id == self.admin_id
+    def next_scheduled(self):
+        """Время ближайшего открытия распределения или напоминания (или None)"""
+        return self._schedule[0][0] if self._schedule else None
 
-    def get_local_time(self):
+    async def sync_shared_state(self, bot=None):
+        """Применяет изменения, сделанные другими процессами в общем хранилище"""
+        snapshot, events = await asyncio.to_thread(self.journal.poll)
+        if snapshot is None and not events:
+            return
+        self.load_state(snapshot, events)
+        if bot is not None:
+            self.refresh_boards(bot, None if snapshot else {
+                event['subject'] for event in events if event['op'] in BOARD_EVENTS
+            })
+
+    async def run_shared_sync(self, bot):
+        while True:
+            try:
+                await self.sync_shared_state(bot)
+            except Exception as e:
+                logging.error(f"Ошибка синхронизации с общим хранилищем: {e}")
+            await asyncio.sleep(self.sync_interval)
+
+    async def is_admin(self, update: Update, bot):
+        """Администратор бота, а в состоянии отдельного чата - и администраторы этого чата"""
+        user_id = update.effective_user.id
+        if user_id == self.admin_id:
+            return True
+        if self.chat_id is None:
+            return False
+        if self.chat_id == user_id:
+            # Личный чат с ботом: его предметами распоряжается сам пользователь
+            return True
+        if self.chat_admins is None or time.monotonic() - self.chat_admins[1] > CHAT_ADMINS_TTL:
+            try:
+                members = await bot.get_chat_administrators(self.chat_id)
+            except TelegramError as e:
+                logging.error(f"Не удалось получить администраторов чата {self.chat_id}: {e}")
+                return self.chat_admins is not None and user_id in self.chat_admins[0]
+            self.chat_admins = ({member.user.id for member in members}, time.monotonic())
+        return user_id in self.chat_admins[0]
+
+    @staticmethod
+    def get_local_time():
         """Получаем текущее время с учетом часового пояса Москвы (UTC+3)"""
         utc_now = datetime.datetime.utcnow()
         msk_offset = datetime.timedelta(hours=3)
@@ -56,21 +604,28 @@ class SeminarBot:
 
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
-        await update.message.reply_text(
+        await self.reply(update, 
             f"Привет, {user.first_name}! Я бот для распределения семинарских тем.\n\n"
             "Доступные команды:\n"
             "/new_subject - начать новое распределение тем\n"
-            "/view_topics - посмотреть текущие темы\n"
-            "/results - показать результаты распределения\n"
+            "/view_topics - посмотреть текущие темы и выбрать тему кнопкой\n"
+            "/results - результаты файлом CSV (/results xlsx, /results <номер предмета>)\n"
+            "/results_text - результаты сообщением\n"
             "/set_subject_time - установить дату и время начала (админ)\n"
             "/cancel_registration - отменить выбор темы (админ)\n"
             "/remove_user - удалить участника с темы (админ)\n"
             "/list_subjects - показать все предметы\n"
+            "/free - показать свободные темы\n"
+            "/my_topic - показать выбранные вами темы\n"
+            "/subscribe [предмет] - уведомить в личке, когда откроется распределение\n"
+            "/unsubscribe [предмет] - отписаться от уведомлений\n"
+            "/prefer 5 12 3 - темы в порядке желания, когда идет сбор пожеланий\n"
+            "/preference_mode <предмет> <минуты> - раздать темы по пожеланиям (админ)\n"
             "/cancel - отменить текущую операцию"
         )
 
     async def new_subject(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        await update.message.reply_text(
+        await self.reply(update, 
             "Введите название предмета:",
             reply_markup=ReplyKeyboardRemove()
         )
@@ -80,17 +635,19 @@ class SeminarBot:
         subject_name = update.message.text.strip()
         
         if not subject_name:
-            await update.message.reply_text("Название предмета не может быть пустым. Попробуйте еще раз:")
+            await self.reply(update, "Название предмета не может быть пустым. Попробуйте еще раз:")
             return WAITING_SUBJECT_NAME
         
         context.user_data['current_subject'] = subject_name
         
-        await update.message.reply_text(
+        await self.reply(update, 
             f"Предмет '{subject_name}' установлен. Теперь отправьте список тем:\n"
             "1. Тема 1\n"
             "2. Тема 2\n"
             "3. Тема 3\n"
-            "..."
+            "...\n\n"
+            "Длинный список можно прислать файлом .txt (в том же формате) "
+            "или .csv (номер,название)."
         )
         return WAITING_TOPICS_LIST
 
@@ -99,65 +656,113 @@ class SeminarBot:
         subject_name = context.user_data.get('current_subject')
         
         if not subject_name:
-            await update.message.reply_text("Ошибка. Начните заново с /new_subject")
+            await self.reply(update, "Ошибка. Начните заново с /new_subject")
             return ConversationHandler.END
         
-        lines = text.split('\n')
-        topics_dict = {}
-        
-        for line in lines:
-            if '.' in line:
-                parts = line.split('.', 1)
-                try:
-                    number = int(parts[0].strip())
-                    topic = parts[1].strip()
-                    if topic:
-                        topics_dict[number] = topic
-                except (ValueError, IndexError):
-                    continue
+        topics_dict, errors = parse_topic_rows(text_topic_rows(text.split('\n')))
         
         if topics_dict:
-            self.topics[subject_name] = topics_dict
-            self.registrations[subject_name] = {}
-            
-            topics_text = f"✅ Темы для '{subject_name}' добавлены!\n\n"
-            for num, topic in sorted(topics_dict.items()):
-                topics_text += f"{num}. {topic}\n"
-            
-            start_time = self.start_times.get(subject_name)
-            if start_time:
-                now = self.get_local_time()
-                if now >= start_time:
-                    topics_text += f"\n✅ Распределение АКТИВНО"
-                else:
-                    time_left = start_time - now
-                    time_info = self.format_time_left(time_left)
-                    topics_text += f"\n⏰ Начнется через: {time_info}"
-            else:
-                topics_text += "\n⏰ Время не установлено (/set_subject_time)"
-            
-            topics_text += "\n\nЧтобы выбрать тему, отправьте номер."
-            
-            await update.message.reply_text(topics_text)
+            await self.save_topics(update, subject_name, topics_dict, errors)
             context.user_data.pop('current_subject', None)
         else:
-            await update.message.reply_text(
+            await self.reply(update, 
                 "Не удалось распознать темы. Формат:\n"
                 "1. Тема 1\n"
                 "2. Тема 2\n"
-                "..."
+                "...\n\n"
+                "Можно также прислать файл .txt или .csv со списком тем."
             )
             return WAITING_TOPICS_LIST
         
         return ConversationHandler.END
 
+    async def handle_topics_document(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Список тем файлом: .txt построчно «1. Тема» или .csv «номер,название»"""
+        document = update.message.document
+        subject_name = context.user_data.get('current_subject')
+        
+        if not subject_name:
+            await self.reply(update, "Ошибка. Начните заново с /new_subject")
+            return ConversationHandler.END
+        
+        file_name = (document.file_name or '').lower()
+        csv_format = file_name.endswith('.csv') or document.mime_type == 'text/csv'
+        if not csv_format and not file_name.endswith('.txt') and document.mime_type != 'text/plain':
+            await self.reply(update, "Поддерживаются файлы .txt и .csv. Попробуйте еще раз:")
+            return WAITING_TOPICS_LIST
+        if document.file_size and document.file_size > MAX_IMPORT_SIZE:
+            await self.reply(update, "Файл слишком большой (больше 20 МБ).")
+            return WAITING_TOPICS_LIST
+        
+        try:
+            telegram_file = await document.get_file()
+            with tempfile.TemporaryFile() as binary:
+                await telegram_file.download_to_memory(out=binary)
+                topics_dict, errors = await asyncio.to_thread(parse_topics_file, binary, csv_format)
+        except (TelegramError, ValueError) as e:
+            logging.error(f"Ошибка при импорте тем из {document.file_name}: {e}")
+            await self.reply(update, f"❌ Не удалось прочитать файл: {e}")
+            return WAITING_TOPICS_LIST
+        
+        if not topics_dict:
+            await self.reply(update, 
+                "В файле не найдено ни одной темы.\n\n" + self.format_import_errors(errors)
+            )
+            return WAITING_TOPICS_LIST
+        
+        await self.save_topics(update, subject_name, topics_dict, errors)
+        context.user_data.pop('current_subject', None)
+        return ConversationHandler.END
+
+    @staticmethod
+    def format_import_errors(errors):
+        if not errors:
+            return ""
+        errors_text = f"⚠️ Пропущено строк: {len(errors)}\n"
+        for line_no, reason in errors[:IMPORT_ERRORS_SHOWN]:
+            errors_text += f"Строка {line_no}: {reason}\n"
+        if len(errors) > IMPORT_ERRORS_SHOWN:
+            errors_text += f"... и еще {len(errors) - IMPORT_ERRORS_SHOWN}\n"
+        return errors_text
+
+    async def save_topics(self, update: Update, subject_name, topics_dict, errors):
+        """Заменяет темы предмета одним событием и отвечает сводкой"""
+        await self.record({
+            'op': 'subject', 'subject': subject_name, 'topics': sorted(topics_dict.items()),
+            'chat_id': update.effective_chat.id,
+        })
+        
+        topics_text = f"✅ Темы для '{subject_name}' добавлены ({len(topics_dict)})!\n\n"
+        for num, topic in itertools.islice(self.topics[subject_name].items(), PAGE_SIZE):
+            topics_text += f"{num}. {self.shorten(topic)}\n"
+        if len(topics_dict) > PAGE_SIZE:
+            topics_text += f"... и еще {len(topics_dict) - PAGE_SIZE} (/view_topics)\n"
+        if errors:
+            topics_text += "\n" + self.format_import_errors(errors)
+        
+        start_time = self.start_times.get(subject_name)
+        if start_time:
+            now = self.get_local_time()
+            if now >= start_time:
+                topics_text += f"\n✅ Распределение АКТИВНО"
+            else:
+                time_left = start_time - now
+                time_info = self.format_time_left(time_left)
+                topics_text += f"\n⏰ Начнется через: {time_info}"
+        else:
+            topics_text += "\n⏰ Время не установлено (/set_subject_time)"
+        
+        topics_text += "\n\nЧтобы выбрать тему, нажмите ее номер под доской (/view_topics) или отправьте номер."
+        
+        await self.reply(update, topics_text)
+
     async def set_subject_time(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        if not self.is_admin(update.effective_user.id):
-            await update.message.reply_text("Эта команда доступна только администратору.")
+        if not await self.is_admin(update, context.bot):
+            await self.reply(update, "Эта команда доступна только администратору.")
             return ConversationHandler.END
         
         if not self.topics:
-            await update.message.reply_text("Нет добавленных предметов.")
+            await self.reply(update, "Нет добавленных предметов.")
             return ConversationHandler.END
         
         subjects_text = "📚 Выберите предмет:\n\n"
@@ -167,7 +772,7 @@ class SeminarBot:
             subjects_text += f"{i}. {subject}{time_info}\n"
         
         subjects_text += "\nВведите номер предмета:"
-        await update.message.reply_text(subjects_text)
+        await self.reply(update, subjects_text)
         
         return WAITING_FOR_SUBJECT_TIME
 
@@ -185,12 +790,12 @@ class SeminarBot:
                 subject = text
         
         if not subject:
-            await update.message.reply_text("❌ Предмет не найден. Введите номер из списка:")
+            await self.reply(update, "❌ Предмет не найден. Введите номер из списка:")
             return WAITING_FOR_SUBJECT_TIME
         
         context.user_data['selected_subject'] = subject
         
-        await update.message.reply_text(
+        await self.reply(update, 
             f"📖 Выбран предмет: {subject}\n\n"
             "📅 Введите дату начала в формате ДД.ММ.ГГГГ\n"
             "Например: 25.12.2024"
@@ -202,7 +807,7 @@ class SeminarBot:
         subject = context.user_data.get('selected_subject')
         
         if not subject:
-            await update.message.reply_text("❌ Ошибка: предмет не выбран.")
+            await self.reply(update, "❌ Ошибка: предмет не выбран.")
             return ConversationHandler.END
         
         # Проверяем формат даты
@@ -210,7 +815,7 @@ class SeminarBot:
         match = re.match(date_pattern, text)
         
         if not match:
-            await update.message.reply_text(
+            await self.reply(update, 
                 "❌ Неверный формат даты!\n"
                 "✅ Используйте: ДД.ММ.ГГГГ\n"
                 "Например: 25.12.2024\n"
@@ -228,7 +833,7 @@ class SeminarBot:
             now_msk = self.get_local_time()
             
             if selected_date.date() < now_msk.date():
-                await update.message.reply_text(
+                await self.reply(update, 
                     "❌ Нельзя установить дату в прошлом!\n"
                     "✅ Введите будущую дату:\n"
                     "Формат: ДД.ММ.ГГГГ"
@@ -238,7 +843,7 @@ class SeminarBot:
             # Сохраняем дату
             context.user_data['selected_date'] = selected_date
             
-            await update.message.reply_text(
+            await self.reply(update, 
                 f"✅ Дата установлена: {selected_date.strftime('%d.%m.%Y')}\n\n"
                 "⏰ Теперь введите время начала в формате ЧЧ:ММ\n"
                 "Например: 14:30"
@@ -246,7 +851,7 @@ class SeminarBot:
             return SETTING_TIME
             
         except ValueError as e:
-            await update.message.reply_text(
+            await self.reply(update, 
                 f"❌ Некорректная дата!\n"
                 "✅ Проверьте:\n"
                 "- День от 1 до 31\n"
@@ -262,7 +867,7 @@ class SeminarBot:
         selected_date = context.user_data.get('selected_date')
         
         if not subject or not selected_date:
-            await update.message.reply_text("❌ Ошибка: данные не найдены.")
+            await self.reply(update, "❌ Ошибка: данные не найдены.")
             return ConversationHandler.END
         
         # Проверяем формат времени
@@ -270,7 +875,7 @@ class SeminarBot:
         match = re.match(time_pattern, text)
         
         if not match:
-            await update.message.reply_text(
+            await self.reply(update, 
                 "❌ Неверный формат времени!\n"
                 "✅ Используйте: ЧЧ:ММ\n"
                 "Например: 14:30\n"
@@ -289,7 +894,7 @@ class SeminarBot:
             
             # Проверяем, что установленное время в будущем
             if start_time <= now_msk:
-                await update.message.reply_text(
+                await self.reply(update, 
                     "❌ Нельзя установить время в прошлом!\n"
                     "✅ Введите будущее время:\n"
                     "Формат: ЧЧ:ММ"
@@ -297,13 +902,16 @@ class SeminarBot:
                 return SETTING_TIME
             
             # Устанавливаем время начала для предмета
-            self.start_times[subject] = start_time
+            await self.record({
+                'op': 'start_time', 'subject': subject, 'at': start_time.isoformat(),
+                'chat_id': update.effective_chat.id,
+            })
             
             # Рассчитываем сколько времени осталось
             time_left = start_time - now_msk
             time_info = self.format_time_left(time_left)
             
-            await update.message.reply_text(
+            await self.reply(update, 
                 f"✅ Дата и время установлены!\n\n"
                 f"📖 Предмет: {subject}\n"
                 f"📅 Дата: {start_time.strftime('%d.%m.%Y')}\n"
@@ -317,51 +925,171 @@ class SeminarBot:
             context.user_data.pop('selected_date', None)
             
         except Exception as e:
-            await update.message.reply_text(f"❌ Ошибка: {str(e)}")
+            await self.reply(update, f"❌ Ошибка: {str(e)}")
         
         return ConversationHandler.END
 
-    async def send_topics_update(self, subject, update: Update = None):
-        try:
-            topics_text = f"📊 Темы по предмету '{subject}':\n\n"
-            
-            for num, topic in self.topics[subject].items():
-                if subject in self.registrations and num in self.registrations[subject]:
-                    user_id, username, timestamp = self.registrations[subject][num]
-                    time_str = timestamp.strftime('%H:%M:%S')
-                    topics_text += f"{num}. {topic} - ✅ @{username} ({time_str})\n"
-                else:
-                    topics_text += f"{num}. {topic} - ❌ Свободна\n"
-            
-            start_time = self.start_times.get(subject)
-            if start_time:
-                now = self.get_local_time()
-                if now >= start_time:
-                    topics_text += f"\n✅ Распределение АКТИВНО"
-                else:
-                    time_left = start_time - now
-                    time_info = self.format_time_left(time_left)
-                    topics_text += f"\n⏰ Начнется через: {time_info}"
-            
-            if update:
-                await update.message.reply_text(topics_text)
-                
-        except Exception as e:
-            logging.error(f"Ошибка при отправке тем: {e}")
+    @staticmethod
+    def page_count(total, page_size=PAGE_SIZE):
+        return max(1, (total + page_size - 1) // page_size)
 
-    async def list_subjects(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        if not self.topics:
-            await update.message.reply_text("Нет добавленных предметов.")
-            return
-        
-        subjects_text = "📚 Список предметов:\n\n"
+    @staticmethod
+    def shorten(title):
+        if len(title) <= TOPIC_TITLE_LIMIT:
+            return title
+        return title[:TOPIC_TITLE_LIMIT - 1] + '…'
+
+    def _cached_page(self, subject, kind, page, render):
+        """Текст страницы из кэша; render(subject, page) вызывается только при промахе"""
+        cache = self.page_cache.setdefault(subject, {})
+        text = cache.get((kind, page))
+        if text is None:
+            text = cache[(kind, page)] = render(subject, page)
+        return text
+
+    def _cached_render(self, key, version, render):
+        """Результат render() из кэша, пока не изменилась version"""
+        cached = self.render_cache.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        value = render()
+        self.render_cache[key] = (version, value)
+        return value
+
+    def countdown_key(self, subject, now):
+        """Минут до начала (-1 - уже началось, None - время не задано): от него зависит строка отсчета"""
+        start_time = self.start_times.get(subject)
+        if start_time is None:
+            return None
+        if now >= start_time:
+            return -1
+        return int((start_time - now).total_seconds()) // 60
+
+    def _render_topics_page(self, subject, page):
+        registrations = self.registrations.get(subject, {})
+        start = page * PAGE_SIZE
+        lines = []
+        for num, topic in itertools.islice(self.topics[subject].items(), start, start + PAGE_SIZE):
+            topic = self.shorten(topic)
+            if num in registrations:
+                user_id, username, timestamp = registrations[num]
+                time_str = timestamp.strftime('%H:%M:%S')
+                lines.append(f"{num}. {topic} - ✅ @{username} ({time_str})\n")
+            else:
+                lines.append(f"{num}. {topic} - ❌ Свободна\n")
+        return ''.join(lines)
+
+    def _render_results_page(self, subject, page):
+        registrations = self.registrations[subject]
+        start = page * PAGE_SIZE
+        lines = []
+        for topic_num in self.results_order[subject][start:start + PAGE_SIZE]:
+            user_id, username, timestamp = registrations[topic_num]
+            topic_name = self.shorten(self.topics[subject][topic_num])
+            time_str = timestamp.strftime('%H:%M:%S')
+            lines.append(f"{topic_num}. {topic_name}\n   👤 @{username} ({time_str})\n\n")
+        return ''.join(lines)
+
+    @staticmethod
+    def page_title(title, page, pages):
+        if pages > 1:
+            title += f" (стр. {page + 1}/{pages})"
+        return title + ":\n\n"
+
+    def page_keyboard(self, kind, subject_id, page, pages, rows=()):
+        """Клавиатура из rows и кнопок ◀️/▶️ для листания; callback_data: pg|вид|id предмета|страница"""
+        rows = list(rows)
+        if pages <= 1:
+            return InlineKeyboardMarkup(rows) if rows else None
+        buttons = []
+        if page > 0:
+            buttons.append(InlineKeyboardButton("◀️", callback_data=f"pg|{kind}|{subject_id}|{page - 1}"))
+        buttons.append(InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=f"pg|{kind}|{subject_id}|{page}"))
+        if page < pages - 1:
+            buttons.append(InlineKeyboardButton("▶️", callback_data=f"pg|{kind}|{subject_id}|{page + 1}"))
+        rows.append(buttons)
+        return InlineKeyboardMarkup(rows)
+
+    def _render_claim_buttons(self, subject, page):
+        """Кнопки выбора тем страницы; callback_data: c|id предмета|тема"""
+        registrations = self.registrations.get(subject, {})
+        subject_id = self.subject_id(subject)
+        start = page * PAGE_SIZE
+        buttons = [
+            InlineKeyboardButton(
+                f"✅ {num}" if num in registrations else str(num), callback_data=f"c|{subject_id}|{num}"
+            )
+            for num in itertools.islice(self.topics[subject], start, start + PAGE_SIZE)
+        ]
+        return tuple(
+            tuple(buttons[i:i + CLAIM_BUTTONS_PER_ROW]) for i in range(0, len(buttons), CLAIM_BUTTONS_PER_ROW)
+        )
+
+    def topics_page(self, subject, page=0):
+        """Страница доски тем: (текст, клавиатура)"""
+        pages = self.page_count(len(self.topics[subject]))
+        page = min(max(page, 0), pages - 1)
+        now = self.get_local_time()
+        version = (self.versions.get(subject, 0), self.countdown_key(subject, now))
+        return self._cached_render(
+            ('topics', subject, page), version, lambda: self._build_topics_page(subject, page, pages, now)
+        )
+
+    def _build_topics_page(self, subject, page, pages, now):
+        topics_text = self.page_title(f"📊 Темы по предмету '{subject}'", page, pages)
+        topics_text += self._cached_page(subject, 'topics', page, self._render_topics_page)
         
-        for subject in self.topics.keys():
+        start_time = self.start_times.get(subject)
+        if start_time:
+            if now >= start_time:
+                topics_text += f"\n✅ Распределение АКТИВНО"
+            else:
+                time_left = start_time - now
+                time_info = self.format_time_left(time_left)
+                topics_text += f"\n⏰ Начнется через: {time_info}"
+        # Кнопки выбора тем есть только у открытого распределения
+        rows = ()
+        if self.is_distribution_started(subject):
+            rows = self._cached_page(subject, 'buttons', page, self._render_claim_buttons)
+        return topics_text, self.page_keyboard('t', self.subject_id(subject), page, pages, rows)
+
+    def render_topics(self, subject, page=0):
+        """Текст страницы доски тем по предмету"""
+        return self.topics_page(subject, page)[0]
+
+    def results_page(self, subject, page=0):
+        """Страница результатов по времени выбора: (текст, клавиатура)"""
+        pages = self.page_count(len(self.results_order.get(subject, ())))
+        page = min(max(page, 0), pages - 1)
+        return self._cached_render(
+            ('results', subject, page), self.versions.get(subject, 0),
+            lambda: self._build_results_page(subject, page, pages),
+        )
+
+    def _build_results_page(self, subject, page, pages):
+        results_text = self.page_title(f"📊 Результаты по '{subject}'", page, pages)
+        results_text += self._cached_page(subject, 'results', page, self._render_results_page)
+        return results_text, self.page_keyboard('r', self.subject_id(subject), page, pages)
+
+    def subjects_page(self, page=0):
+        """Страница списка предметов: (текст, клавиатура)"""
+        subjects = list(self.topics.keys())
+        pages = self.page_count(len(subjects), SUBJECTS_PAGE_SIZE)
+        page = min(max(page, 0), pages - 1)
+        start = page * SUBJECTS_PAGE_SIZE
+        shown = subjects[start:start + SUBJECTS_PAGE_SIZE]
+        now = self.get_local_time()
+        version = (self.state_version, tuple(self.countdown_key(subject, now) for subject in shown))
+        return self._cached_render(
+            ('subjects', page), version, lambda: self._build_subjects_page(shown, page, pages, now)
+        )
+
+    def _build_subjects_page(self, shown, page, pages, now):
+        subjects_text = self.page_title("📚 Список предметов", page, pages)
+        for subject in shown:
             start_time = self.start_times.get(subject)
             if start_time:
                 time_info = start_time.strftime('%d.%m.%Y %H:%M')
-                now = self.get_local_time()
-                
                 if now >= start_time:
                     status = "✅ АКТИВНО"
                 else:
@@ -379,18 +1107,209 @@ class SeminarBot:
             subjects_text += f"   ⏰ Время: {time_info}\n"
             subjects_text += f"   📊 Темы: {topics_count}, Выбрано: {reg_count}\n"
             subjects_text += f"   🚦 Статус: {status}\n\n"
+        return subjects_text, self.page_keyboard('s', '-', page, pages)
+
+    @HANDLER_LATENCY.time('send_topics_update')
+    async def send_topics_update(self, subject, update: Update = None):
+        try:
+            topics_text, keyboard = self.topics_page(subject)
+            
+            if update:
+                sent = await self.reply(
+                    update, topics_text, PRIORITY_BOARD, ('topics', update.effective_chat.id, subject),
+                    reply_markup=keyboard,
+                )
+                # Свежая доска становится живой: следующие изменения редактируют её
+                if isinstance(sent, asyncio.Future):
+                    sent.add_done_callback(
+                        lambda future: self._adopt_live_board(subject, topics_text, future.result())
+                    )
+                else:
+                    self._adopt_live_board(subject, topics_text, sent)
+                
+        except Exception as e:
+            logging.error(f"Ошибка при отправке тем: {e}")
+
+    async def reply(self, update: Update, text, priority=PRIORITY_REPLY, coalesce_key=None, reply_markup=None):
+        """Ответ через очередь исходящих (future, ждать не нужно); без очереди - reply_text и Message"""
+        if self.outbox is None:
+            return await update.message.reply_text(text, reply_markup=reply_markup)
+        kwargs = {}
+        if reply_markup is not None:
+            kwargs['reply_markup'] = reply_markup
+        if update.effective_chat.type != Chat.PRIVATE:
+            kwargs['reply_parameters'] = ReplyParameters(
+                message_id=update.message.message_id, allow_sending_without_reply=True
+            )
+        return self.outbox.send_message(update.effective_chat.id, text, priority, coalesce_key, **kwargs)
+
+    async def edit_page(self, message, text, reply_markup):
+        """Заменяет страницу в уже отправленном сообщении"""
+        if self.outbox is not None:
+            self.outbox.edit_message_text(
+                message.chat_id, message.message_id, text, PRIORITY_REPLY,
+                ('page', message.chat_id, message.message_id), reply_markup=reply_markup,
+            )
+            return
+        try:
+            await message.edit_text(text, reply_markup=reply_markup)
+        except BadRequest as e:
+            if 'not modified' not in str(e):
+                SEND_FAILURES.labels('edit_message_text').inc()
+                logging.error(f"Ошибка при смене страницы: {e}")
+
+    async def handle_page(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Кнопки листания досок, результатов и списка предметов"""
+        query = update.callback_query
+        try:
+            _, kind, subject_id, page = query.data.split('|')
+            page = int(page)
+        except ValueError:
+            await query.answer()
+            return
+        
+        subject = self.subject_ids.get(subject_id)
+        if kind != 's' and subject not in self.topics:
+            await query.answer("Предмет не найден.")
+            return
+        if kind == 't':
+            text, keyboard = self.topics_page(subject, page)
+        elif kind == 'r':
+            text, keyboard = self.results_page(subject, page)
+        else:
+            text, keyboard = self.subjects_page(page)
+        await query.answer()
         
-        await update.message.reply_text(subjects_text)
+        message = query.message
+        if not isinstance(message, Message):
+            return
+        if kind == 't':
+            board = self.live_boards.get(subject, {}).get(message.chat_id)
+            if board is not None and board.message_id == message.message_id:
+                # Живая доска дальше обновляется на выбранной странице
+                board.page = page
+                board.text = text
+        await self.edit_page(message, text, keyboard)
+
+    def _adopt_live_board(self, subject, topics_text, message):
+        if not self.leader or not isinstance(message, Message):
+            return
+        board = self.get_live_board(subject, message.chat_id)
+        board.message_id = message.message_id
+        board.page = 0
+        board.text = topics_text
+
+    def get_live_board(self, subject, chat_id):
+        boards = self.live_boards.setdefault(subject, {})
+        board = boards.get(chat_id)
+        if board is None:
+            board = boards[chat_id] = LiveBoard(subject, chat_id)
+        return board
 
-    # ... остальные методы остаются без изменений
+    def refresh_boards(self, bot, subjects=None):
+        """Обновляет доски предметов (None - всех) во всех их чатах, и там, где лидер их еще не показывал"""
+        if not self.leader:
+            return
+        for subject in self.topics if subjects is None else subjects:
+            if subject not in self.topics:
+                continue
+            for chat_id in self.announce_chats.get(subject, ()):
+                self.get_live_board(subject, chat_id)
+            self.schedule_board_update(subject, bot)
+
+    def schedule_board_update(self, subject, bot, chat_id=None):
+        """Помечает живые доски предмета устаревшими; chat_id - чат, где доска нужна обязательно"""
+        if not self.leader:
+            return
+        if chat_id is not None:
+            self.get_live_board(subject, chat_id)
+        for board in self.live_boards.get(subject, {}).values():
+            board.dirty = True
+            if board.task is None:
+                board.task = asyncio.get_running_loop().create_task(self._refresh_live_board(board, bot))
+
+    async def _refresh_live_board(self, board, bot):
+        """Обновляет доску не чаще раза в board_update_interval, собирая все изменения окна"""
+        loop = asyncio.get_running_loop()
+        try:
+            while board.dirty:
+                delay = board.last_update + self.board_update_interval - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                board.dirty = False
+                if board.subject not in self.topics:
+                    break
+                topics_text, keyboard = self.topics_page(board.subject, board.page)
+                board.last_update = loop.time()
+                if topics_text == board.text:
+                    continue
+                if self.outbox is not None:
+                    await self._push_board_via_outbox(board, topics_text, keyboard)
+                    continue
+                try:
+                    if board.message_id is None:
+                        message = await bot.send_message(
+                            chat_id=board.chat_id, text=topics_text, reply_markup=keyboard
+                        )
+                        board.message_id = message.message_id
+                    else:
+                        await bot.edit_message_text(
+                            topics_text, chat_id=board.chat_id, message_id=board.message_id,
+                            reply_markup=keyboard,
+                        )
+                    board.text = topics_text
+                except BadRequest as e:
+                    if 'not modified' in str(e):
+                        board.text = topics_text
+                    else:
+                        # Сообщение удалено или слишком старое - в следующий раз отправим новое
+                        SEND_FAILURES.labels('edit_message_text').inc()
+                        logging.error(f"Ошибка при обновлении доски тем: {e}")
+                        board.message_id = None
+                        board.text = None
+                except TelegramError as e:
+                    SEND_FAILURES.labels('edit_message_text' if board.message_id else 'send_message').inc()
+                    logging.error(f"Ошибка при обновлении доски тем: {e}")
+        finally:
+            board.task = None
+
+    async def _push_board_via_outbox(self, board, topics_text, keyboard):
+        key = ('board', board.chat_id, board.subject)
+        if board.message_id is None:
+            result = await self.outbox.send_message(
+                board.chat_id, topics_text, PRIORITY_BOARD, key, reply_markup=keyboard
+            )
+            if isinstance(result, Message):
+                board.message_id = result.message_id
+        else:
+            result = await self.outbox.edit_message_text(
+                board.chat_id, board.message_id, topics_text, PRIORITY_BOARD, key, reply_markup=keyboard
+            )
+        if result is None:
+            # Не доставлено (отброшено или сообщение недоступно) - в следующий раз отправим новое
+            board.message_id = None
+            board.text = None
+        else:
+            board.text = topics_text
+
+    async def list_subjects(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if not self.topics:
+            await self.reply(update, "Нет добавленных предметов.")
+            return
+        
+        subjects_text, keyboard = self.subjects_page()
+        await self.reply(
+            update, subjects_text, PRIORITY_BOARD, ('subjects', update.effective_chat.id),
+            reply_markup=keyboard,
+        )
 
     async def cancel_registration(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        if not self.is_admin(update.effective_user.id):
-            await update.message.reply_text("Эта команда доступна только администратору.")
+        if not await self.is_admin(update, context.bot):
+            await self.reply(update, "Эта команда доступна только администратору.")
             return ConversationHandler.END
         
         if not self.topics:
-            await update.message.reply_text("Нет добавленных предметов.")
+            await self.reply(update, "Нет добавленных предметов.")
             return ConversationHandler.END
         
         subjects_text = "Выберите предмет:\n\n"
@@ -398,7 +1317,7 @@ class SeminarBot:
             subjects_text += f"{i}. {subject}\n"
         
         subjects_text += "\nВведите номер предмета:"
-        await update.message.reply_text(subjects_text)
+        await self.reply(update, subjects_text)
         
         context.user_data['cancel_action'] = 'select_subject'
         return CANCELING_REGISTRATION
@@ -422,15 +1341,15 @@ class SeminarBot:
                             occupied_text += f"{topic_num}. {topic_name} - @{username}\n"
                         
                         occupied_text += "\nВведите номер темы для отмены:"
-                        await update.message.reply_text(occupied_text)
+                        await self.reply(update, occupied_text)
                     else:
-                        await update.message.reply_text(f"Для предмета '{subject}' нет занятых тем.")
+                        await self.reply(update, f"Для предмета '{subject}' нет занятых тем.")
                         return ConversationHandler.END
                 else:
-                    await update.message.reply_text("Неверный номер предмета.")
+                    await self.reply(update, "Неверный номер предмета.")
                     return CANCELING_REGISTRATION
             except ValueError:
-                await update.message.reply_text("Введите номер предмета.")
+                await self.reply(update, "Введите номер предмета.")
                 return CANCELING_REGISTRATION
         
         elif context.user_data.get('cancel_action') == 'select_topic':
@@ -438,37 +1357,38 @@ class SeminarBot:
                 topic_num = int(text)
                 subject = context.user_data.get('selected_subject')
                 
-                if subject not in self.registrations or topic_num not in self.registrations[subject]:
-                    await update.message.reply_text("Тема не занята или не существует.")
+                registration = await self.release_topic(subject, topic_num)
+                if registration is None:
+                    await self.reply(update, "Тема не занята или не существует.")
                     return CANCELING_REGISTRATION
                 
-                user_id, username, timestamp = self.registrations[subject].pop(topic_num)
+                user_id, username, timestamp = registration
                 topic_name = self.topics[subject][topic_num]
                 
-                await update.message.reply_text(
+                await self.reply(update, 
                     f"Регистрация отменена:\n"
                     f"Тема: {topic_num}. {topic_name}\n"
                     f"Предмет: {subject}\n"
                     f"Пользователь: @{username}"
                 )
                 
-                await self.send_topics_update(subject, update)
+                self.schedule_board_update(subject, context.bot, update.effective_chat.id)
                 context.user_data.pop('selected_subject', None)
                 context.user_data.pop('cancel_action', None)
                 
             except ValueError:
-                await update.message.reply_text("Введите номер темы.")
+                await self.reply(update, "Введите номер темы.")
                 return CANCELING_REGISTRATION
         
         return ConversationHandler.END
 
     async def remove_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        if not self.is_admin(update.effective_user.id):
-            await update.message.reply_text("Эта команда доступна только администратору.")
+        if not await self.is_admin(update, context.bot):
+            await self.reply(update, "Эта команда доступна только администратору.")
             return ConversationHandler.END
         
         if not self.topics:
-            await update.message.reply_text("Нет добавленных предметов.")
+            await self.reply(update, "Нет добавленных предметов.")
             return ConversationHandler.END
         
         subjects_text = "Выберите предмет:\n\n"
@@ -476,7 +1396,7 @@ class SeminarBot:
             subjects_text += f"{i}. {subject}\n"
         
         subjects_text += "\nВведите номер предмета:"
-        await update.message.reply_text(subjects_text)
+        await self.reply(update, subjects_text)
         
         return SELECTING_SUBJECT_FOR_REMOVAL
 
@@ -494,7 +1414,7 @@ class SeminarBot:
                 subject = text
         
         if not subject:
-            await update.message.reply_text("Предмет не найден.")
+            await self.reply(update, "Предмет не найден.")
             return SELECTING_SUBJECT_FOR_REMOVAL
         
         context.user_data['removal_subject'] = subject
@@ -506,10 +1426,10 @@ class SeminarBot:
                 occupied_text += f"{topic_num}. {topic_name} - @{username}\n"
             
             occupied_text += "\nВведите номер темы для удаления:"
-            await update.message.reply_text(occupied_text)
+            await self.reply(update, occupied_text)
             return SELECTING_TOPIC_FOR_REMOVAL
         else:
-            await update.message.reply_text(f"Для предмета '{subject}' нет занятых тем.")
+            await self.reply(update, f"Для предмета '{subject}' нет занятых тем.")
             context.user_data.pop('removal_subject', None)
             return ConversationHandler.END
 
@@ -518,30 +1438,31 @@ class SeminarBot:
         subject = context.user_data.get('removal_subject')
         
         if not subject:
-            await update.message.reply_text("Ошибка: предмет не выбран.")
+            await self.reply(update, "Ошибка: предмет не выбран.")
             return ConversationHandler.END
         
         try:
             topic_num = int(text)
             
-            if subject not in self.registrations or topic_num not in self.registrations[subject]:
-                await update.message.reply_text("Тема не занята или не существует.")
+            registration = await self.release_topic(subject, topic_num)
+            if registration is None:
+                await self.reply(update, "Тема не занята или не существует.")
                 return SELECTING_TOPIC_FOR_REMOVAL
             
-            user_id, username, timestamp = self.registrations[subject].pop(topic_num)
+            user_id, username, timestamp = registration
             topic_name = self.topics[subject][topic_num]
             
-            await update.message.reply_text(
+            await self.reply(update, 
                 f"Участник удален:\n"
                 f"Тема: {topic_num}. {topic_name}\n"
                 f"Предмет: {subject}\n"
                 f"Пользователь: @{username}"
             )
             
-            await self.send_topics_update(subject, update)
+            self.schedule_board_update(subject, context.bot, update.effective_chat.id)
             
         except ValueError:
-            await update.message.reply_text("Введите номер темы.")
+            await self.reply(update, "Введите номер темы.")
             return SELECTING_TOPIC_FOR_REMOVAL
         finally:
             context.user_data.pop('removal_subject', None)
@@ -552,17 +1473,561 @@ class SeminarBot:
         for key in ['current_subject', 'selected_subject', 'cancel_action', 'removal_subject', 'selected_date']:
             context.user_data.pop(key, None)
         
-        await update.message.reply_text(
+        await self.reply(update, 
             "Операция отменена.",
             reply_markup=ReplyKeyboardRemove()
         )
         return ConversationHandler.END
 
     def is_distribution_started(self, subject):
-        if subject not in self.start_times:
-            return True
+        return subject in self._active_set
+
+    def refresh_activation(self, subject):
+        """Пересчитывает активность предмета и планирует его открытие и напоминание"""
+        start_time = self.start_times.get(subject)
+        now = self.get_local_time()
+        deadline = self.assignment_deadline(subject)
+        if subject in self.preference_windows and subject not in self.assigned_subjects:
+            # Режим пожеланий: по одной темы не занимаются, пока не пройдет пакетное распределение
+            self._set_active(subject, False)
+            if deadline is None:
+                return
+            self._push_schedule(deadline, 'assign', subject, start_time)
+            if now < start_time:
+                # Открытие сбора пожеланий - для уведомления подписчиков
+                self._push_schedule(start_time, 'activate', subject, start_time)
+        else:
+            self._set_active(subject, subject in self.topics and (start_time is None or now >= start_time))
+            if start_time is None or now >= start_time:
+                return
+            self._push_schedule(start_time, 'activate', subject, start_time)
+        if start_time - REMINDER_LEAD > now:
+            self._push_schedule(start_time - REMINDER_LEAD, 'remind', subject, start_time)
+
+    def assignment_deadline(self, subject):
+        """Конец сбора пожеланий, когда темы раздаются разом; None - не в режиме пожеланий или уже роздано"""
+        start_time = self.start_times.get(subject)
+        window = self.preference_windows.get(subject)
+        if start_time is None or window is None or subject in self.assigned_subjects:
+            return None
+        return start_time + window
+
+    def collecting_subject(self):
+        """Предмет, по которому сейчас принимаются пожелания (первый, если их несколько), или None"""
         now = self.get_local_time()
-        return now >= self.start_times[subject]
+        for subject in self.preference_windows:
+            deadline = self.assignment_deadline(subject)
+            if deadline is not None and self.start_times[subject] <= now < deadline and subject in self.topics:
+                return subject
+        return None
+
+    def _set_active(self, subject, active):
+        if active == (subject in self._active_set):
+            return
+        if active:
+            self._active_set.add(subject)
+        else:
+            self._active_set.discard(subject)
+        # Кнопки выбора тем на досках есть только у открытого распределения
+        self._touch(subject)
+        # Перестраиваем только при смене статуса, чтобы горячий путь был одним обращением к списку
+        self.active_subjects = [s for s in self.topics if s in self._active_set]
+
+    def _push_schedule(self, when, kind, subject, start_time):
+        # refresh_activation вызывается на каждое изменение предмета - одно событие планируется один раз
+        key = (when, kind, subject)
+        if key in self._scheduled:
+            return
+        self._scheduled.add(key)
+        heapq.heappush(self._schedule, (when, next(self._schedule_seq), kind, subject, start_time))
+        self._schedule_wakeup.set()
+
+    async def run_scheduler(self, bot):
+        """Открывает распределения в момент start_times и рассылает напоминания"""
+        while True:
+            self._schedule_wakeup.clear()
+            now = self.get_local_time()
+            while self._schedule and self._schedule[0][0] <= now:
+                when, _, kind, subject, start_time = heapq.heappop(self._schedule)
+                self._scheduled.discard((when, kind, subject))
+                # Время начала могли перенести: такие записи в куче просто устарели
+                if self.start_times.get(subject) != start_time or subject not in self.topics:
+                    continue
+                try:
+                    if kind == 'activate':
+                        if self.assignment_deadline(subject) is None:
+                            self._set_active(subject, True)
+                            logging.info(f"Распределение по '{subject}' открыто")
+                            self.schedule_board_update(subject, bot)
+                        if self.leader:
+                            self.start_broadcast(subject, self.opening_text(subject), bot)
+                    elif kind == 'remind' and self.leader:
+                        await self.send_reminder(subject, bot)
+                    elif kind == 'assign' and self.leader:
+                        await self.run_assignment(subject, bot)
+                except Exception as e:
+                    logging.error(f"Ошибка планировщика ({kind}, {subject}): {e}")
+
+            timeout = None
+            if self._schedule:
+                timeout = max(0.0, (self._schedule[0][0] - self.get_local_time()).total_seconds())
+            try:
+                await asyncio.wait_for(self._schedule_wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def send_reminder(self, subject, bot):
+        text = (
+            f"🔔 Через 5 минут начнется распределение тем!\n"
+            f"📚 {subject}\n"
+            f"⏰ {self.start_times[subject].strftime('%d.%m.%Y %H:%M')}"
+        )
+        if self.assignment_deadline(subject) is not None:
+            text += f"\n📝 Темы раздаются по пожеланиям: /prefer <до {PREFERENCE_LIMIT} номеров по порядку>"
+        await self.announce(subject, text, bot)
+        self.start_broadcast(subject, text, bot)
+
+    def opening_text(self, subject):
+        if self.assignment_deadline(subject) is not None:
+            return (
+                f"📝 Начался сбор пожеланий по темам!\n"
+                f"📚 {subject}\n"
+                f"Отправьте в чате группы /prefer и до {PREFERENCE_LIMIT} номеров тем по порядку.\n"
+                f"⏰ Прием до {self.assignment_deadline(subject).strftime('%H:%M')}"
+            )
+        return (
+            f"🚀 Распределение тем открыто!\n"
+            f"📚 {subject}\n"
+            f"Отправьте номер темы в чате группы или нажмите его на доске (/view_topics)."
+        )
+
+    def start_broadcast(self, subject, text, bot):
+        """Запускает рассылку подписчикам предмета в фоне, не задерживая планировщик и обработчики"""
+        recipients = sorted(self.subscribers.get(subject, ()))
+        if not recipients:
+            return None
+        task = asyncio.get_running_loop().create_task(self.broadcast(subject, recipients, text, bot))
+        self._broadcasts.add(task)
+        task.add_done_callback(self._broadcasts.discard)
+        return task
+
+    async def broadcast(self, subject, recipients, text, bot):
+        """Личные сообщения подписчикам пачками по BROADCAST_BATCH_SIZE; возвращает число доставленных"""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        delivered = 0
+        remaining = len(recipients)
+        BROADCAST_PENDING.inc(remaining)
+        logging.info(f"Рассылка по '{subject}': {len(recipients)} подписчиков")
+        try:
+            for first in range(0, len(recipients), BROADCAST_BATCH_SIZE):
+                batch = recipients[first:first + BROADCAST_BATCH_SIZE]
+                batch_started = loop.time()
+                results = await asyncio.gather(*(self._notify(chat_id, text, bot) for chat_id in batch))
+                sent = sum(results)
+                delivered += sent
+                remaining -= len(batch)
+                BROADCAST_MESSAGES.labels('sent').inc(sent)
+                BROADCAST_MESSAGES.labels('failed').inc(len(batch) - sent)
+                BROADCAST_PENDING.inc(-len(batch))
+                if remaining:
+                    logging.info(f"Рассылка по '{subject}': {len(recipients) - remaining} из {len(recipients)}")
+                    if self.outbox is None:
+                        # Без очереди исходящих общий лимит бота соблюдается здесь
+                        await asyncio.sleep(max(0.0, batch_started + len(batch) / BROADCAST_RATE - loop.time()))
+        finally:
+            # Остаток прерванной рассылки больше не ждет отправки
+            BROADCAST_PENDING.inc(-remaining)
+        logging.info(
+            f"Рассылка по '{subject}' завершена: доставлено {delivered} из {len(recipients)} "
+            f"за {loop.time() - started:.1f} с"
+        )
+        return delivered
+
+    async def _notify(self, chat_id, text, bot):
+        """Одно уведомление; True - доставлено"""
+        if self.outbox is not None:
+            # Очередь сама ждет после 429 и пропускает вперед ответы участникам
+            return await self.outbox.send_message(chat_id, text, PRIORITY_BULK) is not None
+        for attempt in range(BROADCAST_RETRIES + 1):
+            try:
+                await bot.send_message(chat_id=chat_id, text=text)
+                return True
+            except RetryAfter as e:
+                if attempt == BROADCAST_RETRIES:
+                    break
+                await asyncio.sleep(e.retry_after)
+            except TelegramError as e:
+                # Чаще всего участник не начинал личный чат с ботом или заблокировал его
+                logging.error(f"Не удалось отправить уведомление {chat_id}: {e}")
+                break
+        SEND_FAILURES.labels('send_message').inc()
+        return False
+
+    async def announce(self, subject, text, bot):
+        """Сообщение во все чаты, где настраивали предмет"""
+        for chat_id in self.announce_chats.get(subject, ()):
+            if self.outbox is not None:
+                self.outbox.send_message(chat_id, text, PRIORITY_REPLY)
+                continue
+            try:
+                await bot.send_message(chat_id=chat_id, text=text)
+            except TelegramError as e:
+                SEND_FAILURES.labels('send_message').inc()
+                logging.error(f"Ошибка при отправке сообщения в {chat_id}: {e}")
+
+    async def run_assignment(self, subject, bot):
+        """Раздает темы по собранным пожеланиям одним оптимальным распределением"""
+        # Участники, у которых уже есть тема, не учитываются; заявки пишутся с временем подачи пожеланий
+        deadline = self.assignment_deadline(subject)
+        if deadline is None or self.get_local_time() < deadline:
+            return
+        wishes = self.preferences.get(subject, {})
+        candidates = sorted(
+            (user_id for user_id in wishes if self.user_topic(user_id, subject) is None),
+            key=lambda user_id: wishes[user_id][2],
+        )
+        taken = self.registrations.get(subject, {})
+        available = {num for num in self.topics[subject] if num not in taken}
+        started = time.perf_counter()
+        result = await asyncio.to_thread(
+            assign, [(user_id, wishes[user_id][1]) for user_id in candidates], available
+        )
+        elapsed = time.perf_counter() - started
+        ASSIGNMENT_LATENCY.observe(elapsed)
+        if self.assignment_deadline(subject) != deadline:
+            # Пока считали, темы предмета заменили или распределение уже провели
+            return
+
+        shared = self.journal is not None and self.journal.shared
+        events = []
+        async with self.get_subject_lock(subject):
+            persisted = []
+            for user_id, topic_number in result.items():
+                if topic_number in self.registrations.get(subject, {}):
+                    continue
+                username, _, submitted = wishes[user_id]
+                event = {
+                    'op': 'claim', 'subject': subject, 'topic': topic_number,
+                    'user_id': user_id, 'username': username, 'at': submitted.isoformat(),
+                }
+                events.append(event)
+                persisted.append(self.journal.claim(event) if shared else self.record(event))
+        holders = await asyncio.gather(*persisted)
+        won = first_choice = 0
+        for event, holder in zip(events, holders):
+            if shared:
+                # Другой процесс мог занять тему раньше: верим тому, что записано в хранилище
+                self.apply_event(holder)
+                if holder != event:
+                    continue
+            won += 1
+            first_choice += wishes[event['user_id']][1][0] == event['topic']
+        CLAIMS.labels('won').inc(won)
+        await self.record({'op': 'assigned', 'subject': subject})
+        logging.info(
+            f"Темы по '{subject}' распределены по пожеланиям: {won} из {len(candidates)} "
+            f"за {elapsed * 1000:.0f} мс"
+        )
+
+        await self.announce(
+            subject,
+            f"📋 Темы по '{subject}' распределены по пожеланиям!\n"
+            f"✅ Получили тему из своего списка: {won} из {len(candidates)}\n"
+            f"🥇 Из них первое желание: {first_choice}\n"
+            f"🟢 Свободных тем осталось: {len(self.free_topics.get(subject, []))} - их можно занять номером.\n"
+            f"📖 Своя тема - /my_topic",
+            bot,
+        )
+        for chat_id in self.announce_chats.get(subject, ()):
+            self.schedule_board_update(subject, bot, chat_id)
+
+    def get_subject_lock(self, subject):
+        lock = self.subject_locks.get(subject)
+        if lock is None:
+            lock = self.subject_locks[subject] = asyncio.Lock()
+        return lock
+
+    @staticmethod
+    def claim_order_key(update: Update):
+        """Порядок заявок: время сообщения в Telegram (у кнопки - время получения ботом), затем update_id"""
+        if update.message is not None:
+            return (update.message.date, update.update_id)
+        return (received_at(), update.update_id)
+
+    async def claim_topic(self, subject, topic_number, user_id, username, order_key):
+        """Пытается занять тему, возвращает True, если заявка победила в окне арбитража по order_key"""
+        slot = (subject, topic_number)
+        timestamp = self.get_local_time()
+        loop = asyncio.get_running_loop()
+
+        # Следующая заявка участника ждет решения по предыдущей: больше одной темы не достанется
+        while (previous := self.user_pending_claims.get((subject, user_id))) is not None:
+            if await previous:
+                return False
+
+        async with self.get_subject_lock(subject):
+            if topic_number in self.registrations.setdefault(subject, {}):
+                return False
+            contenders = self.pending_claims.get(slot)
+            opener = contenders is None
+            if opener:
+                contenders = self.pending_claims[slot] = []
+            decision = loop.create_future()
+            contenders.append((order_key, user_id, username, timestamp, decision))
+            self.user_pending_claims[(subject, user_id)] = decision
+
+        if opener:
+            # Уже полученные заявки на ту же тему успевают встать в список
+            await asyncio.sleep(0)
+            if len(contenders) == 1:
+                await self._resolve_claims(subject, topic_number)
+                return decision.result()
+
+        # Окно арбитража ждем без блокировки пользователя: его другие обновления не стоят
+        async with user_lock_released():
+            if opener:
+                await asyncio.sleep(self.arbitration_window)
+                await self._resolve_claims(subject, topic_number)
+            return await decision
+
+    async def _resolve_claims(self, subject, topic_number):
+        """Фиксирует победителя среди заявок на тему и сообщает итог каждой"""
+        slot = (subject, topic_number)
+        shared = self.journal is not None and self.journal.shared
+        async with self.get_subject_lock(subject):
+            # Слот остается в pending_claims до фиксации: опоздавшие попадают в тот же список
+            contenders = self.pending_claims[slot]
+            winner = min(contenders, key=lambda contender: contender[0])
+            _, user_id, username, timestamp, _ = winner
+            event = {
+                'op': 'claim', 'subject': subject, 'topic': topic_number,
+                'user_id': user_id, 'username': username, 'at': timestamp.isoformat(),
+            }
+            if shared:
+                committed = self.journal.claim(event)
+            else:
+                committed = self.record(event)
+        # Подтверждаем только после записи на диск; fsync общий для всей пачки заявок
+        try:
+            holder = await committed
+            if not shared:
+                holder = event
+        except Exception as e:
+            logging.error(f"Ошибка при сохранении заявки: {e}")
+            holder = None
+        async with self.get_subject_lock(subject):
+            self.pending_claims.pop(slot)
+            if shared and holder is not None:
+                # В общем хранилище тему мог раньше занять другой процесс
+                self.apply_event(holder)
+            elif not shared and holder is None:
+                self.apply_event({'op': 'release', 'subject': subject, 'topic': topic_number})
+            for contender in contenders:
+                _, user_id, _, _, decision = contender
+                won = contender is winner and holder is event
+                CLAIMS.labels('won' if won else 'lost' if holder is not None else 'failed').inc()
+                if self.user_pending_claims.get((subject, user_id)) is decision:
+                    del self.user_pending_claims[(subject, user_id)]
+                decision.set_result(won)
+
+    async def release_topic(self, subject, topic_number):
+        """Освобождает тему и возвращает бывшую регистрацию (user_id, username, timestamp) или None"""
+        async with self.get_subject_lock(subject):
+            registration = self.registrations.get(subject, {}).get(topic_number)
+            if registration is None:
+                return None
+            persisted = self.record({
+                'op': 'release', 'subject': subject, 'topic': topic_number, 'user_id': registration[0]
+            })
+        await persisted
+        return registration
+
+    @staticmethod
+    def to_local_time(moment):
+        """Время Telegram (UTC) в том же московском времени без пояса, что и get_local_time"""
+        return moment.astimezone(datetime.timezone.utc).replace(tzinfo=None) + datetime.timedelta(hours=3)
+
+    async def drain_claims(self, updates, bot):
+        """Разбирает накопившиеся заявки (без повторов, по message.date) одним проходом; вернет число занятых тем"""
+        shared = self.journal is not None and self.journal.shared
+        boards = set()
+        persisted = []
+        # Каждому участнику один ответ: занятая тема или причина отказа по его последнему номеру
+        replies = {}
+        winners = set()
+        skipped = collections.Counter()
+        for update in updates:
+            user = update.effective_user
+            sender = (update.effective_chat.id, user.id)
+            if not self.active_subjects:
+                skipped['нет активного распределения'] += 1
+                replies[sender] = (update, self.no_active_reply())
+                continue
+            subject = self.active_subjects[0]
+            topic_number = int(update.message.text)
+            sent_at = self.to_local_time(update.message.date)
+            start_time = self.start_times.get(subject)
+            boards.add((subject, update.effective_chat.id))
+            if start_time is not None and sent_at < start_time:
+                skipped['до открытия'] += 1
+                if sender not in winners:
+                    replies[sender] = (
+                        update, f"Номер {topic_number} отправлен до открытия распределения. Отправьте его еще раз."
+                    )
+                continue
+            claimed = self.user_topic(user.id, subject)
+            if topic_number not in self.topics[subject]:
+                reply = "Такой темы не существует."
+            elif claimed is not None:
+                reply = self.already_claimed_reply(subject, claimed)
+            elif topic_number in self.registrations.get(subject, {}):
+                CONFLICTS.inc()
+                reply = self.taken_reply(subject, topic_number)
+            else:
+                reply = None
+            if reply is None:
+                event = {
+                    'op': 'claim', 'subject': subject, 'topic': topic_number,
+                    'user_id': user.id, 'username': user.username or user.first_name, 'at': sent_at.isoformat(),
+                }
+                if shared:
+                    # Другой процесс мог занять тему раньше: верим тому, что записано в хранилище
+                    holder = await self.journal.claim(event)
+                    self.apply_event(holder)
+                    if holder != event:
+                        CONFLICTS.inc()
+                        reply = self.taken_reply(subject, topic_number)
+                else:
+                    persisted.append(self.record(event))
+            if reply is None:
+                CLAIMS.labels('won').inc()
+                winners.add(sender)
+                replies[sender] = (update, self.claimed_reply(subject, topic_number))
+            else:
+                CLAIMS.labels('lost').inc()
+                skipped['отказ'] += 1
+                if sender not in winners:
+                    replies[sender] = (update, reply)
+        await asyncio.gather(*persisted)
+        for subject, chat_id in boards:
+            self.schedule_board_update(subject, bot, chat_id)
+        for update, text in replies.values():
+            try:
+                await self.reply(update, text, PRIORITY_CLAIM)
+            except TelegramError as e:
+                logging.error(f"Не удалось ответить на накопившуюся заявку: {e}")
+        if skipped:
+            logging.info(
+                "Накопившиеся номера без заявки: " + ", ".join(f"{reason} - {count}" for reason, count in skipped.items())
+            )
+        return len(winners)
+
+    def no_active_reply(self):
+        subject = self.collecting_subject()
+        if subject is None:
+            return "Нет активных распределений."
+        return (
+            f"По '{subject}' темы раздаются по пожеланиям.\n"
+            f"Отправьте /prefer и до {PREFERENCE_LIMIT} номеров тем по порядку, например: /prefer 5 12 3\n"
+            f"⏰ Прием до {self.assignment_deadline(subject).strftime('%H:%M')}"
+        )
+
+    async def prefer(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/prefer 5 12 3 - темы в порядке желания; новый список заменяет прежний"""
+        user = update.effective_user
+        subject = self.collecting_subject()
+        if subject is None:
+            upcoming = [s for s in self.preference_windows if self.assignment_deadline(s) is not None]
+            if upcoming:
+                start_time = self.start_times[upcoming[0]]
+                await self.reply(
+                    update, f"Сбор пожеланий по '{upcoming[0]}' начнется {start_time.strftime('%d.%m.%Y %H:%M')}."
+                )
+            else:
+                await self.reply(update, "Сейчас пожелания не собираются.")
+            return
+        claimed = self.user_topic(user.id, subject)
+        if claimed is not None:
+            await self.reply(update, self.already_claimed_reply(subject, claimed), PRIORITY_CLAIM)
+            return
+
+        topics = self.topics[subject]
+        deadline = self.assignment_deadline(subject).strftime('%H:%M')
+        numbers = list(dict.fromkeys(int(arg) for arg in re.findall(r'\d+', ' '.join(context.args or []))))
+        if not numbers:
+            current = self.preferences.get(subject, {}).get(user.id)
+            text = self.no_active_reply()
+            if current is not None:
+                text += "\n\nВаш список:\n" + "".join(
+                    f"{rank}. {num}. {self.shorten(topics[num])}\n" for rank, num in enumerate(current[1], 1)
+                )
+            await self.reply(update, text, PRIORITY_CLAIM)
+            return
+        unknown = [num for num in numbers if num not in topics]
+        if unknown:
+            await self.reply(
+                update, f"Таких тем нет: {', '.join(map(str, unknown))}. Номера тем - в /view_topics.", PRIORITY_CLAIM
+            )
+            return
+        if len(numbers) > PREFERENCE_LIMIT:
+            await self.reply(update, f"Можно указать не больше {PREFERENCE_LIMIT} тем.", PRIORITY_CLAIM)
+            return
+
+        await self.record({
+            'op': 'preferences', 'subject': subject, 'user_id': user.id,
+            'username': user.username or user.first_name, 'topics': numbers,
+            'at': self.get_local_time().isoformat(),
+        })
+        text = f"✅ Пожелания по '{subject}' приняты:\n"
+        for rank, num in enumerate(numbers, 1):
+            text += f"{rank}. {num}. {self.shorten(topics[num])}\n"
+        text += f"\n⏰ Темы распределятся в {deadline}. Изменить список - снова /prefer."
+        await self.reply(update, text, PRIORITY_CLAIM)
+
+    async def preference_mode(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/preference_mode <предмет> <минуты> - сбор пожеланий вместо «кто первый»; 0 минут - выключить"""
+        if not await self.is_admin(update, context.bot):
+            await self.reply(update, "Эта команда доступна только администратору.")
+            return
+        args = list(context.args or [])
+        if len(args) < 2 or not args[-1].isdigit():
+            await self.reply(update, 
+                "Использование: /preference_mode <номер или название предмета> <минуты сбора>\n"
+                "0 минут - вернуть порядок «кто первый»."
+            )
+            return
+        minutes = int(args.pop())
+        subject = self.find_subject(' '.join(args))
+        if subject is None:
+            await self.reply(update, "Предмет не найден. Номера предметов - в /list_subjects.")
+            return
+        if subject in self.assigned_subjects:
+            await self.reply(update, f"Темы по '{subject}' уже распределены по пожеланиям.")
+            return
+        if minutes and self.registrations.get(subject):
+            await self.reply(update, f"По '{subject}' уже выбирают темы - режим не сменить.")
+            return
+
+        await self.record({
+            'op': 'preference_mode', 'subject': subject, 'minutes': minutes,
+            'chat_id': update.effective_chat.id,
+        })
+        if not minutes:
+            await self.reply(update, f"'{subject}': темы снова занимаются в порядке «кто первый».")
+            return
+        text = (
+            f"📝 '{subject}': темы раздаются по пожеланиям.\n"
+            f"Участники присылают /prefer и до {PREFERENCE_LIMIT} номеров тем по порядку; "
+            f"через {minutes} мин. после начала темы распределятся разом."
+        )
+        start_time = self.start_times.get(subject)
+        if start_time is None:
+            text += "\n⏰ Время начала не установлено (/set_subject_time)"
+        else:
+            deadline = self.assignment_deadline(subject)
+            text += f"\n⏰ Сбор пожеланий: {start_time.strftime('%d.%m.%Y %H:%M')} - {deadline.strftime('%H:%M')}"
+        await self.reply(update, text)
 
     async def handle_topic_selection(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         text = update.message.text.strip()
@@ -570,85 +2035,363 @@ class SeminarBot:
         username = update.effective_user.username or update.effective_user.first_name
 
         if text.isdigit():
-            selected_subject = None
-            for subject in self.topics.keys():
-                if self.is_distribution_started(subject):
-                    selected_subject = subject
-                    break
-            
-            if not selected_subject:
-                await update.message.reply_text("Нет активных распределений.")
+            if not self.active_subjects:
+                await self.reply(update, self.no_active_reply(), PRIORITY_CLAIM)
                 return
+            selected_subject = self.active_subjects[0]
             
             try:
                 topic_number = int(text)
                 topics = self.topics[selected_subject]
                 
                 if topic_number not in topics:
-                    await update.message.reply_text("Такой темы не существует.")
+                    await self.reply(update, "Такой темы не существует.", PRIORITY_CLAIM)
                     return
                 
-                if selected_subject in self.registrations and topic_number in self.registrations[selected_subject]:
-                    await update.message.reply_text("Эта тема уже занята!")
+                claimed = self.user_topic(user_id, selected_subject)
+                if claimed is not None:
+                    await self.reply(update, self.already_claimed_reply(selected_subject, claimed), PRIORITY_CLAIM)
                     return
                 
-                timestamp = self.get_local_time()
-                if selected_subject not in self.registrations:
-                    self.registrations[selected_subject] = {}
-                self.registrations[selected_subject][topic_number] = (user_id, username, timestamp)
+                if selected_subject in self.registrations and topic_number in self.registrations[selected_subject]:
+                    CONFLICTS.inc()
+                    await self.reply(update, self.taken_reply(selected_subject, topic_number), PRIORITY_CLAIM)
+                    return
                 
-                await update.message.reply_text(
-                    f"🎉 Тема выбрана!\n"
-                    f"📖 {topic_number}. {topics[topic_number]}\n"
-                    f"📚 {selected_subject}\n"
-                    f"⏰ {timestamp.strftime('%H:%M:%S')}"
+                won = await self.claim_topic(
+                    selected_subject, topic_number, user_id, username, self.claim_order_key(update)
                 )
+                claimed = self.user_topic(user_id, selected_subject)
+                if not won and claimed is not None:
+                    # Пока эта заявка ждала, прошла предыдущая заявка участника
+                    await self.reply(update, self.already_claimed_reply(selected_subject, claimed), PRIORITY_CLAIM)
+                    return
+                if not won:
+                    CONFLICTS.inc()
+                    await self.reply(update, self.taken_reply(selected_subject, topic_number), PRIORITY_CLAIM)
+                    return
                 
-                await self.send_topics_update(selected_subject, update)
+                await self.reply(update, self.claimed_reply(selected_subject, topic_number), PRIORITY_CLAIM)
+                
+                self.schedule_board_update(selected_subject, context.bot, update.effective_chat.id)
                 
             except ValueError:
-                await update.message.reply_text("Введите номер темы.")
+                await self.reply(update, "Введите номер темы.", PRIORITY_CLAIM)
+
+    async def handle_claim_button(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Выбор темы кнопкой на доске; ответ - всплывающее уведомление и смена кнопки"""
+        query = update.callback_query
+        try:
+            _, subject_id, topic_number = query.data.split('|')
+            topic_number = int(topic_number)
+        except ValueError:
+            await query.answer()
+            return
+        
+        subject = self.subject_ids.get(subject_id)
+        if subject not in self.topics or topic_number not in self.topics[subject]:
+            await query.answer("Такой темы не существует.")
+            return
+        if not self.is_distribution_started(subject):
+            if self.collecting_subject() == subject:
+                await query.answer(self.no_active_reply()[:CALLBACK_ANSWER_LIMIT])
+            else:
+                await query.answer("Распределение еще не началось.")
+            return
+        
+        claimed = self.user_topic(query.from_user.id, subject)
+        if claimed is not None:
+            await query.answer(self.already_claimed_reply(subject, claimed)[:CALLBACK_ANSWER_LIMIT])
+            return
+        
+        won = False
+        if topic_number not in self.registrations.get(subject, {}):
+            user = query.from_user
+            won = await self.claim_topic(
+                subject, topic_number, user.id, user.username or user.first_name, self.claim_order_key(update)
+            )
+        claimed = self.user_topic(query.from_user.id, subject)
+        if won:
+            answer = f"🎉 Тема выбрана!\n📖 {topic_number}. {self.topics[subject][topic_number]}"
+        elif claimed is not None:
+            answer = self.already_claimed_reply(subject, claimed)
+        else:
+            CONFLICTS.inc()
+            answer = self.taken_reply(subject, topic_number)
+        await query.answer(answer[:CALLBACK_ANSWER_LIMIT])
+        
+        message = query.message
+        if not isinstance(message, Message):
+            return
+        page = self.topics[subject].index[topic_number] // PAGE_SIZE
+        if self.leader:
+            # Доска, на которой нажали кнопку, становится живой и покажет новое состояние кнопки
+            board = self.get_live_board(subject, message.chat_id)
+            if board.message_id != message.message_id:
+                board.message_id = message.message_id
+                board.text = None
+            board.page = page
+            self.schedule_board_update(subject, context.bot, message.chat_id)
+        else:
+            await self.edit_page(message, *self.topics_page(subject, page))
 
     async def view_topics(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not self.topics:
-            await update.message.reply_text("Темы еще не добавлены.")
+            await self.reply(update, "Темы еще не добавлены.")
             return
         
         for subject in self.topics.keys():
             await self.send_topics_update(subject, update)
 
+    async def free_topics_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if not self.topics:
+            await self.reply(update, "Темы еще не добавлены.")
+            return
+        
+        free_text = ""
+        for subject, topics in self.topics.items():
+            free = self.free_topics.get(subject, [])
+            free_text += f"🟢 Свободные темы по '{subject}' ({len(free)} из {len(topics)}):\n"
+            shown = 0
+            for num in free[:FREE_LIST_LIMIT]:
+                line = f"{num}. {self.shorten(topics[num])}\n"
+                # Запас под строки «... и еще» и заголовки следующих предметов
+                if len(free_text) + len(line) > MESSAGE_LIMIT - 200:
+                    break
+                free_text += line
+                shown += 1
+            if len(free) > shown:
+                free_text += f"... и еще {len(free) - shown}\n"
+            free_text += "\n"
+        
+        await self.reply(update, free_text, PRIORITY_BOARD, ('free', update.effective_chat.id))
+
+    async def my_topic(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        claims = self.user_claims.get(update.effective_user.id)
+        if not claims:
+            await self.reply(update, "Вы еще не выбрали ни одной темы.")
+            return
+        text = "📖 Ваши темы:\n\n"
+        for subject, num in claims.items():
+            text += f"📚 {subject}\n{num}. {self.shorten(self.topics[subject][num])}\n\n"
+        await self.reply(update, text)
+
+    async def profile(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/profile [секунды] [sample] - профиль цикла событий и трассы обновлений файлом"""
+        # Профилируется весь процесс, поэтому администраторам отдельных чатов команда недоступна
+        if update.effective_user.id != self.admin_id:
+            await self.reply(update, "Эта команда доступна только администратору бота.")
+            return
+        args = [arg.lower() for arg in context.args or []]
+        mode = args.pop() if args and args[-1] in ('cprofile', 'sample') else 'cprofile'
+        if len(args) > 1 or (args and not (args[0].isdigit() and int(args[0]) > 0)):
+            await self.reply(update, 
+                f"Использование: /profile [секунды, до {PROFILE_MAX_SECONDS}] [cprofile|sample]\n"
+                "cprofile - точные счетчики вызовов, но бот на это время медленнее; "
+                "sample - выборки стека, почти без замедления."
+            )
+            return
+        seconds = min(int(args[0]) if args else PROFILE_SECONDS, PROFILE_MAX_SECONDS)
+        profiled = profiling.start_profile(mode, seconds)
+        if profiled is None:
+            await self.reply(update, "Профилирование уже идет, дождитесь отчета.")
+            return
+        # Окно профилирования не держит обработчик: иначе команды администратора ждали бы его целиком
+        task = asyncio.get_running_loop().create_task(self.send_profile(update, profiled, mode))
+        self._reports.add(task)
+        task.add_done_callback(self._reports.discard)
+        await self.reply(update, f"⏱ Профилирование ({mode}) на {seconds} с, отчет придет файлом.")
+
+    async def send_profile(self, update: Update, profiled, mode):
+        try:
+            report = await profiled
+        except Exception as e:
+            logging.error(f"Ошибка профилирования: {e}")
+            await self.reply(update, f"❌ Профилирование не удалось: {e}")
+            return
+        stamp = self.get_local_time().strftime('%Y%m%d-%H%M%S')
+        await self.reply_document(update, report.encode('utf-8'), f"profile-{mode}-{stamp}.txt")
+
+    def command_subjects(self, context):
+        """Предмет из аргументов команды списком, без аргументов - все предметы; None - не найден"""
+        if not context.args:
+            return list(self.topics)
+        subject = self.find_subject(' '.join(context.args))
+        return None if subject is None else [subject]
+
+    async def subscribe(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/subscribe [предмет] - личное сообщение при открытии распределения и за 5 минут до него"""
+        subjects = self.command_subjects(context)
+        if subjects is None:
+            await self.reply(update, "Предмет не найден. Номера предметов - в /list_subjects.")
+            return
+        if not subjects:
+            await self.reply(update, "Нет добавленных предметов.")
+            return
+        user_id = update.effective_user.id
+        await asyncio.gather(*(
+            self.record({'op': 'subscribe', 'subject': subject, 'user_id': user_id})
+            for subject in subjects if user_id not in self.subscribers.get(subject, ())
+        ))
+        text = "🔔 Пришлю в личные сообщения, когда откроется распределение, и напомню за 5 минут:\n"
+        text += "".join(f"📚 {subject}\n" for subject in subjects)
+        if update.effective_chat.type != Chat.PRIVATE:
+            text += "\nЕсли вы еще не писали боту в личку, начните с ним чат - иначе Telegram не даст ему написать вам."
+        await self.reply(update, text)
+
+    async def unsubscribe(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        subjects = self.command_subjects(context)
+        if subjects is None:
+            await self.reply(update, "Предмет не найден. Номера предметов - в /list_subjects.")
+            return
+        user_id = update.effective_user.id
+        subscribed = [subject for subject in subjects if user_id in self.subscribers.get(subject, ())]
+        if not subscribed:
+            await self.reply(update, "Вы не подписаны на уведомления.")
+            return
+        await asyncio.gather(*(
+            self.record({'op': 'unsubscribe', 'subject': subject, 'user_id': user_id}) for subject in subscribed
+        ))
+        await self.reply(update, "🔕 Уведомлений больше не будет:\n" + "".join(f"📚 {s}\n" for s in subscribed))
+
+    def export_rows(self, subject):
+        """Строки выгрузки в порядке выбора тем, без сортировки при каждом вызове"""
+        registrations = self.registrations[subject]
+        topics = self.topics[subject]
+        for topic_num in self.results_order.get(subject, ()):
+            user_id, username, timestamp = registrations[topic_num]
+            yield (subject, topic_num, topics[topic_num], f"@{username}", user_id,
+                   timestamp.strftime('%d.%m.%Y %H:%M:%S'))
+
+    def _render_csv(self, subject, page):
+        buffer = io.StringIO()
+        csv.writer(buffer, delimiter=EXPORT_DELIMITER).writerows(self.export_rows(subject))
+        return buffer.getvalue().encode('utf-8')
+
+    def results_csv(self, subjects):
+        """CSV по предметам: строки каждого предмета кэшируются до следующей заявки или отмены"""
+        header = io.StringIO()
+        csv.writer(header, delimiter=EXPORT_DELIMITER).writerow(EXPORT_COLUMNS)
+        # BOM нужен, чтобы Excel открыл файл в UTF-8
+        parts = [header.getvalue().encode('utf-8-sig')]
+        parts.extend(self._cached_page(subject, 'csv', 0, self._render_csv) for subject in subjects)
+        return b''.join(parts)
+
+    def results_xlsx(self, subjects):
+        try:
+            from openpyxl import Workbook
+        except ImportError:
+            raise RuntimeError("для выгрузки в XLSX нужен пакет openpyxl")
+        # write_only пишет строки потоком, не держа в памяти объекты ячеек
+        workbook = Workbook(write_only=True)
+        for subject in subjects:
+            sheet = workbook.create_sheet(re.sub(r'[\\/*?:\[\]]', '_', subject)[:31] or '_')
+            sheet.append(EXPORT_COLUMNS)
+            for row in self.export_rows(subject):
+                sheet.append(row)
+        buffer = io.BytesIO()
+        workbook.save(buffer)
+        return buffer.getvalue()
+
+    def find_subject(self, text):
+        """Предмет по номеру в списке или по названию"""
+        subjects = list(self.topics.keys())
+        if text.isdigit() and 1 <= int(text) <= len(subjects):
+            return subjects[int(text) - 1]
+        return text if text in self.topics else None
+
+    async def reply_document(self, update: Update, data, filename, coalesce_key=None):
+        if self.outbox is None:
+            return await update.message.reply_document(document=data, filename=filename)
+        kwargs = {}
+        if update.effective_chat.type != Chat.PRIVATE:
+            kwargs['reply_parameters'] = ReplyParameters(
+                message_id=update.message.message_id, allow_sending_without_reply=True
+            )
+        return self.outbox.submit(
+            'send_document', update.effective_chat.id, PRIORITY_REPLY, coalesce_key,
+            document=data, filename=filename, **kwargs
+        )
+
     async def show_results(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/results [xlsx] [предмет] - выгрузка результатов файлом"""
+        if self.journal is not None and self.journal.shared:
+            await self.sync_shared_state(context.bot)
+        
+        args = list(context.args or [])
+        file_format = 'csv'
+        if args and args[0].lower() in ('csv', 'xlsx'):
+            file_format = args.pop(0).lower()
+        if args:
+            subject = self.find_subject(' '.join(args))
+            if subject is None:
+                await self.reply(update, "Предмет не найден. Номера предметов - в /list_subjects.")
+                return
+            subjects = [subject]
+        else:
+            subjects = list(self.topics.keys())
+        subjects = [subject for subject in subjects if self.registrations.get(subject)]
+        if not subjects:
+            await self.reply(update, "Еще никто не выбрал темы.")
+            return
+        
+        filename = "results"
+        if len(subjects) == 1:
+            filename += "_" + re.sub(r'[\\/:*?"<>|\s]+', '_', subjects[0])
+        filename += "." + file_format
+        try:
+            if file_format == 'xlsx':
+                # Файл пересобирается, только если с прошлой выгрузки изменился какой-то из предметов
+                key = ('xlsx', tuple(subjects))
+                version = tuple(self.versions.get(subject, 0) for subject in subjects)
+                cached = self.render_cache.get(key)
+                if cached is not None and cached[0] == version:
+                    data = cached[1]
+                else:
+                    data = await asyncio.to_thread(self.results_xlsx, subjects)
+                    self.render_cache[key] = (version, data)
+            else:
+                data = self.results_csv(subjects)
+        except RuntimeError as e:
+            await self.reply(update, f"❌ Не удалось выгрузить результаты: {e}")
+            return
+        await self.reply_document(
+            update, data, filename, ('export', update.effective_chat.id, file_format, tuple(subjects))
+        )
+
+    async def show_results_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if self.journal is not None and self.journal.shared:
+            await self.sync_shared_state(context.bot)
         if not any(self.registrations.values()):
-            await update.message.reply_text("Еще никто не выбрал темы.")
+            await self.reply(update, "Еще никто не выбрал темы.")
             return
         
         for subject, registrations in self.registrations.items():
             if registrations:
-                sorted_registrations = sorted(registrations.items(), key=lambda x: x[1][2])
-                
-                results_text = f"📊 Результаты по '{subject}':\n\n"
-                
-                for topic_num, (user_id, username, timestamp) in sorted_registrations:
-                    topic_name = self.topics[subject][topic_num]
-                    time_str = timestamp.strftime('%H:%M:%S')
-                    results_text += f"{topic_num}. {topic_name}\n   👤 @{username} ({time_str})\n\n"
-                
-                await update.message.reply_text(results_text)
+                results_text, keyboard = self.results_page(subject)
+                await self.reply(
+                    update, results_text, PRIORITY_BOARD, ('results', update.effective_chat.id, subject),
+                    reply_markup=keyboard,
+                )
+
+def setup_handlers(application, bot):
+    """Регистрирует все обработчики бота в приложении"""
+    # Шаги диалогов переживают перезапуск, если у приложения есть хранилище
+    persistent = application.persistence is not None
 
-def main():
-    TOKEN = os.environ.get('BOT_TOKEN', "8405347117:AAG7h0qxePyQ9mXW3z03DBYOEWafOVP3oBI")
-    
-    application = Application.builder().token(TOKEN).build()
-    bot = SeminarBot()
-    
     # ConversationHandler для добавления предметов
     new_subject_handler = ConversationHandler(
         entry_points=[CommandHandler("new_subject", bot.new_subject)],
         states={
             WAITING_SUBJECT_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, bot.handle_subject_name)],
-            WAITING_TOPICS_LIST: [MessageHandler(filters.TEXT & ~filters.COMMAND, bot.handle_topics_list)],
+            WAITING_TOPICS_LIST: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, bot.handle_topics_list),
+                MessageHandler(filters.Document.ALL, bot.handle_topics_document),
+            ],
         },
-        fallbacks=[CommandHandler("cancel", bot.cancel)]
+        fallbacks=[CommandHandler("cancel", bot.cancel)],
+        name="new_subject",
+        persistent=persistent,
     )
     
     # ConversationHandler для установки времени
@@ -659,7 +2402,9 @@ def main():
             SETTING_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, bot.handle_set_date)],
             SETTING_TIME: [MessageHandler(filters.TEXT & ~filters.COMMAND, bot.handle_set_time)],
         },
-        fallbacks=[CommandHandler("cancel", bot.cancel)]
+        fallbacks=[CommandHandler("cancel", bot.cancel)],
+        name="set_subject_time",
+        persistent=persistent,
     )
     
     # ConversationHandler для административных команд
@@ -673,27 +2418,169 @@ def main():
             SELECTING_SUBJECT_FOR_REMOVAL: [MessageHandler(filters.TEXT & ~filters.COMMAND, bot.handle_subject_selection_for_removal)],
             SELECTING_TOPIC_FOR_REMOVAL: [MessageHandler(filters.TEXT & ~filters.COMMAND, bot.handle_topic_selection_for_removal)]
         },
-        fallbacks=[CommandHandler("cancel", bot.cancel)]
+        fallbacks=[CommandHandler("cancel", bot.cancel)],
+        name="admin",
+        persistent=persistent,
     )
     
-    # Добавляем обработчики
+    # Добавляем обработчики; ограничение частоты заявок срабатывает раньше всех остальных
+    throttle = ClaimThrottle(conversations=(new_subject_handler, time_handler, admin_handler))
+    application.add_handler(TypeHandler(Update, throttle.throttle_claims), group=-1)
     application.add_handler(CommandHandler("start", bot.start))
     application.add_handler(new_subject_handler)
     application.add_handler(time_handler)
     application.add_handler(CommandHandler("view_topics", bot.view_topics))
     application.add_handler(CommandHandler("results", bot.show_results))
+    application.add_handler(CommandHandler("results_text", bot.show_results_text))
     application.add_handler(CommandHandler("list_subjects", bot.list_subjects))
+    application.add_handler(CommandHandler("free", bot.free_topics_command))
+    application.add_handler(CommandHandler("my_topic", bot.my_topic))
+    application.add_handler(CommandHandler("prefer", bot.prefer))
+    application.add_handler(CommandHandler("preference_mode", bot.preference_mode))
+    application.add_handler(CommandHandler("subscribe", bot.subscribe))
+    application.add_handler(CommandHandler("profile", bot.profile))
+    application.add_handler(CommandHandler("unsubscribe", bot.unsubscribe))
+    application.add_handler(CallbackQueryHandler(bot.handle_page, pattern=r'^pg\|'))
+    application.add_handler(CallbackQueryHandler(bot.handle_claim_button, pattern=r'^c\|'))
     application.add_handler(admin_handler)
     application.add_handler(CommandHandler("cancel", bot.cancel))
     
     # Обработчик для выбора тем
-    application.add_handler(MessageHandler(
-        filters.TEXT & filters.Regex(r'^\d+$'), 
-        bot.handle_topic_selection
-    ))
+    application.add_handler(MessageHandler(CLAIM_FILTER, bot.handle_topic_selection))
+    
+    # Время и ошибки каждого обработчика попадают в метрики
+    for handlers in application.handlers.values():
+        instrument_handlers(handlers)
+
+def get_token():
+    return os.environ.get('BOT_TOKEN', "8405347117:AAG7h0qxePyQ9mXW3z03DBYOEWafOVP3oBI")
+
+def get_base_url():
+    """Адрес Bot API; для нагрузочных тестов - заглушка fake_bot_api.py"""
+    return os.environ.get('BOT_API_URL', 'https://api.telegram.org/bot')
+
+def build_request(get_updates=False):
+    """HTTP-клиент Bot API с пулом и таймаутами из BOT_* (частные - BOT_SEND_*/BOT_UPDATES_*)"""
+    # У getUpdates свой пул: длинный опрос не занимает соединения, нужные для отправки ответов
+    prefix = 'BOT_UPDATES_' if get_updates else 'BOT_SEND_'
+    defaults = HTTP_UPDATES_DEFAULTS if get_updates else HTTP_SEND_DEFAULTS
+
+    def setting(name):
+        return os.environ.get(prefix + name, os.environ.get('BOT_' + name, defaults[name]))
+
+    http_version = setting('HTTP_VERSION')
+    if http_version.startswith('2') and importlib.util.find_spec('h2') is None:
+        logging.warning("Для HTTP/2 нужен пакет h2 (pip install 'httpx[http2]'), используется HTTP/1.1")
+        http_version = '1.1'
+    # Клиент для отправки считает ожидание Bot API в трассах обновлений (profiling.py)
+    request_class = HTTPXRequest if get_updates else TracedRequest
+    return request_class(
+        connection_pool_size=int(setting('POOL_SIZE')),
+        connect_timeout=float(setting('CONNECT_TIMEOUT')),
+        read_timeout=float(setting('READ_TIMEOUT')),
+        write_timeout=float(setting('WRITE_TIMEOUT')),
+        pool_timeout=float(setting('POOL_TIMEOUT')),
+        http_version=http_version,
+    )
+
+def build_application(worker_index=0, workers=1):
+    """Собирает Application и SeminarBot (или ChatRouter при CHAT_STATE_DIR) по переменным окружения"""
+    # При нескольких процессах лимиты отправки делятся поровну, а доски и напоминания ведет процесс 0
+    outbox = Outbox(
+        global_rate=float(os.environ.get('SEND_GLOBAL_RATE', '30')) / workers,
+        chat_rate=float(os.environ.get('SEND_CHAT_RATE', '1')) / workers,
+        max_depth=int(os.environ.get('SEND_QUEUE_LIMIT', '2000')),
+    )
+    # Метрики слушают только локальный адрес; у каждого рабочего процесса свой порт
+    metrics_address = None
+    if os.environ.get('METRICS_PORT'):
+        metrics_address = (
+            os.environ.get('METRICS_HOST', '127.0.0.1'), int(os.environ['METRICS_PORT']) + worker_index
+        )
+    arbitration_window = float(os.environ.get('ARBITRATION_WINDOW', ARBITRATION_WINDOW))
+    # Накопившиеся обновления забираются через getUpdates - только при опросе в одном процессе
+    # и если включено DRAIN_BACKLOG
+    drain_backlog = (
+        workers == 1 and os.environ.get('BOT_MODE', 'polling') == 'polling'
+        and os.environ.get('DRAIN_BACKLOG', '0') == '1'
+    )
+    state_dir = os.environ.get('CHAT_STATE_DIR')
+    if state_dir:
+        bot = ChatRouter(
+            SeminarBot,
+            state_dir,
+            shared=workers > 1,
+            outbox=outbox,
+            leader=worker_index == 0,
+            arbitration_window=arbitration_window,
+            max_loaded=int(os.environ.get('MAX_LOADED_CHATS', MAX_LOADED_CHATS)),
+            idle_timeout=float(os.environ.get('CHAT_IDLE_TIMEOUT', CHAT_IDLE_TIMEOUT)),
+            metrics_address=metrics_address,
+            drain_backlog=drain_backlog,
+        )
+    else:
+        store_path = os.environ.get('STORE_PATH')
+        journal_path = os.environ.get('JOURNAL_PATH', 'seminar_journal.jsonl')
+        if store_path:
+            journal = SharedStore(store_path)
+        else:
+            journal = Journal(journal_path) if journal_path else None
+        bot = SeminarBot(
+            arbitration_window=arbitration_window,
+            journal=journal,
+            outbox=outbox,
+            leader=worker_index == 0,
+            metrics_address=metrics_address,
+            drain_backlog=drain_backlog,
+        )
+        bot.restore()
+    
+    # Трассировка каждого обновления: время обработчиков и ожидания Bot API, медленные - в лог
+    TRACER.always = os.environ.get('TRACE_UPDATES', '0') == '1'
+    TRACER.slow_update = float(os.environ.get('TRACE_SLOW_UPDATE', profiling.SLOW_UPDATE))
+    concurrent_updates = int(os.environ.get('CONCURRENT_UPDATES', '64'))
+    builder = (
+        Application.builder()
+        .token(get_token())
+        .base_url(get_base_url())
+        .request(build_request())
+        .get_updates_request(build_request(get_updates=True))
+        .concurrent_updates(PerUserUpdateProcessor(concurrent_updates))
+        .post_init(bot.post_init)
+        .post_stop(bot.post_stop)
+        .post_shutdown(bot.post_shutdown)
+    )
+    # Незавершенные диалоги (если задан PERSISTENCE_PATH); обновления одного пользователя
+    # всегда в одном процессе, поэтому файл свой у каждого
+    persistence_path = os.environ.get('PERSISTENCE_PATH')
+    if persistence_path:
+        if workers > 1:
+            persistence_path += f'.{worker_index}'
+        builder = builder.persistence(SQLitePersistence(
+            persistence_path, update_interval=float(os.environ.get('PERSISTENCE_INTERVAL', '5'))
+        ))
+    application = builder.build()
+    setup_handlers(application, bot)
+    return application, bot
+
+def main():
+    workers = int(os.environ.get('WORKERS', '1'))
+    if workers > 1:
+        if not os.environ.get('CHAT_STATE_DIR') and not os.environ.get('STORE_PATH'):
+            raise RuntimeError("Для нескольких процессов нужно общее хранилище STORE_PATH или CHAT_STATE_DIR")
+        from workers import run_workers
+        print(f"Бот запущен ({workers} процессов)...")
+        run_workers(workers, sys.modules[__name__])
+        return
+    
+    application, bot = build_application()
     
     print("Бот запущен...")
-    application.run_polling()
+    if os.environ.get('BOT_MODE', 'polling') == 'webhook':
+        from webhook import WebhookConfig, run_webhook
+        asyncio.run(run_webhook(application, WebhookConfig.from_env()))
+    else:
+        application.run_polling()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,149 @@
+"""Журнал предзаписи для состояния SeminarBot.
+
+Каждое изменение (предмет, время начала, занятие и освобождение темы)
+дописывается строкой JSON в файл журнала. Записи, пришедшие, пока идёт
+fsync предыдущей пачки, копятся и сбрасываются на диск одной пачкой
+(group commit), поэтому всплеск заявок платит за несколько fsync, а не
+за один на каждую заявку. После compact_every событий состояние целиком
+сохраняется в снимок, а журнал обрезается, чтобы восстановление после
+перезапуска оставалось быстрым.
+
+Все события журнала - идемпотентные «установить значение», поэтому
+событие, попавшее и в снимок, и в журнал после него, при повторном
+применении даёт то же состояние.
+"""
+import asyncio
+import json
+import logging
+import os
+
+
+class Journal:
+    # Журнал принадлежит одному процессу; общее для нескольких процессов хранилище - SharedStore
+    shared = False
+
+    def __init__(self, path, compact_every=5000):
+        self.path = path
+        self.snapshot_path = path + '.snapshot'
+        self.compact_every = compact_every
+        # Функция, возвращающая текущее состояние для снимка; задаётся владельцем журнала
+        self.snapshot_provider = None
+        self.events_since_snapshot = 0
+        self._file = None
+        self._pending = []
+        self._flusher = None
+
+    def load(self):
+        """Читает снимок и события после него: (снимок или None, список событий)"""
+        snapshot = None
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+
+        events = []
+        if os.path.exists(self.path):
+            valid_size = 0
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    try:
+                        events.append(json.loads(line))
+                    except ValueError:
+                        # Недописанная при падении строка: всё после неё отбрасываем
+                        logging.warning(f"Журнал {self.path} обрезан на позиции {valid_size}")
+                        break
+                    valid_size += len(line)
+            if valid_size != os.path.getsize(self.path):
+                with open(self.path, 'r+b') as f:
+                    f.truncate(valid_size)
+
+        self.events_since_snapshot = len(events)
+        return snapshot, events
+
+    def append(self, event):
+        """Ставит событие в очередь на запись; возвращает future, готовый после fsync"""
+        return self._enqueue(event, False)
+
+    def claim(self, event):
+        """Записывает заявку на тему; future вернет событие того, кто владеет темой.
+
+        В журнале одного процесса арбитраж уже сделан в памяти, поэтому
+        заявка всегда проходит и future возвращает само событие.
+        """
+        return self._enqueue(event, True)
+
+    def _enqueue(self, event, is_claim):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((event, is_claim, future))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = loop.create_task(self._flush_loop())
+        return future
+
+    async def _flush_loop(self):
+        while self._pending:
+            batch, self._pending = self._pending, []
+            try:
+                results = await asyncio.to_thread(
+                    self._write_batch, [(event, is_claim) for event, is_claim, _ in batch]
+                )
+            except Exception as e:
+                logging.error(f"Ошибка записи журнала: {e}")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+            self.events_since_snapshot += len(batch)
+            if self.snapshot_provider and self.events_since_snapshot >= self.compact_every:
+                await self.compact()
+
+    def _write_batch(self, batch):
+        """Пишет пачку событий одним fsync; возвращает результаты для future"""
+        data = ''.join(json.dumps(event, ensure_ascii=False) + '\n' for event, _ in batch)
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+        self._file.write(data.encode('utf-8'))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return [event if is_claim else None for event, is_claim in batch]
+
+    async def compact(self):
+        """Сохраняет снимок состояния и обрезает журнал"""
+        # Состояние снимаем в потоке цикла событий, чтобы оно было согласованным
+        state = self.snapshot_provider()
+        await asyncio.to_thread(self._write_snapshot, state)
+        self.events_since_snapshot = 0
+        logging.info(f"Журнал {self.path} сжат в снимок")
+
+    def _write_snapshot(self, state):
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        directory = os.path.dirname(os.path.abspath(self.snapshot_path))
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.path, 'wb')
+        os.fsync(self._file.fileno())
+
+    async def close(self):
+        """Дописывает очередь, сжимает журнал и закрывает файл"""
+        if self._flusher is not None:
+            await self._flusher
+        if self.snapshot_provider and self.events_since_snapshot:
+            await self.compact()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,212 @@
+"""Метрики бота в текстовом формате Prometheus.
+
+Небольшой реестр счетчиков, датчиков и гистограмм без внешних
+зависимостей. Все значения меняются в потоке цикла событий, и отдает их
+HTTP-сервер на том же цикле (asyncio.start_server), поэтому блокировки не
+нужны. Значение метрики может вычисляться функцией в момент запроса: так
+снимаются глубины очередей и счетчики, которые бот и так ведет.
+"""
+import asyncio
+import bisect
+import functools
+import logging
+import time
+
+# Границы гистограммы задержек, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._functions = {}
+        existing = (registry if registry is not None else REGISTRY).register(self)
+        if existing is not self:
+            # Тот же модуль загружен второй раз (gspd как __main__ и как gspd) - значения общие
+            self._values = existing._values
+            self._functions = existing._functions
+
+    def labels(self, *values):
+        return _Child(self, tuple(str(value) for value in values))
+
+    def set_function(self, function, *labels):
+        """Значение вычисляется function() при каждом запросе метрик"""
+        self._functions[tuple(str(label) for label in labels)] = function
+
+    def samples(self):
+        """Четверки (суффикс имени, значения меток, доп. метки, значение)"""
+        for labels, value in self._values.items():
+            yield '', labels, (), value
+        for labels, function in self._functions.items():
+            try:
+                value = function()
+            except Exception as e:
+                logging.error(f"Ошибка при вычислении метрики {self.name}: {e}")
+                continue
+            yield '', labels, (), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, extra, value in self.samples():
+            lines.append(
+                f"{self.name}{suffix}{_format_labels(self.labelnames, labels, extra)} {_format_value(value)}"
+            )
+        return '\n'.join(lines)
+
+
+class _Child:
+    __slots__ = ('metric', 'key')
+
+    def __init__(self, metric, key):
+        self.metric = metric
+        self.key = key
+
+    def inc(self, amount=1):
+        self.metric.inc(amount, self.key)
+
+    def set(self, value):
+        self.metric.set(value, self.key)
+
+    def observe(self, value):
+        self.metric.observe(value, self.key)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, key=()):
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, key=()):
+        self._values[key] = value
+
+    def inc(self, amount=1, key=()):
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, key=()):
+        state = self._values.get(key)
+        if state is None:
+            # Счетчики по корзинам (последняя - +Inf), сумма и количество
+            state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def time(self, *labels):
+        """Декоратор корутины: время ее выполнения попадает в гистограмму"""
+        key = tuple(str(label) for label in labels)
+
+        def decorator(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - started, key)
+            return wrapper
+        return decorator
+
+    def samples(self):
+        for labels, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                yield '_bucket', labels, (('le', _format_value(float(bound))),), cumulative
+            yield '_sum', labels, (), total
+            yield '_count', labels, (), count
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        """Регистрирует метрику; если такая же уже есть, возвращает ее, а не новую.
+
+        Повторное объявление с тем же именем, типом, метками и корзинами
+        бывает, когда модуль импортирован дважды; другое определение под
+        тем же именем - ошибка.
+        """
+        existing = self._metrics.get(metric.name)
+        if existing is None:
+            self._metrics[metric.name] = metric
+            return metric
+        if (type(existing), existing.labelnames, getattr(existing, 'buckets', None)) != \
+                (type(metric), metric.labelnames, getattr(metric, 'buckets', None)):
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована с другим определением")
+        return existing
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self._metrics.values()) + '\n'
+
+
+REGISTRY = Registry()
+
+
+async def serve(host, port, registry=REGISTRY):
+    """HTTP-сервер с метриками на GET /metrics; возвращает asyncio.Server"""
+
+    async def handle(reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            # Заголовки запроса не нужны, но их надо дочитать
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] in ('/metrics', '/'):
+                status, body = '200 OK', registry.render().encode('utf-8')
+            else:
+                status, body = '404 Not Found', b'not found\n'
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode('latin-1') + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logging.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,331 @@
+"""Очередь исходящих сообщений с учетом лимитов Telegram.
+
+Вместо того чтобы каждый обработчик сам ждал ответа Bot API, сообщения
+ставятся в очередь с классом приоритета. Диспетчер отправляет их с учетом
+общего лимита бота (около 30 сообщений в секунду) и лимита на один чат
+(около одного сообщения в секунду), начиная с подтверждений заявок.
+Доски и списки идут после ответов: сообщения с одинаковым coalesce_key
+склеиваются в одно, а при переполнении очереди именно они отбрасываются.
+Ниже всех - массовые рассылки подписчикам: они занимают только то, что
+остается от лимита после ответов участникам.
+На 429 чат приостанавливается на retry_after, сообщение остается в очереди.
+"""
+import asyncio
+import collections
+import logging
+
+from telegram.error import RetryAfter, TelegramError
+
+from profiling import current_span
+
+# Классы приоритета: чем меньше число, тем раньше уходит сообщение
+PRIORITY_CLAIM = 0
+PRIORITY_REPLY = 1
+PRIORITY_BOARD = 2
+PRIORITY_BULK = 3
+PRIORITIES = (PRIORITY_CLAIM, PRIORITY_REPLY, PRIORITY_BOARD, PRIORITY_BULK)
+PRIORITY_NAMES = {PRIORITY_CLAIM: 'claim', PRIORITY_REPLY: 'reply', PRIORITY_BOARD: 'board', PRIORITY_BULK: 'bulk'}
+# При скольких ведрах чатов начинать выбрасывать полные (чаты, куда давно ничего не отправлялось)
+CHAT_BUCKET_PRUNE_SIZE = 10_000
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity про запас"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'paused_until')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.paused_until = now
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now):
+        """Через сколько секунд можно будет взять токен"""
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now):
+        """Ведро полное и не на паузе - новое ведро вело бы себя так же"""
+        if now < self.paused_until:
+            return False
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+    def pause(self, now, seconds):
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0
+        self.updated = self.paused_until
+
+
+class OutgoingMessage:
+    __slots__ = ('priority', 'chat_id', 'method', 'kwargs', 'coalesce_key', 'futures', 'spans', 'queued_at')
+
+    def __init__(self, priority, chat_id, method, kwargs, coalesce_key, future, span=None, queued_at=0.0):
+        self.priority = priority
+        self.chat_id = chat_id
+        self.method = method
+        self.kwargs = kwargs
+        self.coalesce_key = coalesce_key
+        self.futures = [future]
+        # Трассы обновлений, ответы которых везет сообщение (profiling.py)
+        self.spans = [span] if span is not None else []
+        self.queued_at = queued_at
+
+
+class Outbox:
+    def __init__(self, global_rate=30.0, chat_rate=1.0, chat_burst=3, max_depth=2000,
+                 max_in_flight=16):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_depth = max_depth
+        self.max_in_flight = max_in_flight
+        self.bot = None
+        # приоритет -> {chat_id: deque}; порядок чатов в словаре дает обход по кругу
+        self._queues = {priority: {} for priority in PRIORITIES}
+        self._by_key = {}
+        self._chat_buckets = {}
+        self._prune_at = CHAT_BUCKET_PRUNE_SIZE
+        self._global_bucket = None
+        self._depth = 0
+        self._wakeup = asyncio.Event()
+        self._in_flight = None
+        self._sending = set()
+        self._dispatcher = None
+        self.stats = collections.Counter()
+
+    def start(self, bot):
+        loop = asyncio.get_running_loop()
+        self.bot = bot
+        self._global_bucket = TokenBucket(self.global_rate, self.global_rate, loop.time())
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        self._dispatcher = loop.create_task(self._dispatch_loop())
+
+    async def stop(self, timeout=5.0):
+        """Пытается дослать очередь за timeout секунд, дожидается начатых отправок и останавливает диспетчер"""
+        if self._dispatcher is None:
+            return
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._depth and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        self._dispatcher.cancel()
+        self._dispatcher = None
+        # Начатые запросы ограничены таймаутами HTTP-клиента, а их результат ждут обработчики
+        while self._sending:
+            await asyncio.wait(list(self._sending))
+        # Недосланное (или вернувшееся после 429) уже не уйдет
+        for chats in self._queues.values():
+            for queue in chats.values():
+                for item in queue:
+                    self._forget(item)
+                    self._settle(item, None)
+                    self.stats['dropped'] += 1
+            chats.clear()
+
+    def depth(self):
+        """Число сообщений в очереди по классам приоритета"""
+        return {
+            PRIORITY_NAMES[priority]: sum(len(queue) for queue in chats.values())
+            for priority, chats in self._queues.items()
+        }
+
+    def send_message(self, chat_id, text, priority=PRIORITY_REPLY, coalesce_key=None, **kwargs):
+        return self.submit('send_message', chat_id, priority, coalesce_key, text=text, **kwargs)
+
+    def edit_message_text(self, chat_id, message_id, text, priority=PRIORITY_BOARD,
+                          coalesce_key=None, **kwargs):
+        return self.submit('edit_message_text', chat_id, priority, coalesce_key,
+                           message_id=message_id, text=text, **kwargs)
+
+    def submit(self, method, chat_id, priority, coalesce_key=None, **kwargs):
+        """Ставит вызов метода бота в очередь.
+
+        Возвращает future с результатом вызова; None означает, что сообщение
+        отброшено при переполнении или не доставлено из-за ошибки.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        queued = self._by_key.get(coalesce_key) if coalesce_key is not None else None
+        if queued is not None:
+            # Более свежее содержимое заменяет еще не отправленное
+            queued.method = method
+            queued.kwargs = kwargs
+            queued.futures.append(future)
+            self._hold_span(queued)
+            self.stats['merged'] += 1
+            return future
+
+        if self._depth >= self.max_depth and not self._evict_below(priority):
+            self.stats['dropped'] += 1
+            future.set_result(None)
+            return future
+
+        item = OutgoingMessage(priority, chat_id, method, kwargs, coalesce_key, future, queued_at=loop.time())
+        self._hold_span(item)
+        self._queues[priority].setdefault(chat_id, collections.deque()).append(item)
+        if coalesce_key is not None:
+            self._by_key[coalesce_key] = item
+        self._depth += 1
+        self._wakeup.set()
+        return future
+
+    @staticmethod
+    def _hold_span(item):
+        """Трасса обновления, которое ставит сообщение в очередь, не закроется до его отправки"""
+        span = current_span()
+        if span is not None:
+            span.hold()
+            item.spans.append(span)
+
+    @staticmethod
+    def _settle(item, result):
+        for future in item.futures:
+            if not future.done():
+                future.set_result(result)
+        for span in item.spans:
+            span.release()
+
+    def _evict_below(self, priority):
+        """Освобождает место, выбрасывая самое свежее сообщение с приоритетом ниже priority"""
+        for lower in reversed(PRIORITIES):
+            if lower <= priority or lower == PRIORITY_CLAIM:
+                break
+            for chat_id, queue in reversed(list(self._queues[lower].items())):
+                item = queue.pop()
+                if not queue:
+                    del self._queues[lower][chat_id]
+                self._forget(item)
+                self._settle(item, None)
+                self.stats['dropped'] += 1
+                return True
+        return False
+
+    def _forget(self, item):
+        self._depth -= 1
+        if item.coalesce_key is not None and self._by_key.get(item.coalesce_key) is item:
+            del self._by_key[item.coalesce_key]
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self._prune_at:
+                self._prune_buckets(now)
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+
+    def _prune_buckets(self, now):
+        """Выбрасывает полные ведра чатов: после рассылки по личным чатам их остаются тысячи"""
+        for chat_id in [chat_id for chat_id, bucket in self._chat_buckets.items() if bucket.is_full(now)]:
+            del self._chat_buckets[chat_id]
+        # Следующая чистка - когда ведер станет вдвое больше оставшихся, чтобы не перебирать их на каждом чате
+        self._prune_at = max(CHAT_BUCKET_PRUNE_SIZE, 2 * len(self._chat_buckets))
+
+    def _pick(self, now):
+        """Следующее сообщение, которое можно отправить сейчас, или время ожидания"""
+        wait = None
+        for priority in PRIORITIES:
+            chats = self._queues[priority]
+            for chat_id in list(chats):
+                chat_wait = self._chat_bucket(chat_id, now).wait_time(now)
+                if chat_wait == 0:
+                    queue = chats.pop(chat_id)
+                    item = queue.popleft()
+                    if queue:
+                        # Чат уходит в конец круга, чтобы один чат не занимал всю очередь
+                        chats[chat_id] = queue
+                    return item, None
+                wait = chat_wait if wait is None else min(wait, chat_wait)
+        return None, wait
+
+    async def _dispatch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._depth:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = loop.time()
+            global_wait = self._global_bucket.wait_time(now)
+            if global_wait:
+                await asyncio.sleep(global_wait)
+                continue
+
+            item, wait = self._pick(now)
+            if item is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._forget(item)
+            self._global_bucket.take(now)
+            self._chat_bucket(item.chat_id, now).take(now)
+            await self._in_flight.acquire()
+            task = loop.create_task(self._send(item))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, item):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        retry_after = None
+        try:
+            result = await getattr(self.bot, item.method)(chat_id=item.chat_id, **item.kwargs)
+            self.stats['sent'] += 1
+        except RetryAfter as e:
+            self.stats['retried'] += 1
+            retry_after = e.retry_after
+        except TelegramError as e:
+            if 'not modified' in str(e):
+                # Доска уже показывает этот текст - для вызывающего это успех
+                result = True
+            else:
+                self.stats['failed'] += 1
+                logging.error(f"Ошибка при отправке в {item.chat_id} ({item.method}): {e}")
+                result = None
+        finally:
+            self._in_flight.release()
+
+        # До _settle: он закрывает трассы, и неудачная попытка в них бы уже не попала
+        now = loop.time()
+        for span in item.spans:
+            span.add_send(started - item.queued_at, now - started)
+        if retry_after is not None:
+            self._chat_bucket(item.chat_id, now).pause(now, retry_after)
+            self._requeue(item)
+        else:
+            self._settle(item, result)
+
+    def _requeue(self, item):
+        """Возвращает сообщение в начало очереди своего чата"""
+        item.queued_at = asyncio.get_running_loop().time()
+        queued = self._by_key.get(item.coalesce_key) if item.coalesce_key is not None else None
+        if queued is not None:
+            queued.futures.extend(item.futures)
+            queued.spans.extend(item.spans)
+            return
+        self._queues[item.priority].setdefault(item.chat_id, collections.deque()).appendleft(item)
+        if item.coalesce_key is not None:
+            self._by_key[item.coalesce_key] = item
+        self._depth += 1
+        self._wakeup.set()
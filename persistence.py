@@ -0,0 +1,174 @@
+"""Хранение диалогов (ConversationHandler) и context.user_data между перезапусками.
+
+Application раз в update_interval передает в хранилище данные
+пользователей, у которых были обновления, и состояния диалогов, которые
+менялись. Хранилище пишет из них только то, что действительно изменилось
+с прошлой записи, - одной транзакцией SQLite в отдельном потоке. Обработка
+обновлений записи не ждет, поэтому задержка ответов не растет; после
+падения теряется не больше последнего интервала.
+"""
+import asyncio
+import json
+import logging
+import pickle
+import sqlite3
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+# Как часто Application передает изменения в хранилище, секунды
+FLUSH_INTERVAL = 5.0
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS user_data (
+    user_id INTEGER PRIMARY KEY,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state BLOB NOT NULL,
+    PRIMARY KEY (name, key)
+);
+'''
+
+
+class SQLitePersistence(BasePersistence):
+    """Пишет только изменившиеся записи пользователей и диалогов пачками.
+
+    Хранятся только user_data и состояния диалогов: chat_data, bot_data и
+    callback_data бот не использует.
+    """
+
+    def __init__(self, path, update_interval=FLUSH_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = path
+        self._conn = None
+        # Что лежит в базе сейчас (в виде pickle) - чтобы не переписывать неизменившееся
+        self._stored_users = {}
+        self._stored_conversations = {}
+        # Изменения, ждущие записи: ключ -> pickle или None (удалить)
+        self._pending_users = {}
+        self._pending_conversations = {}
+        self._writer = None
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    async def get_user_data(self):
+        rows = await asyncio.to_thread(lambda: self._connect().execute('SELECT user_id, data FROM user_data').fetchall())
+        self._stored_users = dict(rows)
+        return {user_id: pickle.loads(data) for user_id, data in rows}
+
+    async def get_conversations(self, name):
+        rows = await asyncio.to_thread(lambda: self._connect().execute(
+            'SELECT key, state FROM conversations WHERE name = ?', (name,)
+        ).fetchall())
+        conversations = {}
+        for key, state in rows:
+            self._stored_conversations[(name, key)] = state
+            conversations[tuple(json.loads(key))] = pickle.loads(state)
+        return conversations
+
+    async def update_user_data(self, user_id, data):
+        # Пустые user_data у тех, кого в базе нет, писать незачем
+        value = pickle.dumps(data) if data else None
+        self._stage(self._pending_users, self._stored_users, user_id, value)
+
+    async def drop_user_data(self, user_id):
+        self._stage(self._pending_users, self._stored_users, user_id, None)
+
+    async def update_conversation(self, name, key, new_state):
+        value = None if new_state is None else pickle.dumps(new_state)
+        self._stage(self._pending_conversations, self._stored_conversations, (name, json.dumps(key)), value)
+
+    def _stage(self, pending, stored, key, value):
+        if stored.get(key) == value:
+            pending.pop(key, None)
+            return
+        pending[key] = value
+        # Все update_* одного прохода Application выполняются до того, как запустится запись
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.get_running_loop().create_task(self._write_pending())
+
+    async def _write_pending(self):
+        while self._pending_users or self._pending_conversations:
+            users, self._pending_users = self._pending_users, {}
+            conversations, self._pending_conversations = self._pending_conversations, {}
+            try:
+                await asyncio.to_thread(self._write, users, conversations)
+            except Exception as e:
+                logging.error(f"Ошибка записи диалогов в {self.path}: {e}")
+                # Вернем изменения в очередь, если их не перекрыли более новые
+                for key, value in users.items():
+                    self._pending_users.setdefault(key, value)
+                for key, value in conversations.items():
+                    self._pending_conversations.setdefault(key, value)
+                return
+            for stored, written in ((self._stored_users, users), (self._stored_conversations, conversations)):
+                for key, value in written.items():
+                    if value is None:
+                        stored.pop(key, None)
+                    else:
+                        stored[key] = value
+
+    def _write(self, users, conversations):
+        conn = self._connect()
+        conn.execute('BEGIN')
+        try:
+            conn.executemany('DELETE FROM user_data WHERE user_id = ?',
+                             [(user_id,) for user_id, data in users.items() if data is None])
+            conn.executemany('INSERT OR REPLACE INTO user_data (user_id, data) VALUES (?, ?)',
+                             [(user_id, data) for user_id, data in users.items() if data is not None])
+            conn.executemany('DELETE FROM conversations WHERE name = ? AND key = ?',
+                             [key for key, state in conversations.items() if state is None])
+            conn.executemany('INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)',
+                             [(*key, state) for key, state in conversations.items() if state is not None])
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    async def flush(self):
+        if self._writer is not None:
+            await self._writer
+        await self._write_pending()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def get_chat_data(self):
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def get_bot_data(self):
+        return {}
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
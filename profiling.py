@@ -0,0 +1,290 @@
+"""Профилирование работающего бота по команде администратора.
+
+Все обработчики выполняются в одном потоке цикла событий, поэтому
+профилировать достаточно его:
+
+- profile_loop включает cProfile в потоке цикла на заданное время -
+  точные счетчики вызовов, но каждый вызов функции заметно дороже;
+- sample_loop раз в SAMPLE_INTERVAL снимает стек потока цикла из
+  отдельного потока (sys._current_frames) - бот почти не замедляется,
+  доли времени получаются приблизительными.
+
+Трассировка обновлений: у обновления заводится Span (contextvars), в
+который обработчики (instrument в gspd.py) пишут свое время, HTTP-клиент
+(TracedRequest) - время вызовов Bot API из обработчика, а очередь
+исходящих (outbox.py) - сколько ответы обновления ждали в очереди и
+отправлялись. Трасса считается законченной, когда отправлен последний из
+ответов, поставленных в очередь самим обработчиком (задачи, которые он
+запустил, например обновление доски, в нее не входят). Так видно, что
+медленнее - собственный код обработчика, очередь или Telegram.
+Трассировка включается переменной TRACE_UPDATES и на время /profile;
+выключенная, она стоит одной проверки флага на обновление и одного
+ContextVar.get на вызов API и на сообщение в очереди.
+"""
+import asyncio
+import collections
+import contextvars
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+
+from telegram.request import HTTPXRequest
+
+import metrics
+
+# Период снятия стека при профилировании выборками, секунды
+SAMPLE_INTERVAL = 0.005
+# Сколько строк в каждой таблице отчета
+TOP_FUNCTIONS = 40
+# Обновления дольше этого попадают в лог при включенной трассировке, секунды
+SLOW_UPDATE = 1.0
+
+UPDATE_TIME = metrics.Histogram(
+    'seminar_update_seconds', 'Время обработки обновления при трассировке по частям', ['part']
+)
+
+# Трасса обновления, которое обрабатывается в текущей задаче
+CURRENT_SPAN = contextvars.ContextVar('update_span', default=None)
+
+
+def current_span():
+    """Трасса обновления, если код выполняется в задаче самого обновления, иначе None"""
+    span = CURRENT_SPAN.get()
+    if span is None or span.task is not asyncio.current_task():
+        return None
+    return span
+
+
+class Span:
+    """Время одного обновления: всего, в обработчиках, в очереди исходящих и в ожидании Bot API.
+
+    api_time - вызовы Bot API прямо из обработчика (входят в handler_time),
+    send_time и queue_time - отправка и ожидание ответов из очереди исходящих.
+    Трасса открыта, пока обновление обрабатывается или есть неотправленные
+    ответы (hold/release).
+    """
+    __slots__ = ('tracer', 'task', 'started', 'handlers', 'handler_time', 'api_time', 'api_calls',
+                 'send_time', 'queue_time', 'sends', '_holds')
+
+    def __init__(self, tracer):
+        self.tracer = tracer
+        self.task = asyncio.current_task()
+        self.started = time.perf_counter()
+        self.handlers = []
+        self.handler_time = 0.0
+        self.api_time = 0.0
+        self.api_calls = 0
+        self.send_time = 0.0
+        self.queue_time = 0.0
+        self.sends = 0
+        self._holds = 1
+
+    def hold(self):
+        self._holds += 1
+
+    def release(self):
+        self._holds -= 1
+        if not self._holds:
+            self.tracer.complete(self)
+
+    def add_send(self, queued, sent):
+        """Ответ из очереди исходящих ждал queued секунд и отправлялся sent секунд"""
+        self.queue_time += queued
+        self.send_time += sent
+        self.sends += 1
+
+
+class UpdateTracer:
+    """Заводит Span на обновление и собирает законченные трассы.
+
+    always - трассировать постоянно (TRACE_UPDATES); иначе трассы пишутся,
+    только пока открыт хотя бы один сбор (collect), например на время /profile.
+    """
+
+    def __init__(self, always=False, slow_update=SLOW_UPDATE):
+        self.always = always
+        self.slow_update = slow_update
+        self._collectors = []
+
+    @property
+    def enabled(self):
+        return self.always or bool(self._collectors)
+
+    def start(self):
+        """Span нового обновления и токен для finish; None, если трассировка выключена"""
+        if not self.enabled:
+            return None
+        span = Span(self)
+        return span, CURRENT_SPAN.set(span)
+
+    def finish(self, started):
+        """Обработчики обновления закончили; трасса закроется, когда уйдут его ответы из очереди"""
+        span, token = started
+        CURRENT_SPAN.reset(token)
+        span.release()
+
+    def complete(self, span):
+        total = time.perf_counter() - span.started
+        own = max(span.handler_time - span.api_time, 0.0)
+        api = span.api_time + span.send_time
+        # (обработчики, всего, свой код, Bot API, очередь исходящих, вызовов Bot API)
+        record = ('+'.join(span.handlers) or '-', total, own, api, span.queue_time, span.api_calls + span.sends)
+        UPDATE_TIME.labels('total').observe(total)
+        UPDATE_TIME.labels('handler').observe(own)
+        UPDATE_TIME.labels('api').observe(api)
+        UPDATE_TIME.labels('queue').observe(span.queue_time)
+        if total >= self.slow_update:
+            logging.info(
+                f"Медленное обновление ({record[0]}): {total:.3f} с, код обработчиков {own:.3f} с, "
+                f"Bot API {api:.3f} с ({record[5]} вызовов), очередь исходящих {span.queue_time:.3f} с"
+            )
+        for records in self._collectors:
+            records.append(record)
+
+    def collect(self):
+        """Начинает сбор трасс; вернет список, который пополняется до stop_collecting"""
+        records = []
+        self._collectors.append(records)
+        return records
+
+    def stop_collecting(self, records):
+        self._collectors.remove(records)
+
+
+TRACER = UpdateTracer()
+
+
+class TracedRequest(HTTPXRequest):
+    """HTTPXRequest, который добавляет время запроса к трассе текущего обновления"""
+
+    async def do_request(self, *args, **kwargs):
+        span = current_span()
+        if span is None:
+            return await super().do_request(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return await super().do_request(*args, **kwargs)
+        finally:
+            span.api_time += time.perf_counter() - started
+            span.api_calls += 1
+
+
+# Профилировщик в процессе может быть только один
+_running = False
+
+
+def start_profile(mode, seconds):
+    """Задача профилирования ('cprofile' или 'sample') с отчетом; None, если профилирование уже идет.
+
+    К отчету добавляется сводка трасс обновлений за то же время.
+    """
+    global _running
+    if _running:
+        return None
+    _running = True
+    return asyncio.ensure_future(_profile(mode, seconds))
+
+
+async def _profile(mode, seconds):
+    global _running
+    records = TRACER.collect()
+    try:
+        report = await (sample_loop(seconds) if mode == 'sample' else profile_loop(seconds))
+    finally:
+        TRACER.stop_collecting(records)
+        _running = False
+    return report + "\n" + trace_report(records)
+
+
+async def profile_loop(seconds):
+    """cProfile потока цикла событий на seconds секунд; отчет pstats текстом"""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.disable()
+    buffer = io.StringIO()
+    stats = pstats.Stats(profiler, stream=buffer)
+    stats.strip_dirs()
+    buffer.write(f"cProfile цикла событий за {seconds} с\n\nПо собственному времени (tottime):\n")
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(TOP_FUNCTIONS)
+    buffer.write("\nС учетом вложенных вызовов (cumtime):\n")
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+    return buffer.getvalue()
+
+
+def _frame_key(code):
+    return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}({code.co_name})"
+
+
+async def sample_loop(seconds, interval=SAMPLE_INTERVAL):
+    """Выборки стека потока цикла событий раз в interval в течение seconds секунд; отчет текстом"""
+    loop_thread = threading.get_ident()
+    own = collections.Counter()
+    inclusive = collections.Counter()
+    samples = 0
+    stop = threading.Event()
+
+    def run():
+        nonlocal samples
+        while not stop.wait(interval):
+            frame = sys._current_frames().get(loop_thread)
+            if frame is None:
+                continue
+            own[frame.f_code] += 1
+            codes = set()
+            while frame is not None:
+                codes.add(frame.f_code)
+                frame = frame.f_back
+            inclusive.update(codes)
+            samples += 1
+
+    sampler = threading.Thread(target=run, name='loop-sampler', daemon=True)
+    sampler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        stop.set()
+        await asyncio.to_thread(sampler.join)
+    lines = [f"Выборки стека цикла событий за {seconds} с: {samples} выборок раз в {interval * 1000:g} мс"]
+    for title, counter in (("Где выполнялся код (собственное время)", own),
+                           ("С учетом вложенных вызовов", inclusive)):
+        lines.append(f"\n{title}:\n{'доля':>7} {'выборок':>8}  функция")
+        for code, count in counter.most_common(TOP_FUNCTIONS):
+            lines.append(f"{count / max(samples, 1):7.1%} {count:>8}  {_frame_key(code)}")
+    return "\n".join(lines) + "\n"
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def trace_report(records):
+    """Сводка трасс обновлений по обработчикам: сколько, время всего и ожидание Bot API"""
+    if not records:
+        return "Трассы обновлений: обновлений не было.\n"
+    groups = collections.defaultdict(list)
+    for record in records:
+        groups[record[0]].append(record)
+    lines = [
+        f"Трассы обновлений: {len(records)}. Время, мс: всего до отправки последнего ответа (p50/p95/max); "
+        f"в среднем - код обработчиков, Bot API и ожидание в очереди исходящих",
+        f"{'обработчик':<28} {'число':>6} {'p50':>8} {'p95':>8} {'max':>8} {'код':>8} {'API':>8} "
+        f"{'очередь':>8} {'вызовов':>8}",
+    ]
+    for name, group in sorted(groups.items(), key=lambda item: -sum(record[1] for record in item[1])):
+        totals = [record[1] for record in group]
+        own, api, queued, calls = (sum(record[i] for record in group) / len(group) for i in range(2, 6))
+        lines.append(
+            f"{name[:28]:<28} {len(group):>6} {_percentile(totals, 0.5) * 1000:8.1f} "
+            f"{_percentile(totals, 0.95) * 1000:8.1f} {max(totals) * 1000:8.1f} "
+            f"{own * 1000:8.1f} {api * 1000:8.1f} {queued * 1000:8.1f} {calls:8.1f}"
+        )
+    return "\n".join(lines) + "\n"
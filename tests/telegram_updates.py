@@ -0,0 +1,91 @@
+"""Обновления Telegram в виде JSON и Application на подмененном транспорте для тестов"""
+import contextlib
+import itertools
+import time
+
+from telegram import Update
+from telegram.ext import Application
+
+import bench_rush
+import gspd
+from update_processing import PerUserUpdateProcessor
+
+ADMIN = 1074399585
+CHAT = {'id': -100, 'type': 'supergroup'}
+_ids = itertools.count(1)
+
+
+def user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': 'S', 'username': f's{user_id}'}
+
+
+def message(user_id, text, chat=CHAT, date=None):
+    data = {
+        'message_id': next(_ids), 'date': int(time.time() if date is None else date), 'chat': chat,
+        'from': user(user_id), 'text': text,
+    }
+    if text.startswith('/'):
+        data['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': next(_ids), 'message': data}
+
+
+def button(user_id, data, chat=CHAT):
+    return {'update_id': next(_ids), 'callback_query': {
+        'id': str(next(_ids)), 'from': user(user_id), 'chat_instance': '1', 'data': data,
+        'message': {'message_id': 1, 'date': int(time.time()), 'chat': chat, 'text': 'board'},
+    }}
+
+
+class BacklogRequest(bench_rush.FakeRequest):
+    """Транспорт для getUpdates: отдает накопившиеся обновления с учетом offset"""
+
+    def __init__(self, updates):
+        super().__init__()
+        self.updates = updates
+
+    @property
+    def read_timeout(self):
+        return 0
+
+    def _result(self, api_method, params):
+        if api_method != 'getUpdates':
+            return super()._result(api_method, params)
+        offset = params.get('offset') or 0
+        pending = [update for update in self.updates if update['update_id'] >= offset]
+        return pending[:params.get('limit', 100)]
+
+
+@contextlib.asynccontextmanager
+async def running_application(bot, request=None, updates_request=None):
+    """Запущенный Application с обработчиками бота; request - bench_rush.FakeRequest"""
+    request = request or bench_rush.FakeRequest()
+    application = (
+        Application.builder().token(bench_rush.BENCH_TOKEN).request(request)
+        .get_updates_request(updates_request or bench_rush.FakeRequest()).updater(None)
+        .concurrent_updates(PerUserUpdateProcessor(8)).build()
+    )
+    gspd.setup_handlers(application, bot)
+    async with application:
+        await bot.post_init(application)
+        await application.start()
+        try:
+            yield application
+        finally:
+            await application.stop()
+            await bot.post_stop(application)
+            await bot.post_shutdown(application)
+
+
+async def feed(application, updates):
+    """Передает обновления по одному, дожидаясь обработки каждого"""
+    for data in updates:
+        await application.update_queue.put(Update.de_json(data, application.bot))
+        await application.update_queue.join()
+
+
+async def run_updates(bot, updates, request=None):
+    """Обрабатывает обновления и возвращает вызовы Bot API"""
+    request = request or bench_rush.FakeRequest()
+    async with running_application(bot, request) as application:
+        await feed(application, updates)
+    return request.calls
@@ -0,0 +1,91 @@
+import asyncio
+import datetime
+
+import gspd
+from update_processing import USER_LOCK
+
+SUBJECT = 'Физика'
+
+
+def order_key(seconds, update_id):
+    return (datetime.datetime(2024, 1, 1, 10, 0, seconds, tzinfo=datetime.timezone.utc), update_id)
+
+
+def test_arbitration_prefers_earliest_telegram_time():
+    bot = gspd.SeminarBot(arbitration_window=0.05)
+    bot.topics[SUBJECT] = {n: f'тема {n}' for n in range(1, 4)}
+
+    async def run():
+        # Корутины заявок стартуют не в том порядке, в каком сообщения пришли в Telegram
+        claims = [
+            bot.claim_topic(SUBJECT, 1, user_id, f'u{user_id}', order_key(seconds, update_id))
+            for user_id, seconds, update_id in ((1, 3, 30), (2, 1, 12), (3, 1, 11), (4, 2, 20))
+        ]
+        results = await asyncio.gather(*claims)
+        late = await bot.claim_topic(SUBJECT, 1, 5, 'u5', order_key(0, 1))
+        return results, late
+
+    results, late = asyncio.run(run())
+    # При равном времени Telegram побеждает меньший update_id
+    assert results == [False, False, True, False]
+    assert bot.registrations[SUBJECT][1][0] == 3
+    # Заявка после окна арбитража застает тему занятой, даже если она «раньше»
+    assert late is False
+    assert not bot.pending_claims
+
+
+def test_uncontested_claim_does_not_wait_for_window():
+    bot = gspd.SeminarBot(arbitration_window=5.0)
+    bot.topics[SUBJECT] = {n: f'тема {n}' for n in range(1, 4)}
+
+    async def run():
+        return await asyncio.wait_for(bot.claim_topic(SUBJECT, 1, 1, 'u1', order_key(0, 1)), 1.0)
+
+    assert asyncio.run(run()) is True
+    assert bot.registrations[SUBJECT][1][0] == 1
+
+
+def test_window_is_waited_without_user_lock():
+    window = 0.3
+    bot = gspd.SeminarBot(arbitration_window=window)
+    bot.topics[SUBJECT] = {n: f'тема {n}' for n in range(1, 4)}
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        lock = asyncio.Lock()
+
+        async def claim_under_user_lock():
+            async with lock:
+                USER_LOCK.set(lock)
+                return await bot.claim_topic(SUBJECT, 1, 1, 'u1', order_key(2, 20))
+
+        async def next_update_of_same_user():
+            await asyncio.sleep(0.01)
+            async with lock:
+                return loop.time()
+
+        started = loop.time()
+        results = await asyncio.gather(
+            claim_under_user_lock(), bot.claim_topic(SUBJECT, 1, 2, 'u2', order_key(1, 10)), next_update_of_same_user()
+        )
+        return results[:2], results[2] - started
+
+    results, unlocked_after = asyncio.run(run())
+    assert results == [False, True]
+    assert unlocked_after < window
+
+
+def test_user_gets_one_topic_from_concurrent_claims():
+    bot = gspd.SeminarBot(arbitration_window=0.05)
+    bot.topics[SUBJECT] = {n: f'тема {n}' for n in range(1, 4)}
+
+    async def run():
+        return await asyncio.gather(
+            bot.claim_topic(SUBJECT, 1, 1, 'u1', order_key(1, 10)),
+            bot.claim_topic(SUBJECT, 1, 2, 'u2', order_key(2, 20)),
+            bot.claim_topic(SUBJECT, 2, 1, 'u1', order_key(3, 30)),
+        )
+
+    assert asyncio.run(run()) == [True, False, False]
+    assert list(bot.registrations[SUBJECT]) == [1]
+    assert not bot.user_pending_claims
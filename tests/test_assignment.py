@@ -0,0 +1,57 @@
+import itertools
+import random
+
+from assignment import assign
+
+
+def placement_cost(preferences, result):
+    """(сумма мест, сумма мест с весом очередности) так, как их считает assign"""
+    count = len(preferences)
+    depth = max((len(topics) for _, topics in preferences), default=0)
+    places = first = 0
+    for row, (key, topics) in enumerate(preferences):
+        topic = result.get(key)
+        place = topics.index(topic) + 1 if topic is not None else depth + 1
+        places += place
+        first += (count - row) * place
+    return places, first
+
+
+def brute_force(preferences, available):
+    """Стоимость лучшего распределения полным перебором"""
+    options = [
+        [None] + list(dict.fromkeys(topic for topic in topics if topic in available))
+        for _, topics in preferences
+    ]
+    best = None
+    for choice in itertools.product(*options):
+        taken = [topic for topic in choice if topic is not None]
+        if len(taken) != len(set(taken)):
+            continue
+        result = {key: topic for (key, _), topic in zip(preferences, choice) if topic is not None}
+        cost = placement_cost(preferences, result)
+        best = cost if best is None else min(best, cost)
+    return best
+
+
+def test_assign_matches_brute_force():
+    rng = random.Random(7)
+    for _ in range(300):
+        topics = rng.randint(1, 6)
+        available = set(rng.sample(range(1, topics + 1), rng.randint(1, topics)))
+        preferences = [
+            (f'u{row}', [rng.randint(1, topics) for _ in range(rng.randint(0, 4))])
+            for row in range(rng.randint(0, 5))
+        ]
+        result = assign(preferences, available)
+        wishes = dict(preferences)
+        assert len(set(result.values())) == len(result)
+        assert all(topic in available and topic in wishes[key] for key, topic in result.items())
+        assert placement_cost(preferences, result) == brute_force(preferences, available)
+
+
+def test_assign_breaks_ties_by_submission_order():
+    # Оба хотят только тему 1: ее получает тот, кто прислал список раньше
+    assert assign([('a', [1]), ('b', [1])], {1, 2}) == {'a': 1}
+    # Цепочка перестановок: b уступает первое желание, чтобы a получил хоть что-то
+    assert assign([('a', [1]), ('b', [1, 2])], {1, 2}) == {'a': 1, 'b': 2}
@@ -0,0 +1,94 @@
+import asyncio
+import datetime
+import json
+
+import bench_rush
+import gspd
+from chat_router import ChatRouter
+from telegram_updates import BacklogRequest, message, running_application
+
+START = datetime.datetime(2024, 3, 1, 12, 0)
+
+
+def sent(seconds):
+    """Время Telegram (UTC, секунды) для московского START + seconds"""
+    moment = START + datetime.timedelta(seconds=seconds) - datetime.timedelta(hours=3)
+    return moment.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def open_subject(bot, start=START):
+    bot.apply_event({'op': 'subject', 'subject': 'Физика', 'topics': [[n, f'тема {n}'] for n in range(1, 4)]})
+    bot.apply_event({'op': 'start_time', 'subject': 'Физика', 'at': start.isoformat()})
+
+
+def drain(bot, updates):
+    """Запускает бота с накопившимися обновлениями; (запросы getUpdates, ответы {message_id: [тексты]})"""
+    request = bench_rush.FakeRequest()
+    updates_request = BacklogRequest(updates)
+
+    async def run():
+        async with running_application(bot, request, updates_request) as application:
+            await application.update_queue.join()
+
+    asyncio.run(run())
+    replies = {}
+    for method, params, _ in request.calls:
+        if method == 'sendMessage' and 'reply_parameters' in params:
+            reply_to = params['reply_parameters']
+            if isinstance(reply_to, str):
+                reply_to = json.loads(reply_to)
+            replies.setdefault(reply_to['message_id'], []).append(params['text'])
+    fetches = [params for method, params, _ in updates_request.calls if method == 'getUpdates']
+    return fetches, replies
+
+
+def message_id(update):
+    return update['message']['message_id']
+
+
+def test_drain_orders_by_date_dedupes_and_answers_everyone():
+    bot = gspd.SeminarBot(arbitration_window=0.0, drain_backlog=True)
+    open_subject(bot)
+    late = message(1, '2', date=sent(5))
+    early = message(2, '2', date=sent(3))
+    repeat = message(2, '2', date=sent(4))
+    before_open = message(3, '1', date=sent(-10))
+    missing = message(4, '9', date=sent(6))
+    command = message(5, '/list_subjects', date=sent(7))
+    updates = [late, early, repeat, before_open, missing, command]
+    fetches, replies = drain(bot, updates)
+
+    # Тему получает тот, кто раньше отправил номер, хотя его обновление пришло позже
+    assert bot.registrations['Физика'][2][0] == 2
+    assert replies[message_id(early)][0].startswith("🎉 Тема выбрана!")
+    # Повтор того же номера не дает второго ответа
+    assert message_id(repeat) not in replies
+    assert replies[message_id(late)][0].startswith("Эта тема уже занята!")
+    assert "до открытия" in replies[message_id(before_open)][0]
+    assert 1 not in bot.registrations['Физика']
+    assert replies[message_id(missing)] == ["Такой темы не существует."]
+    # Команда не заявка: ее обрабатывает обычный обработчик после разбора
+    assert len(replies[message_id(command)]) == 1
+    # Последний пустой getUpdates подтверждает все забранные обновления
+    assert fetches[-1]['offset'] == command['update_id'] + 1
+
+
+def test_drain_without_active_subject_answers_each_sender_once():
+    bot = gspd.SeminarBot(arbitration_window=0.0, drain_backlog=True)
+    open_subject(bot, start=bot.get_local_time() + datetime.timedelta(hours=1))
+    updates = [message(1, '1', date=sent(1)), message(1, '2', date=sent(2)), message(2, '3', date=sent(3))]
+    _, replies = drain(bot, updates)
+
+    assert not bot.registrations['Физика']
+    texts = [text for texts in replies.values() for text in texts]
+    assert texts == [bot.no_active_reply()] * 2
+
+
+def test_router_drain_answers_in_each_chat(tmp_path):
+    router = ChatRouter(gspd.SeminarBot, str(tmp_path), drain_backlog=True)
+    other = {'id': -200, 'type': 'supergroup'}
+    updates = [message(1, '1', date=sent(1)), message(1, '1', chat=other, date=sent(2))]
+    _, replies = drain(router, updates)
+
+    assert sorted(replies) == sorted(message_id(update) for update in updates)
+    assert all(texts == ["Нет активных распределений."] for texts in replies.values())
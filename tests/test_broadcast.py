@@ -0,0 +1,82 @@
+import asyncio
+import datetime
+
+from telegram.error import Forbidden, RetryAfter
+
+import bench_rush
+import gspd
+from outbox import Outbox
+from telegram_updates import feed, message, running_application
+
+SUBJECT = 'Физика'
+
+
+class PrivateChats:
+    """Бот для личных сообщений: считает одновременные отправки, часть чатов отвечает ошибками"""
+
+    def __init__(self, blocked=(), busy=()):
+        self.blocked = set(blocked)
+        self.busy = set(busy)
+        self.sent = []
+        self.in_flight = self.max_in_flight = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.001)
+            if chat_id in self.blocked:
+                raise Forbidden("bot was blocked by the user")
+            if chat_id in self.busy:
+                self.busy.discard(chat_id)
+                raise RetryAfter(0)
+            self.sent.append(chat_id)
+            return text
+        finally:
+            self.in_flight -= 1
+
+
+def test_broadcast_in_batches_with_retries(monkeypatch):
+    monkeypatch.setattr(gspd, 'BROADCAST_RATE', 10_000.0)
+    bot = gspd.SeminarBot()
+    recipients = list(range(1, 46))
+    private = PrivateChats(blocked={3}, busy={4})
+    delivered = asyncio.run(bot.broadcast(SUBJECT, recipients, "открыто", private))
+    assert delivered == 44
+    assert sorted(private.sent) == [chat_id for chat_id in recipients if chat_id != 3]
+    assert private.max_in_flight == gspd.BROADCAST_BATCH_SIZE
+
+
+def test_broadcast_through_outbox():
+    async def run():
+        private = PrivateChats(blocked={2})
+        outbox = Outbox(global_rate=1000.0)
+        outbox.start(private)
+        bot = gspd.SeminarBot(outbox=outbox)
+        delivered = await bot.broadcast(SUBJECT, [1, 2, 3], "открыто", private)
+        await outbox.stop()
+        return delivered, private.sent
+
+    delivered, sent = asyncio.run(run())
+    assert delivered == 2
+    assert sorted(sent) == [1, 3]
+
+
+def test_subscribers_are_notified_when_distribution_opens():
+    bot = gspd.SeminarBot()
+    bot.apply_event({'op': 'subject', 'subject': SUBJECT, 'topics': [[1, 'тема']]})
+    request = bench_rush.FakeRequest()
+
+    async def run():
+        async with running_application(bot, request) as application:
+            await feed(application, [message(user_id, '/subscribe 1') for user_id in (7, 8)])
+            start = bot.get_local_time() + datetime.timedelta(seconds=0.3)
+            await bot.record({'op': 'start_time', 'subject': SUBJECT, 'at': start.isoformat()})
+            await asyncio.sleep(0.8)
+
+    asyncio.run(run())
+    # Подписчикам пишут в личку (положительный chat_id), ответы на /subscribe ушли в группу
+    private = sorted(
+        params['chat_id'] for method, params, _ in request.calls if method == 'sendMessage' and params['chat_id'] > 0
+    )
+    assert private == [7, 8]
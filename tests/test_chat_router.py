@@ -0,0 +1,83 @@
+import asyncio
+import datetime
+
+import chat_router
+import gspd
+from chat_router import ChatRouter
+
+SUBJECT = 'Физика'
+
+
+def make_router(tmp_path, **kwargs):
+    return ChatRouter(gspd.SeminarBot, str(tmp_path), arbitration_window=0.0, **kwargs)
+
+
+async def add_subject(router, chat_id, start=None):
+    chat = await router.get_chat(chat_id)
+    await chat.record({'op': 'subject', 'subject': SUBJECT, 'topics': [[1, f'тема чата {chat_id}']]})
+    if start is not None:
+        await chat.record({'op': 'start_time', 'subject': SUBJECT, 'at': start.isoformat()})
+    return chat
+
+
+def test_least_recently_used_chat_is_unloaded_and_restored(tmp_path):
+    router = make_router(tmp_path, max_loaded=2)
+
+    async def run():
+        for chat_id in (1, 2):
+            await add_subject(router, chat_id)
+        await router.get_chat(1)
+        await add_subject(router, 3)
+        loaded = list(router.chats)
+        restored = await router.get_chat(2)
+        await router.post_shutdown(None)
+        return loaded, restored
+
+    loaded, restored = asyncio.run(run())
+    assert loaded == [1, 3]
+    assert restored.topics[SUBJECT][1] == 'тема чата 2'
+
+
+def test_chat_in_use_is_not_unloaded(tmp_path):
+    router = make_router(tmp_path, max_loaded=1)
+
+    async def run():
+        chat = await add_subject(router, 1)
+        chat.pending_claims[(SUBJECT, 1)] = []
+        await add_subject(router, 2)
+        loaded = set(router.chats)
+        chat.pending_claims.clear()
+        router.unload_overflow()
+        after = set(router.chats)
+        await router.post_shutdown(None)
+        return loaded, after
+
+    loaded, after = asyncio.run(run())
+    # Занятый чат 1 остается, и только что загруженный чат 2 не выгружается сразу же
+    assert loaded == {1, 2}
+    assert after == {2}
+
+
+def test_idle_chat_sleeps_until_its_distribution(tmp_path, monkeypatch):
+    router = make_router(tmp_path, idle_timeout=0)
+    start = gspd.SeminarBot.get_local_time() + datetime.timedelta(minutes=10)
+
+    async def run():
+        await add_subject(router, 1, start)
+        await router.sweep()
+        await asyncio.gather(*router._unloading.values())
+        unloaded = 1 not in router.chats
+        # Новый процесс узнает о запланированном событии из wake.json
+        wake_times = make_router(tmp_path).wake_times
+        monkeypatch.setattr(chat_router, 'CHAT_WAKE_LEAD', datetime.timedelta(minutes=15))
+        router.idle_timeout = 3600
+        await router.sweep()
+        woken = 1 in router.chats
+        await router.post_shutdown(None)
+        return unloaded, wake_times, woken
+
+    unloaded, wake_times, woken = asyncio.run(run())
+    assert unloaded
+    # Первое событие расписания - напоминание перед открытием
+    assert wake_times == {1: start - gspd.REMINDER_LEAD}
+    assert woken
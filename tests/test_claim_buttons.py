@@ -0,0 +1,43 @@
+import asyncio
+import datetime
+
+import gspd
+from telegram_updates import button, run_updates
+
+SUBJECT = 'Физика'
+
+
+def make_bot(started=True):
+    bot = gspd.SeminarBot(arbitration_window=0.0)
+    bot.apply_event({'op': 'subject', 'subject': SUBJECT, 'topics': [[n, f'тема {n}'] for n in range(1, 4)]})
+    start = bot.get_local_time() + datetime.timedelta(minutes=-1 if started else 10)
+    bot.apply_event({'op': 'start_time', 'subject': SUBJECT, 'at': start.isoformat()})
+    return bot
+
+
+def answers(calls):
+    return [params.get('text') for method, params, _ in calls if method == 'answerCallbackQuery']
+
+
+def test_button_claims_topic():
+    bot = make_bot()
+    subject_id = bot.subject_id(SUBJECT)
+    presses = [button(7, f'c|{subject_id}|2'), button(8, f'c|{subject_id}|2'), button(7, f'c|{subject_id}|3')]
+    calls = asyncio.run(run_updates(bot, presses))
+    won, taken, again = answers(calls)
+    assert won.startswith("🎉 Тема выбрана!") and "2. тема 2" in won
+    assert taken == bot.taken_reply(SUBJECT, 2)[:gspd.CALLBACK_ANSWER_LIMIT]
+    assert again == bot.already_claimed_reply(SUBJECT, 2)[:gspd.CALLBACK_ANSWER_LIMIT]
+    assert bot.registrations[SUBJECT][2][0] == 7
+    assert 3 not in bot.registrations[SUBJECT]
+    labels = [key.text for row in bot.topics_page(SUBJECT)[1].inline_keyboard for key in row]
+    assert labels == ['1', '✅ 2', '3']
+
+
+def test_button_before_start_and_bad_data_are_answered():
+    bot = make_bot(started=False)
+    subject_id = bot.subject_id(SUBJECT)
+    presses = [button(7, f'c|{subject_id}|1'), button(7, f'c|{subject_id}|9'), button(7, 'c|broken')]
+    calls = asyncio.run(run_updates(bot, presses))
+    assert answers(calls) == ["Распределение еще не началось.", "Такой темы не существует.", None]
+    assert not bot.registrations[SUBJECT]
@@ -0,0 +1,60 @@
+import datetime
+import random
+
+import pytest
+
+from claim_table import ClaimOrder, ClaimTable, TopicTable, to_micros
+
+
+def test_topic_table_keeps_order_and_replaces_duplicates():
+    topics = TopicTable([(3, 'c'), (1, 'a'), (3, 'c2'), (2, 'b')])
+    assert list(topics.items()) == [(3, 'c2'), (1, 'a'), (2, 'b')]
+    assert 4 not in topics
+    with pytest.raises(KeyError):
+        topics[4]
+
+
+def test_claim_table_matches_dict():
+    rng = random.Random(3)
+    topics = TopicTable((n, f'тема {n}') for n in range(1, 31))
+    table, model = ClaimTable(topics.index), {}
+    start = datetime.datetime(2024, 1, 1, 10, 0)
+    for step in range(1000):
+        number = rng.randint(1, 30)
+        if number in model and rng.random() < 0.5:
+            del table[number], model[number]
+        else:
+            value = (rng.randint(1, 10**12), f'user{rng.randint(1, 5)}', start + datetime.timedelta(microseconds=step))
+            table[number] = model[number] = value
+        assert len(table) == len(model)
+        assert dict(table.items()) == model
+    assert set(table) == set(model)
+
+
+def test_claim_table_rejects_unknown_topics():
+    table = ClaimTable(TopicTable([(1, 'a')]).index)
+    with pytest.raises(KeyError):
+        table[2] = (1, 'u', datetime.datetime(2024, 1, 1))
+    with pytest.raises(KeyError):
+        del table[1]
+    assert 2 not in table
+
+
+def test_usernames_are_shared():
+    index = TopicTable([(1, 'a'), (2, 'b')]).index
+    first, second = ClaimTable(index), ClaimTable(index)
+    moment = datetime.datetime(2024, 1, 1)
+    first[1] = (1, ''.join(['u', 'ser']), moment)
+    second[2] = (1, ''.join(['us', 'er']), moment)
+    assert first[1][1] is second[2][1]
+
+
+def test_claim_order_keeps_time_order():
+    moment = datetime.datetime(2024, 1, 1, 10, 0)
+    order = ClaimOrder([(to_micros(moment), 5), (to_micros(moment), 2)])
+    assert order.add(to_micros(moment), 9) == 2
+    assert order.add(to_micros(moment - datetime.timedelta(seconds=1)), 7) == 0
+    assert list(order) == [7, 2, 5, 9]
+    assert order.remove(to_micros(moment), 5) == 2
+    assert order.remove(to_micros(moment), 5) is None
+    assert list(order) == [7, 2, 9]
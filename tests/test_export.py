@@ -0,0 +1,68 @@
+import asyncio
+import codecs
+import csv
+import datetime
+import io
+import sys
+
+import pytest
+
+import gspd
+from telegram_updates import message, run_updates
+
+SUBJECT = 'Физика'
+
+
+def make_bot():
+    bot = gspd.SeminarBot()
+    bot.apply_event({'op': 'subject', 'subject': SUBJECT, 'topics': [[n, f'тема {n}'] for n in range(1, 6)]})
+    for topic, user_id, second in ((3, 7, 5), (1, 8, 9), (5, 9, 1)):
+        bot.apply_event({
+            'op': 'claim', 'subject': SUBJECT, 'topic': topic, 'user_id': user_id, 'username': f'u{user_id}',
+            'at': datetime.datetime(2024, 1, 1, 10, 0, second).isoformat(),
+        })
+    return bot
+
+
+def read_csv(data):
+    assert data.startswith(codecs.BOM_UTF8)
+    return list(csv.reader(io.StringIO(data.decode('utf-8-sig')), delimiter=gspd.EXPORT_DELIMITER))
+
+
+def test_csv_rows_follow_claim_time():
+    bot = make_bot()
+    rows = read_csv(bot.results_csv([SUBJECT]))
+    assert rows[0] == list(gspd.EXPORT_COLUMNS)
+    assert [(row[1], row[3]) for row in rows[1:]] == [('5', '@u9'), ('3', '@u7'), ('1', '@u8')]
+    assert rows[1][5] == '01.01.2024 10:00:01'
+
+
+def test_cached_csv_is_dropped_on_release():
+    bot = make_bot()
+    bot.results_csv([SUBJECT])
+    bot.apply_event({'op': 'release', 'subject': SUBJECT, 'topic': 3, 'user_id': 7})
+    rows = read_csv(bot.results_csv([SUBJECT]))
+    assert [row[1] for row in rows[1:]] == ['5', '1']
+
+
+def test_results_command_sends_document():
+    calls = asyncio.run(run_updates(make_bot(), [message(5, '/results 1'), message(5, '/results Химия')]))
+    documents = [params for method, params, _ in calls if method == 'sendDocument']
+    assert len(documents) == 1
+    texts = [params['text'] for method, params, _ in calls if method == 'sendMessage']
+    assert texts == ["Предмет не найден. Номера предметов - в /list_subjects."]
+
+
+def test_xlsx_without_openpyxl_is_reported(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'openpyxl', None)
+    calls = asyncio.run(run_updates(make_bot(), [message(5, '/results xlsx')]))
+    texts = [params['text'] for method, params, _ in calls if method == 'sendMessage']
+    assert texts == ["❌ Не удалось выгрузить результаты: для выгрузки в XLSX нужен пакет openpyxl"]
+
+
+def test_xlsx_has_sheet_per_subject():
+    openpyxl = pytest.importorskip('openpyxl')
+    workbook = openpyxl.load_workbook(io.BytesIO(make_bot().results_xlsx([SUBJECT])))
+    rows = list(workbook[SUBJECT].values)
+    assert rows[0] == tuple(gspd.EXPORT_COLUMNS)
+    assert [row[1] for row in rows[1:]] == [5, 3, 1]
@@ -0,0 +1,54 @@
+import asyncio
+import datetime
+import random
+
+import gspd
+from telegram_updates import message, run_updates
+
+SUBJECT = 'Физика'
+
+
+def claim(topic, user_id):
+    return {
+        'op': 'claim', 'subject': SUBJECT, 'topic': topic, 'user_id': user_id,
+        'username': f'u{user_id}', 'at': datetime.datetime(2024, 1, 1, 10, 0).isoformat(),
+    }
+
+
+def test_free_index_follows_claims_and_releases():
+    rng = random.Random(5)
+    bot = gspd.SeminarBot()
+    bot.apply_event({'op': 'subject', 'subject': SUBJECT, 'topics': [[n, f'тема {n}'] for n in range(1, 51)]})
+    for step in range(500):
+        topic = rng.randint(1, 50)
+        holder = bot.registrations[SUBJECT].get(topic)
+        if holder is None:
+            bot.apply_event(claim(topic, 1000 + step))
+        else:
+            bot.apply_event({'op': 'release', 'subject': SUBJECT, 'topic': topic, 'user_id': holder[0]})
+        expected = [num for num in range(1, 51) if num not in bot.registrations[SUBJECT]]
+        assert bot.free_topics[SUBJECT] == expected
+
+
+def test_nearest_free_topic_prefers_smaller_on_tie():
+    bot = gspd.SeminarBot()
+    bot.apply_event({'op': 'subject', 'subject': SUBJECT, 'topics': [[n, f'тема {n}'] for n in range(1, 8)]})
+    for topic in (3, 4, 5):
+        bot.apply_event(claim(topic, topic))
+    assert bot.nearest_free_topic(SUBJECT, 4) == 2
+    assert bot.nearest_free_topic(SUBJECT, 5) == 6
+    for topic in (1, 2, 6, 7):
+        bot.apply_event(claim(topic, topic))
+    assert bot.nearest_free_topic(SUBJECT, 4) is None
+
+
+def test_free_command_lists_free_topics():
+    bot = gspd.SeminarBot()
+    topics = gspd.FREE_LIST_LIMIT + 5
+    bot.apply_event({'op': 'subject', 'subject': SUBJECT, 'topics': [[n, f'тема {n}'] for n in range(1, topics + 1)]})
+    bot.apply_event(claim(1, 7))
+    calls = asyncio.run(run_updates(bot, [message(5, '/free')]))
+    text, = [params['text'] for method, params, _ in calls if method == 'sendMessage']
+    assert f"({topics - 1} из {topics})" in text
+    assert "\n1. " not in text and "2. тема 2" in text
+    assert "... и еще 4" in text
@@ -0,0 +1,63 @@
+import asyncio
+import datetime
+import json
+
+import gspd
+from journal import Journal
+
+SUBJECT = 'Физика'
+
+
+async def fill_journal(bot):
+    await bot.record({'op': 'subject', 'subject': SUBJECT, 'topics': [[n, f'тема {n}'] for n in range(1, 6)]})
+    await bot.record({'op': 'start_time', 'subject': SUBJECT, 'at': datetime.datetime(2024, 1, 1, 10).isoformat()})
+    for topic, user_id in ((1, 10), (2, 11), (3, 12)):
+        claimed = datetime.datetime(2024, 1, 1, 10, 0, topic)
+        await bot.record({
+            'op': 'claim', 'subject': SUBJECT, 'topic': topic,
+            'user_id': user_id, 'username': f'u{user_id}', 'at': claimed.isoformat(),
+        })
+    await bot.record({'op': 'release', 'subject': SUBJECT, 'topic': 2, 'user_id': 11})
+
+
+def restored(path):
+    bot = gspd.SeminarBot(journal=Journal(path))
+    bot.restore()
+    return bot.export_state()
+
+
+def test_journal_replay_restores_state(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    bot = gspd.SeminarBot(journal=Journal(path))
+    asyncio.run(fill_journal(bot))
+    state = bot.export_state()
+    assert state['registrations'][SUBJECT] == [[1, 10, 'u10', '2024-01-01T10:00:01'],
+                                               [3, 12, 'u12', '2024-01-01T10:00:03']]
+    assert restored(path) == state
+
+    # Строка, недописанная при падении, отбрасывается вместе с хвостом файла
+    with open(path, 'ab') as f:
+        f.write(b'{"op": "claim", "subj')
+    assert restored(path) == state
+    assert open(path, 'rb').read().endswith(b'}\n')
+
+
+def test_journal_compaction_keeps_state(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    bot = gspd.SeminarBot(journal=Journal(path, compact_every=3))
+
+    async def run():
+        await fill_journal(bot)
+        await bot.journal._flusher
+
+    asyncio.run(run())
+    state = bot.export_state()
+    snapshot, events = Journal(path).load()
+    assert snapshot is not None
+    assert len(events) < 6
+    assert restored(path) == state
+
+    # После close журнал сжат целиком, и состояние читается из одного снимка
+    asyncio.run(bot.journal.close())
+    snapshot, events = Journal(path).load()
+    assert snapshot == json.loads(json.dumps(state)) and events == []
@@ -0,0 +1,53 @@
+import asyncio
+import datetime
+
+import bench_rush
+import gspd
+from telegram_updates import CHAT, feed, message, running_application
+
+
+def open_subject(bot, topics=10):
+    bot.apply_event({'op': 'subject', 'subject': 'Физика', 'topics': [[n, f'тема {n}'] for n in range(1, topics + 1)]})
+    start = bot.get_local_time() - datetime.timedelta(minutes=1)
+    bot.apply_event({'op': 'start_time', 'subject': 'Физика', 'at': start.isoformat()})
+
+
+def board_calls(calls):
+    return [
+        (method, params) for method, params, _ in calls
+        if method in ('sendMessage', 'editMessageText') and 'reply_markup' in params and params['chat_id'] == CHAT['id']
+    ]
+
+
+def test_claims_are_coalesced_into_one_live_board():
+    bot = gspd.SeminarBot(arbitration_window=0.0, board_update_interval=0.3)
+    open_subject(bot)
+    request = bench_rush.FakeRequest()
+
+    async def run():
+        async with running_application(bot, request) as application:
+            await feed(application, [message(user_id, str(user_id)) for user_id in range(1, 6)])
+            await asyncio.sleep(0.8)
+
+    asyncio.run(run())
+    boards = board_calls(request.calls)
+    # Первая заявка создает доску, остальные попадают в одно редактирование
+    assert [method for method, _ in boards] == ['sendMessage', 'editMessageText']
+    assert boards[1][1]['message_id'] == bot.live_boards['Физика'][CHAT['id']].message_id
+    assert all(f's{user_id}' in boards[1][1]['text'] for user_id in range(1, 6))
+
+
+def test_unchanged_board_is_not_edited():
+    bot = gspd.SeminarBot(arbitration_window=0.0, board_update_interval=0.05)
+    open_subject(bot)
+    request = bench_rush.FakeRequest()
+
+    async def run():
+        async with running_application(bot, request) as application:
+            await feed(application, [message(1, '1')])
+            await asyncio.sleep(0.2)
+            bot.schedule_board_update('Физика', application.bot)
+            await asyncio.sleep(0.2)
+
+    asyncio.run(run())
+    assert [method for method, _ in board_calls(request.calls)] == ['sendMessage']
@@ -0,0 +1,41 @@
+import pytest
+
+import metrics
+
+
+def test_same_metric_registered_twice_shares_values():
+    registry = metrics.Registry()
+    first = metrics.Counter('requests_total', 'Запросы', ['kind'], registry=registry)
+    # Так же объявляет метрики второй экземпляр модуля (gspd как __main__ и как gspd)
+    second = metrics.Counter('requests_total', 'Запросы', ['kind'], registry=registry)
+    first.labels('a').inc()
+    second.labels('a').inc(2)
+    assert registry.get('requests_total') is first
+    assert 'requests_total{kind="a"} 3' in registry.render()
+
+
+def test_histogram_registered_twice_shares_buckets():
+    registry = metrics.Registry()
+    first = metrics.Histogram('latency_seconds', 'Задержка', buckets=(0.1, 1.0), registry=registry)
+    second = metrics.Histogram('latency_seconds', 'Задержка', buckets=(0.1, 1.0), registry=registry)
+    second.observe(0.5)
+    assert 'latency_seconds_count 1' in registry.render()
+    assert first._values is second._values
+
+
+@pytest.mark.parametrize('other', [
+    lambda registry: metrics.Gauge('requests_total', 'Запросы', ['kind'], registry=registry),
+    lambda registry: metrics.Counter('requests_total', 'Запросы', ['chat'], registry=registry),
+])
+def test_conflicting_definition_is_rejected(other):
+    registry = metrics.Registry()
+    metrics.Counter('requests_total', 'Запросы', ['kind'], registry=registry)
+    with pytest.raises(ValueError):
+        other(registry)
+
+
+def test_histogram_with_other_buckets_is_rejected():
+    registry = metrics.Registry()
+    metrics.Histogram('latency_seconds', 'Задержка', buckets=(0.1, 1.0), registry=registry)
+    with pytest.raises(ValueError):
+        metrics.Histogram('latency_seconds', 'Задержка', buckets=(0.5,), registry=registry)
@@ -0,0 +1,73 @@
+import asyncio
+
+import gspd
+import outbox
+from outbox import Outbox
+from telegram_updates import ADMIN, message, run_updates
+
+
+class SlowBot:
+    """Бот, у которого каждая отправка занимает latency секунд"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.sent.append((chat_id, text))
+        return text
+
+
+def test_idle_chat_buckets_are_pruned(monkeypatch):
+    monkeypatch.setattr(outbox, 'CHAT_BUCKET_PRUNE_SIZE', 10)
+
+    async def run():
+        box = Outbox(global_rate=1000.0, chat_rate=1000.0)
+        box.start(SlowBot())
+        for chat_id in range(100):
+            await box.send_message(chat_id, 'рассылка')
+            await asyncio.sleep(0.005)
+        await box.stop()
+        return box
+
+    box = asyncio.run(run())
+    assert box.stats['sent'] == 100
+    assert len(box._chat_buckets) <= 20
+
+
+def test_stop_waits_for_sends_in_flight():
+    async def run():
+        bot = SlowBot(latency=0.2)
+        box = Outbox()
+        box.start(bot)
+        future = box.send_message(1, 'последнее')
+        await asyncio.sleep(0.05)
+        await box.stop()
+        return bot, future
+
+    bot, future = asyncio.run(run())
+    assert bot.sent == [(1, 'последнее')]
+    assert future.result() == 'последнее'
+
+
+def test_stop_settles_unsent_messages():
+    async def run():
+        box = Outbox(chat_rate=0.01, chat_burst=1)
+        box.start(SlowBot())
+        futures = [box.send_message(1, str(n)) for n in range(3)]
+        await box.stop(timeout=0.1)
+        return box, futures
+
+    box, futures = asyncio.run(run())
+    assert [future.result() for future in futures] == ['0', None, None]
+    assert box.depth() == {name: 0 for name in outbox.PRIORITY_NAMES.values()}
+
+
+def test_admin_dialog_replies_go_through_outbox():
+    box = Outbox()
+    bot = gspd.SeminarBot(outbox=box)
+    calls = asyncio.run(run_updates(bot, [message(ADMIN, '/new_subject'), message(ADMIN, '/cancel')]))
+    replies = [params['text'] for method, params, _ in calls if method == 'sendMessage']
+    assert replies == ["Введите название предмета:", "Операция отменена."]
+    assert box.stats['sent'] == 2
@@ -0,0 +1,70 @@
+import asyncio
+import datetime
+import json
+import zlib
+
+import gspd
+from telegram_updates import button, run_updates
+
+# Разные названия с одинаковым CRC32
+COLLIDING = ('История 48709094', 'Геометрия 95154810')
+
+
+def open_subject(bot, subject, topics=3):
+    bot.apply_event({'op': 'subject', 'subject': subject, 'topics': [[n, f'тема {n}'] for n in range(1, topics + 1)]})
+    start = bot.get_local_time() - datetime.timedelta(minutes=1)
+    bot.apply_event({'op': 'start_time', 'subject': subject, 'at': start.isoformat()})
+
+
+def keyboard_data(markup):
+    if isinstance(markup, str):
+        markup = json.loads(markup)
+    return [[button['callback_data'] for button in row] for row in markup['inline_keyboard']]
+
+
+def test_topics_are_split_into_pages():
+    bot = gspd.SeminarBot()
+    open_subject(bot, 'Физика', topics=2 * gspd.PAGE_SIZE + 5)
+    subject_id = bot.subject_id('Физика')
+    text, keyboard = bot.topics_page('Физика', 1)
+    assert "(стр. 2/3)" in text
+    assert f"{gspd.PAGE_SIZE + 1}. тема" in text and f"{2 * gspd.PAGE_SIZE + 1}. тема" not in text
+    assert keyboard.inline_keyboard[-1][0].callback_data == f"pg|t|{subject_id}|0"
+    assert keyboard.inline_keyboard[-1][-1].callback_data == f"pg|t|{subject_id}|2"
+    # Страница за пределами доски - последняя
+    assert bot.topics_page('Физика', 10)[0] == bot.topics_page('Физика', 2)[0]
+
+
+def test_short_board_has_no_page_buttons():
+    bot = gspd.SeminarBot()
+    open_subject(bot, 'Физика', topics=3)
+    text, keyboard = bot.topics_page('Физика')
+    assert "стр." not in text
+    assert all(data.startswith('c|') for row in keyboard_data(keyboard.to_dict()) for data in row)
+
+
+def test_page_button_edits_message():
+    bot = gspd.SeminarBot()
+    open_subject(bot, 'Физика', topics=2 * gspd.PAGE_SIZE + 5)
+    subject_id = bot.subject_id('Физика')
+    calls = asyncio.run(run_updates(bot, [button(7, f'pg|t|{subject_id}|2'), button(7, 'pg|t|ffffffff|0')]))
+    edits = [params for method, params, _ in calls if method == 'editMessageText']
+    assert len(edits) == 1
+    assert "(стр. 3/3)" in edits[0]['text']
+    assert keyboard_data(edits[0]['reply_markup'])[-1][0] == f"pg|t|{subject_id}|1"
+    answers = [params.get('text') for method, params, _ in calls if method == 'answerCallbackQuery']
+    assert answers == [None, "Предмет не найден."]
+
+
+def test_colliding_subject_ids_are_salted():
+    assert len({zlib.crc32(subject.encode('utf-8')) for subject in COLLIDING}) == 1
+    bot = gspd.SeminarBot(arbitration_window=0.0)
+    for subject in COLLIDING:
+        open_subject(bot, subject)
+    first, second = (bot.subject_id(subject) for subject in COLLIDING)
+    assert first != second
+    assert bot.subject_ids == {first: COLLIDING[0], second: COLLIDING[1]}
+
+    asyncio.run(run_updates(bot, [button(7, f'c|{second}|2')]))
+    assert 2 in bot.registrations[COLLIDING[1]]
+    assert not bot.registrations[COLLIDING[0]]
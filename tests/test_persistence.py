@@ -0,0 +1,82 @@
+import asyncio
+
+from persistence import SQLitePersistence
+
+
+class CountingPersistence(SQLitePersistence):
+    """Запоминает, что уходило в каждую транзакцию"""
+
+    def __init__(self, path, fail=0):
+        super().__init__(path)
+        self.writes = []
+        self.fail = fail
+
+    def _write(self, users, conversations):
+        if self.fail:
+            self.fail -= 1
+            raise OSError("disk is full")
+        self.writes.append((set(users), set(conversations)))
+        super()._write(users, conversations)
+
+
+async def reload(path):
+    persistence = CountingPersistence(path)
+    loaded = await persistence.get_user_data(), await persistence.get_conversations('dialog')
+    return persistence, loaded
+
+
+def test_changes_survive_restart(tmp_path):
+    path = str(tmp_path / 'dialogs.sqlite')
+
+    async def run():
+        persistence = CountingPersistence(path)
+        await persistence.update_user_data(1, {'current_subject': 'Физика'})
+        await persistence.update_conversation('dialog', (10, 1), 2)
+        await persistence.update_conversation('dialog', (10, 2), 1)
+        await persistence.flush()
+        _, loaded = await reload(path)
+        return persistence.writes, loaded
+
+    writes, (user_data, conversations) = asyncio.run(run())
+    # Все изменения одного прохода - одна транзакция
+    assert len(writes) == 1
+    assert user_data == {1: {'current_subject': 'Физика'}}
+    assert conversations == {(10, 1): 2, (10, 2): 1}
+
+
+def test_only_changed_keys_are_written(tmp_path):
+    path = str(tmp_path / 'dialogs.sqlite')
+
+    async def run():
+        first = CountingPersistence(path)
+        await first.update_user_data(1, {'a': 1})
+        await first.update_conversation('dialog', (10, 1), 2)
+        await first.flush()
+        persistence, _ = await reload(path)
+        await persistence.update_user_data(1, {'a': 1})
+        await persistence.update_user_data(2, {})
+        await persistence.update_conversation('dialog', (10, 1), 2)
+        await persistence.update_conversation('dialog', (10, 2), 1)
+        await persistence.update_conversation('dialog', (10, 1), None)
+        await persistence.flush()
+        return persistence.writes, (await reload(path))[1]
+
+    writes, (user_data, conversations) = asyncio.run(run())
+    assert writes == [(set(), {('dialog', '[10, 2]'), ('dialog', '[10, 1]')})]
+    assert user_data == {1: {'a': 1}}
+    assert conversations == {(10, 2): 1}
+
+
+def test_failed_write_is_retried(tmp_path):
+    path = str(tmp_path / 'dialogs.sqlite')
+
+    async def run():
+        persistence = CountingPersistence(path, fail=1)
+        await persistence.update_user_data(1, {'a': 1})
+        await persistence._writer
+        await persistence.update_user_data(2, {'b': 2})
+        await persistence.flush()
+        return (await reload(path))[1]
+
+    user_data, _ = asyncio.run(run())
+    assert user_data == {1: {'a': 1}, 2: {'b': 2}}
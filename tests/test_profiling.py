@@ -0,0 +1,80 @@
+import asyncio
+import json
+
+import bench_rush
+import gspd
+import profiling
+from outbox import Outbox
+from telegram_updates import ADMIN, feed, message, running_application
+
+LATENCY = 0.05
+
+
+def make_bot():
+    bot = gspd.SeminarBot(arbitration_window=0.0, outbox=Outbox(global_rate=1000, chat_rate=1000, chat_burst=100))
+    bot.apply_event({'op': 'subject', 'subject': 'Физика', 'topics': [[1, 'тема']]})
+    return bot
+
+
+class FailingRequest(bench_rush.FakeRequest):
+    """sendMessage отвечает ошибкой Bot API после задержки"""
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        status, body = await super().do_request(url, method, request_data, **kwargs)
+        if url.endswith('/sendMessage'):
+            return 400, json.dumps({'ok': False, 'error_code': 400, 'description': 'Bad Request: chat not found'}).encode()
+        return status, body
+
+
+def collect_trace(request, updates):
+    """Трассы обновлений, обработанных ботом с очередью исходящих"""
+    async def scenario():
+        records = profiling.TRACER.collect()
+        try:
+            async with running_application(make_bot(), request) as application:
+                await feed(application, updates)
+                # Ответ уходит из очереди уже после того, как обработчик вернулся
+                for _ in range(100):
+                    if records:
+                        break
+                    await asyncio.sleep(0.01)
+        finally:
+            profiling.TRACER.stop_collecting(records)
+        return records
+
+    return asyncio.run(scenario())
+
+
+def test_outbox_sends_are_counted_in_update_trace():
+    records = collect_trace(bench_rush.FakeRequest(LATENCY), [message(5, '/list_subjects')])
+    assert len(records) == 1
+    name, total, own, api, queued, calls = records[0]
+    assert name == 'throttle_claims+list_subjects'
+    assert calls == 1
+    assert api >= LATENCY
+    assert total >= api + queued
+
+
+def test_failed_sends_are_counted_in_update_trace():
+    records = collect_trace(FailingRequest(LATENCY), [message(5, '/list_subjects')])
+    assert len(records) == 1
+    name, total, own, api, queued, calls = records[0]
+    assert calls == 1
+    assert api >= LATENCY
+
+
+def test_profile_does_not_block_admin_commands():
+    async def scenario():
+        request = bench_rush.FakeRequest()
+        async with running_application(make_bot(), request) as application:
+            await feed(application, [message(ADMIN, '/profile 1 sample'), message(ADMIN, '/list_subjects')])
+            await asyncio.sleep(0.2)
+            answered = [params.get('text', '') for method, params, _ in request.calls if method == 'sendMessage']
+            documents = [method for method, _, _ in request.calls if method == 'sendDocument']
+            assert any(text.startswith('📚 Список предметов') for text in answered)
+            assert not documents
+            await asyncio.sleep(1.5)
+            return [params for method, params, _ in request.calls if method == 'sendDocument']
+
+    documents = asyncio.run(scenario())
+    assert len(documents) == 1
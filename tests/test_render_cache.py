@@ -0,0 +1,54 @@
+import datetime
+
+import gspd
+
+NOW = datetime.datetime(2024, 3, 1, 12, 0)
+
+
+def make_bot(clock=None):
+    clock = clock or [NOW]
+    bot = gspd.SeminarBot()
+    bot.get_local_time = lambda: clock[0]
+    for subject in ('Физика', 'Химия'):
+        bot.apply_event({'op': 'subject', 'subject': subject, 'topics': [[n, f'тема {n}'] for n in range(1, 4)]})
+    bot.apply_event({'op': 'start_time', 'subject': 'Физика', 'at': (NOW - datetime.timedelta(minutes=1)).isoformat()})
+    return bot
+
+
+def claim(bot, subject, topic, user_id):
+    bot.apply_event({
+        'op': 'claim', 'subject': subject, 'topic': topic, 'user_id': user_id,
+        'username': f'u{user_id}', 'at': NOW.isoformat(),
+    })
+
+
+def test_pages_are_reused_until_their_subject_changes():
+    bot = make_bot()
+    physics, chemistry, results = bot.topics_page('Физика'), bot.topics_page('Химия'), bot.results_page('Физика')
+    assert bot.topics_page('Физика') is physics
+    claim(bot, 'Физика', 2, 7)
+    changed = bot.topics_page('Физика')
+    assert changed is not physics and '@u7' in changed[0]
+    assert bot.results_page('Физика') is not results
+    assert bot.topics_page('Химия') is chemistry
+
+
+def test_subject_list_changes_with_any_subject():
+    bot = make_bot()
+    subjects = bot.subjects_page()
+    assert bot.subjects_page() is subjects
+    claim(bot, 'Химия', 1, 8)
+    assert bot.subjects_page() is not subjects
+
+
+def test_countdown_minute_invalidates_board():
+    clock = [NOW]
+    bot = make_bot(clock)
+    start = NOW + datetime.timedelta(minutes=10, seconds=30)
+    bot.apply_event({'op': 'start_time', 'subject': 'Химия', 'at': start.isoformat()})
+    page = bot.topics_page('Химия')
+    clock[0] += datetime.timedelta(seconds=20)
+    assert bot.topics_page('Химия') is page
+    clock[0] += datetime.timedelta(minutes=1)
+    later = bot.topics_page('Химия')
+    assert later is not page and later[0] != page[0]
@@ -0,0 +1,73 @@
+import asyncio
+import datetime
+
+import bench_rush
+import gspd
+from chat_router import ChatRouter
+from claim_store import SharedStore
+from telegram_updates import CHAT, message, run_updates, running_application
+
+
+async def claim_on_follower(path):
+    """Другой процесс (не лидер) заводит предмет в CHAT и принимает заявку на тему 1"""
+    follower = gspd.SeminarBot(arbitration_window=0.0, journal=SharedStore(path), leader=False)
+    start = follower.get_local_time() - datetime.timedelta(minutes=1)
+    await follower.record({
+        'op': 'subject', 'subject': 'Физика', 'topics': [[n, f'тема {n}'] for n in range(1, 4)],
+        'chat_id': CHAT['id'],
+    })
+    await follower.record({'op': 'start_time', 'subject': 'Физика', 'at': start.isoformat()})
+    calls = await run_updates(follower, [message(7, '1')])
+    assert not any(method == 'sendMessage' and 's7' in params['text'] for method, params, _ in calls)
+
+
+def boards(calls):
+    return [
+        params for method, params, _ in calls
+        if method in ('sendMessage', 'editMessageText') and params['chat_id'] == CHAT['id'] and 's7' in params['text']
+    ]
+
+
+def test_leader_shows_claims_from_shared_feed(tmp_path):
+    path = str(tmp_path / 'store.sqlite')
+    leader = gspd.SeminarBot(arbitration_window=0.0, journal=SharedStore(path), sync_interval=0.05)
+    request = bench_rush.FakeRequest()
+
+    async def run():
+        async with running_application(leader, request):
+            await claim_on_follower(path)
+            await asyncio.sleep(0.3)
+
+    asyncio.run(run())
+    assert boards(request.calls)
+
+
+def test_leader_loads_chat_written_by_other_process(tmp_path):
+    router = ChatRouter(gspd.SeminarBot, str(tmp_path), shared=True, arbitration_window=0.0)
+    request = bench_rush.FakeRequest()
+
+    async def run():
+        async with running_application(router, request):
+            await router.watch_stores()
+            await claim_on_follower(router.journal_path(CHAT['id']))
+            await router.watch_stores()
+            await asyncio.sleep(0.1)
+            assert CHAT['id'] in router.chats
+
+    asyncio.run(run())
+    assert boards(request.calls)
+
+
+def test_own_events_are_not_polled_back(tmp_path):
+    path = str(tmp_path / 'store.sqlite')
+    writer, reader = SharedStore(path), SharedStore(path)
+    bot = gspd.SeminarBot(arbitration_window=0.0, journal=writer)
+
+    async def run():
+        await bot.record({'op': 'subject', 'subject': 'Физика', 'topics': [[1, 'тема']]})
+        await bot.record({'op': 'start_time', 'subject': 'Физика', 'at': bot.get_local_time().isoformat()})
+
+    asyncio.run(run())
+    assert writer.poll() == (None, [])
+    snapshot, events = reader.poll()
+    assert [event['op'] for event in events] == ['subject', 'start_time']
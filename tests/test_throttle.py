@@ -0,0 +1,46 @@
+import asyncio
+import datetime
+
+import gspd
+import throttle
+from telegram_updates import ADMIN, button, message, run_updates
+
+
+def open_subject(bot):
+    bot.apply_event({'op': 'subject', 'subject': 'Физика', 'topics': [[n, f'тема {n}'] for n in range(1, 6)]})
+    start = bot.get_local_time() - datetime.timedelta(minutes=1)
+    bot.apply_event({'op': 'start_time', 'subject': 'Физика', 'at': start.isoformat()})
+
+
+def throttled():
+    return throttle.THROTTLED._values.get((), 0)
+
+
+def test_conversation_steps_are_not_throttled():
+    bot = gspd.SeminarBot(arbitration_window=0.0)
+    open_subject(bot)
+    before = throttled()
+    updates = [message(ADMIN, '/cancel_registration')] + [message(ADMIN, '9') for _ in range(6)]
+    calls = asyncio.run(run_updates(bot, updates))
+    replies = [params['text'] for method, params, _ in calls if method == 'sendMessage']
+    assert replies.count("Неверный номер предмета.") == 6
+    assert throttled() == before
+
+
+def test_throttled_buttons_are_answered():
+    bot = gspd.SeminarBot(arbitration_window=0.0)
+    open_subject(bot)
+    before = throttled()
+    subject_id = bot.subject_id('Физика')
+    presses = [button(7, f'c|{subject_id}|{n}') for n in (1, 2, 3, 4, 5, 1)]
+    calls = asyncio.run(run_updates(bot, presses))
+    assert throttled() - before == len(presses) - throttle.CLAIM_BURST
+    assert sum(method == 'answerCallbackQuery' for method, _, _ in calls) == len(presses)
+
+
+def test_claims_are_throttled():
+    bot = gspd.SeminarBot(arbitration_window=0.0)
+    open_subject(bot)
+    before = throttled()
+    asyncio.run(run_updates(bot, [message(8, str(n)) for n in (1, 2, 3, 4, 5)]))
+    assert throttled() - before == 5 - throttle.CLAIM_BURST
@@ -0,0 +1,39 @@
+import io
+
+from topic_import import parse_topic_rows, parse_topics_file, text_topic_rows
+
+
+def parse_text(text):
+    return parse_topic_rows(text_topic_rows(text.split('\n')))
+
+
+def test_numbers_parse_like_int():
+    topics, errors = parse_text(" 1. Механика\n+2. Оптика\n 03 . Термодинамика\n-4. Вне списка")
+    assert topics == {1: 'Механика', 2: 'Оптика', 3: 'Термодинамика', -4: 'Вне списка'}
+    assert errors == []
+
+
+def test_bad_lines_are_reported():
+    topics, errors = parse_text("1. Механика\n². Степень\nбез точки\n5.\n1. Повтор\n\nx. Тема")
+    assert topics == {1: 'Механика'}
+    assert [line_no for line_no, _ in errors] == [2, 3, 4, 5, 7]
+    assert errors[0] == (2, "«²» - не номер темы")
+
+
+def test_csv_with_header_and_semicolons():
+    data = "Номер;Название\n1;Механика; часть 1\n2;Оптика\n;\n".encode('utf-8-sig')
+    topics, errors = parse_topics_file(io.BytesIO(data), csv_format=True)
+    assert topics == {1: 'Механика; часть 1', 2: 'Оптика'}
+    assert errors == []
+
+
+def test_csv_without_header_keeps_first_row():
+    topics, errors = parse_topics_file(io.BytesIO(b" 1,Mechanics\n2,Optics\n"), csv_format=True)
+    assert topics == {1: 'Mechanics', 2: 'Optics'}
+
+
+def test_windows_1251_fallback_keeps_file_open():
+    binary = io.BytesIO("1. Механика\r\n2. Оптика\r\n".encode('cp1251'))
+    topics, errors = parse_topics_file(binary, csv_format=False)
+    assert topics == {1: 'Механика', 2: 'Оптика'}
+    assert not binary.closed
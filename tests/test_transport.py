@@ -0,0 +1,66 @@
+import asyncio
+import threading
+
+import pytest
+from telegram import Bot
+from telegram.error import RetryAfter
+
+import gspd
+from fake_bot_api import FakeBotApi, UpdateStream, make_api_server
+from profiling import TracedRequest
+
+CHAT_ID = -1001000000000
+
+
+def client_settings(request):
+    kwargs = request._client_kwargs
+    return kwargs['limits'].max_connections, kwargs['timeout'].pool, kwargs['http2']
+
+
+def test_pool_settings_come_from_environment(monkeypatch):
+    monkeypatch.setenv('BOT_POOL_SIZE', '16')
+    monkeypatch.setenv('BOT_POOL_TIMEOUT', '7')
+    monkeypatch.setenv('BOT_SEND_POOL_SIZE', '64')
+    send, updates = gspd.build_request(), gspd.build_request(get_updates=True)
+    assert isinstance(send, TracedRequest) and not isinstance(updates, TracedRequest)
+    assert client_settings(send) == (64, 7.0, False)
+    assert client_settings(updates) == (16, 7.0, False)
+
+
+def test_defaults_keep_send_and_poll_pools_apart():
+    assert client_settings(gspd.build_request()) == (128, 3.0, False)
+    assert client_settings(gspd.build_request(get_updates=True))[0] == 2
+
+
+def test_http2_without_h2_falls_back(monkeypatch):
+    monkeypatch.setenv('BOT_HTTP_VERSION', '2')
+    monkeypatch.setattr(gspd.importlib.util, 'find_spec', lambda name: None)
+    assert client_settings(gspd.build_request())[2] is False
+
+
+@pytest.fixture
+def api():
+    api = FakeBotApi(UpdateStream(students=0, chats=0), chat_rate=5)
+    server = make_api_server(api)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield api, f"http://127.0.0.1:{server.server_port}/bot"
+    server.shutdown()
+
+
+def test_concurrent_sends_over_pool_to_fake_api(api, monkeypatch):
+    api, base_url = api
+    monkeypatch.setenv('BOT_SEND_POOL_SIZE', '4')
+
+    async def run():
+        async with Bot('123:test', base_url=base_url, request=gspd.build_request()) as bot:
+            return await asyncio.gather(
+                *(bot.send_message(CHAT_ID, str(n)) for n in range(8)), return_exceptions=True
+            )
+
+    results = asyncio.run(run())
+    # Заглушка держит лимит Telegram на чат: 5 сообщений в секунду, остальным - 429
+    assert sum(not isinstance(result, Exception) for result in results) == 5
+    assert all(isinstance(result, RetryAfter) for result in results if isinstance(result, Exception))
+    assert api.counts['sendMessage'] == 5
+    assert sum(api.rejected.values()) == 3
@@ -0,0 +1,47 @@
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from fake_bot_api import FakeBotApi, UpdateStream, make_api_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def api_url():
+    server = make_api_server(FakeBotApi(UpdateStream(students=0, chats=0)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/bot"
+    server.shutdown()
+
+
+def test_several_workers_start_and_stop(api_url, tmp_path):
+    """python gspd.py с WORKERS>1: gspd загружается и как __main__, и как модуль"""
+    env = dict(os.environ, WORKERS='2', CHAT_STATE_DIR='chats', BOT_API_URL=api_url, BOT_TOKEN='123:test', PYTHONUNBUFFERED='1')
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'gspd.py')], cwd=tmp_path, env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+    )
+    output = []
+    started = set()
+    reader = threading.Thread(target=lambda: output.extend(process.stdout), daemon=True)
+    reader.start()
+    deadline = time.monotonic() + 60
+    while len(started) < 2 and process.poll() is None and time.monotonic() < deadline:
+        time.sleep(0.2)
+        started = {line for line in list(output) if 'Рабочий процесс' in line and 'запущен' in line}
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(30)
+    finally:
+        process.kill()
+    reader.join(5)
+    log = ''.join(output)
+    assert len(started) == 2, log
+    assert 'Traceback' not in log, log
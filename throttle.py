@@ -0,0 +1,66 @@
+"""Ограничение частоты заявок одного участника"""
+import logging
+import time
+
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import ApplicationHandlerStop, ContextTypes, filters
+
+import metrics
+from outbox import TokenBucket
+
+# Заявки одного участника (номера тем и кнопки): в среднем не чаще CLAIM_RATE в секунду, подряд - до CLAIM_BURST
+CLAIM_RATE = 1.0
+CLAIM_BURST = 3
+# При скольких ведрах заявок начинать выбрасывать полные (давно молчащих участников)
+THROTTLE_PRUNE_SIZE = 10_000
+
+THROTTLED = metrics.Counter('seminar_throttled_total', 'Заявки, отброшенные ограничением частоты')
+
+# Сообщение с номером темы и команда с пожеланиями
+CLAIM_FILTER = filters.TEXT & filters.Regex(r'^\d+$')
+PREFER_FILTER = filters.TEXT & filters.Regex(r'^/prefer\b')
+THROTTLED_FILTER = CLAIM_FILTER | PREFER_FILTER
+
+
+class ClaimThrottle:
+    """Ведро токенов на участника: лишние заявки отбрасываются в группе -1 до всех обработчиков"""
+    # Номер, который ждет шаг диалога из conversations, заявкой не считается
+
+    def __init__(self, rate=CLAIM_RATE, burst=CLAIM_BURST, conversations=()):
+        self.rate = rate
+        self.burst = burst
+        self.conversations = list(conversations)
+        self.buckets = {}
+
+    def is_claim(self, update: Update):
+        if update.callback_query is not None:
+            return (update.callback_query.data or '').startswith('c|')
+        if update.message is None or not THROTTLED_FILTER.check_update(update):
+            return False
+        return not any(conversation.check_update(update) for conversation in self.conversations)
+
+    async def throttle_claims(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if update.effective_user is None or not self.is_claim(update):
+            return
+        now = time.monotonic()
+        bucket = self.buckets.get(update.effective_user.id)
+        if bucket is None:
+            if len(self.buckets) >= THROTTLE_PRUNE_SIZE:
+                self.prune(now)
+            bucket = self.buckets[update.effective_user.id] = TokenBucket(self.rate, self.burst, now)
+        if bucket.wait_time(now) > 0:
+            THROTTLED.inc()
+            if update.callback_query is not None:
+                # Без ответа у кнопки крутится индикатор, пока Telegram не сдастся
+                try:
+                    await update.callback_query.answer()
+                except TelegramError as e:
+                    logging.error(f"Не удалось ответить на нажатие кнопки: {e}")
+            raise ApplicationHandlerStop
+        bucket.take(now)
+
+    def prune(self, now):
+        """Выбрасывает полные ведра: для их владельцев новое ведро ничем не отличается"""
+        for user_id in [user_id for user_id, bucket in self.buckets.items() if bucket.is_full(now)]:
+            del self.buckets[user_id]
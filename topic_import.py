@@ -0,0 +1,71 @@
+"""Разбор списков тем из текста и загруженных TXT/CSV-файлов"""
+import csv
+import io
+import itertools
+
+
+def _topic_number(text):
+    """Номер темы так же, как его понимает int() (со знаком и пробелами вокруг), или None"""
+    try:
+        return int(text)
+    except ValueError:
+        return None
+
+
+def text_topic_rows(lines):
+    """Строки вида «1. Тема» -> (номер строки, номер темы, название); без точки номер None"""
+    for line_no, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        number, dot, title = line.partition('.')
+        yield line_no, number if dot else None, title
+
+
+def csv_topic_rows(stream):
+    """Строки CSV «номер,название» (или через ;) -> (номер строки, номер темы, название)"""
+    first = stream.readline()
+    delimiter = ';' if first.count(';') > first.count(',') else ','
+    reader = csv.reader(itertools.chain([first], stream), delimiter=delimiter)
+    for row in reader:
+        if not row or not any(cell.strip() for cell in row):
+            continue
+        if reader.line_num == 1 and _topic_number(row[0]) is None:
+            # Строка заголовков
+            continue
+        yield reader.line_num, row[0], delimiter.join(row[1:])
+
+
+def parse_topic_rows(rows):
+    """Собирает темы из (номер строки, номер темы, название): (темы, ошибки [(номер строки, причина)])"""
+    topics, errors = {}, []
+    for line_no, number, title in rows:
+        if number is None:
+            errors.append((line_no, "ожидается «номер. название»"))
+            continue
+        title = title.strip()
+        topic_number = _topic_number(number)
+        if topic_number is None:
+            errors.append((line_no, f"«{number.strip()[:20]}» - не номер темы"))
+        elif not title:
+            errors.append((line_no, "пустое название"))
+        elif topic_number in topics:
+            errors.append((line_no, f"номер {topic_number} повторяется"))
+        else:
+            topics[topic_number] = title
+    return topics, errors
+
+
+def parse_topics_file(binary, csv_format):
+    """Разбирает файл построчно, не читая его целиком в память"""
+    for encoding in ('utf-8-sig', 'cp1251'):
+        binary.seek(0)
+        stream = io.TextIOWrapper(binary, encoding=encoding, newline='' if csv_format else None)
+        try:
+            rows = csv_topic_rows(stream) if csv_format else text_topic_rows(stream)
+            return parse_topic_rows(rows)
+        except UnicodeDecodeError:
+            continue
+        finally:
+            # Файл закрывает вызывающий, обертка не должна его закрыть
+            stream.detach()
+    raise ValueError("не удалось определить кодировку файла (нужна UTF-8 или Windows-1251)")
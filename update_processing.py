@@ -0,0 +1,152 @@
+"""Обработка входящих обновлений: по очереди для одного пользователя в чате, с метриками обработчиков"""
+import asyncio
+import contextlib
+import contextvars
+import datetime
+import functools
+import time
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, BaseUpdateProcessor, ConversationHandler
+
+import metrics
+import profiling
+from outbox import PRIORITY_NAMES
+from profiling import TRACER
+
+# Метрики (см. metrics.py и METRICS_PORT в build_application)
+HANDLER_LATENCY = metrics.Histogram(
+    'seminar_handler_latency_seconds', 'Время работы обработчика', ['handler']
+)
+HANDLER_ERRORS = metrics.Counter('seminar_handler_errors_total', 'Исключения в обработчиках', ['handler'])
+UPDATES = metrics.Counter('seminar_updates_total', 'Обработанные обновления')
+UPDATES_IN_FLIGHT = metrics.Gauge('seminar_updates_in_flight', 'Обновления, которые обрабатываются сейчас')
+UPDATE_QUEUE_DEPTH = metrics.Gauge('seminar_update_queue_depth', 'Обновления, ждущие обработки')
+PENDING_CLAIMS = metrics.Gauge('seminar_pending_claims', 'Темы в окне арбитража')
+OUTBOX_DEPTH = metrics.Gauge('seminar_outbox_depth', 'Сообщения в очереди исходящих', ['priority'])
+OUTBOX_MESSAGES = metrics.Counter(
+    'seminar_outbox_messages_total', 'Сообщения очереди исходящих по исходу', ['result']
+)
+
+# Блокировка пользователя, чье обновление сейчас обрабатывается, и время, когда оно дошло до бота
+USER_LOCK = contextvars.ContextVar('user_lock', default=None)
+RECEIVED_AT = contextvars.ContextVar('received_at', default=None)
+
+
+def received_at():
+    """Время (UTC), когда текущее обновление дошло до обработки; вне обработки - сейчас"""
+    return RECEIVED_AT.get() or datetime.datetime.now(datetime.timezone.utc)
+
+
+@contextlib.asynccontextmanager
+async def user_lock_released():
+    """Пускает следующие обновления пользователя, пока обработчик ждет (окно арбитража заявок)"""
+    lock = USER_LOCK.get()
+    if lock is None or not lock.locked():
+        yield
+        return
+    lock.release()
+    try:
+        yield
+    finally:
+        await lock.acquire()
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Обрабатывает обновления параллельно, но для одного пользователя в чате - по очереди (ради диалогов)"""
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}
+        self._waiters = {}
+
+    async def do_process_update(self, update, coroutine):
+        key = None
+        if isinstance(update, Update):
+            chat_id = update.effective_chat.id if update.effective_chat else None
+            user_id = update.effective_user.id if update.effective_user else None
+            key = (chat_id, user_id)
+        RECEIVED_AT.set(datetime.datetime.now(datetime.timezone.utc))
+        UPDATES.inc()
+        UPDATES_IN_FLIGHT.inc()
+        trace = TRACER.start()
+        try:
+            await self._process(key, coroutine)
+        finally:
+            UPDATES_IN_FLIGHT.inc(-1)
+            if trace is not None:
+                TRACER.finish(trace)
+
+    async def _process(self, key, coroutine):
+        if key is None or key == (None, None):
+            await coroutine
+            return
+
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                USER_LOCK.set(lock)
+                await coroutine
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+def instrument(callback):
+    """Обертка обработчика: время работы - в гистограмму, исключения - в счетчик"""
+    name = callback.__name__
+    latency = HANDLER_LATENCY.labels(name)
+    errors = HANDLER_ERRORS.labels(name)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            latency.observe(elapsed)
+            span = profiling.current_span()
+            if span is not None:
+                span.handlers.append(name)
+                span.handler_time += elapsed
+    return wrapper
+
+
+def instrument_handlers(handlers):
+    """Оборачивает колбэки обработчиков, включая шаги ConversationHandler"""
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            instrument_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                instrument_handlers(state_handlers)
+            instrument_handlers(handler.fallbacks)
+        else:
+            handler.callback = instrument(handler.callback)
+
+
+def register_metrics(application, outbox, pending_claims):
+    """Датчики, которые вычисляются из состояния бота в момент запроса метрик"""
+    UPDATE_QUEUE_DEPTH.set_function(application.update_queue.qsize)
+    PENDING_CLAIMS.set_function(pending_claims)
+    if outbox is not None:
+        for priority in PRIORITY_NAMES.values():
+            OUTBOX_DEPTH.set_function(lambda priority=priority: outbox.depth()[priority], priority)
+        for result in ('sent', 'failed', 'dropped', 'merged', 'retried'):
+            OUTBOX_MESSAGES.set_function(lambda result=result: outbox.stats[result], result)
@@ -0,0 +1,124 @@
+"""Режим вебхука: Telegram сам присылает обновления по HTTP.
+
+Flask-приложение принимает POST от Telegram, проверяет секретный токен
+и кладёт обновление в update_queue того же Application, что и в режиме
+long polling. Число одновременно обрабатываемых запросов ограничено,
+тот же предел передаётся Telegram как max_connections.
+"""
+import asyncio
+import hmac
+import logging
+import os
+import secrets
+import signal
+import threading
+
+from flask import Flask, abort, request
+from telegram import Update
+from werkzeug.serving import make_server
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookConfig:
+    """Настройки вебхука, по умолчанию берутся из переменных окружения"""
+
+    def __init__(self, url, listen='0.0.0.0', port=8443, path='/telegram',
+                 secret_token=None, max_connections=40, enqueue_timeout=10.0):
+        self.url = url.rstrip('/')
+        self.listen = listen
+        self.port = port
+        self.path = path if path.startswith('/') else '/' + path
+        # Если секрет не задан, генерируем его на каждый запуск: setWebhook всё равно вызывается заново
+        self.secret_token = secret_token or secrets.token_urlsafe(32)
+        self.max_connections = max_connections
+        self.enqueue_timeout = enqueue_timeout
+
+    @property
+    def webhook_url(self):
+        return self.url + self.path
+
+    @classmethod
+    def from_env(cls):
+        url = os.environ.get('WEBHOOK_URL')
+        if not url:
+            raise RuntimeError("Для режима вебхука нужно задать WEBHOOK_URL")
+        return cls(
+            url=url,
+            listen=os.environ.get('WEBHOOK_LISTEN', '0.0.0.0'),
+            port=int(os.environ.get('WEBHOOK_PORT', '8443')),
+            path=os.environ.get('WEBHOOK_PATH', '/telegram'),
+            secret_token=os.environ.get('WEBHOOK_SECRET'),
+            max_connections=int(os.environ.get('WEBHOOK_MAX_CONNECTIONS', '40')),
+        )
+
+
+def create_webhook_app(config, dispatch):
+    """Flask-приложение, которое передаёт JSON каждого обновления в dispatch(data).
+
+    dispatch вызывается в потоке HTTP-сервера и должен вернуть управление,
+    когда обновление принято в очередь обработки.
+    """
+    app = Flask(__name__)
+    in_flight = threading.BoundedSemaphore(config.max_connections)
+
+    @app.post(config.path)
+    def telegram_webhook():
+        token = request.headers.get(SECRET_HEADER, '')
+        if not hmac.compare_digest(token, config.secret_token):
+            abort(403)
+
+        # Сверх лимита не копим потоки: 503 заставит Telegram повторить доставку позже
+        if not in_flight.acquire(timeout=config.enqueue_timeout):
+            return '', 503
+        try:
+            data = request.get_json(force=True, silent=True)
+            if not data:
+                abort(400)
+            dispatch(data)
+        finally:
+            in_flight.release()
+        return '', 200
+
+    return app
+
+
+async def run_webhook(application, config):
+    """Запускает Application и HTTP-сервер вебхука до получения SIGINT/SIGTERM"""
+    loop = asyncio.get_running_loop()
+    stop_event = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    def dispatch(data):
+        update = Update.de_json(data, application.bot)
+        future = asyncio.run_coroutine_threadsafe(application.update_queue.put(update), loop)
+        future.result(timeout=config.enqueue_timeout)
+
+    server = make_server(config.listen, config.port, create_webhook_app(config, dispatch), threaded=True)
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.bot.set_webhook(
+            url=config.webhook_url,
+            secret_token=config.secret_token,
+            max_connections=config.max_connections,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        await application.start()
+
+        thread = threading.Thread(target=server.serve_forever, name='webhook-server', daemon=True)
+        thread.start()
+        logging.info(f"Вебхук слушает {config.listen}:{config.port}{config.path}")
+
+        try:
+            await stop_event.wait()
+        finally:
+            server.shutdown()
+            thread.join()
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+    if application.post_shutdown:
+        await application.post_shutdown(application)
@@ -0,0 +1,168 @@
+"""Запуск бота в нескольких процессах с общим хранилищем заявок.
+
+Главный процесс только принимает обновления (вебхук или long polling) и
+раскладывает их по рабочим процессам. Все обновления одного пользователя
+попадают в один и тот же процесс, поэтому шаги его диалогов
+(ConversationHandler хранит их в памяти процесса) идут по порядку.
+Рабочие процессы собирают обычный Application через
+gspd.build_application и делят состояние через SharedStore: занятие темы
+атомарно в SQLite, а изменения соседей подтягиваются из ленты событий.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+
+from telegram import Bot, Update
+from telegram.error import TelegramError
+
+# Сколько обновлений может ждать в очереди одного рабочего процесса
+WORKER_QUEUE_LIMIT = 10_000
+
+
+def worker_for(data, count):
+    """Номер рабочего процесса для обновления в виде JSON"""
+    for value in data.values():
+        if not isinstance(value, dict):
+            continue
+        user = value.get('from') or {}
+        chat = value.get('chat') or (value.get('message') or {}).get('chat') or {}
+        key = user.get('id') or chat.get('id')
+        if key is not None:
+            return key % count
+    return data.get('update_id', 0) % count
+
+
+def worker_main(index, count, updates):
+    # Останавливает рабочих главный процесс, посылая None в очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(run_worker(index, count, updates))
+
+
+async def run_worker(index, count, updates):
+    import gspd
+
+    application, bot = gspd.build_application(worker_index=index, workers=count)
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        logging.info(f"Рабочий процесс {index} запущен")
+        try:
+            while True:
+                data = await asyncio.to_thread(updates.get)
+                if data is None:
+                    break
+                await application.update_queue.put(Update.de_json(data, application.bot))
+            await application.update_queue.join()
+        finally:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+
+def run_workers(count, gspd=None):
+    """Запускает count рабочих процессов и принимает для них обновления до SIGINT/SIGTERM.
+
+    gspd - уже загруженный модуль бота (при запуске python gspd.py это __main__);
+    если не передан, импортируется.
+    """
+    if gspd is None:
+        import gspd
+
+    context = multiprocessing.get_context('spawn')
+    queues = [context.Queue(WORKER_QUEUE_LIMIT) for _ in range(count)]
+    processes = [
+        context.Process(target=worker_main, args=(index, count, queues[index]), name=f'worker-{index}')
+        for index in range(count)
+    ]
+    for process in processes:
+        process.start()
+
+    def dispatch(data, timeout=None):
+        queues[worker_for(data, count)].put(data, timeout=timeout)
+
+    try:
+        if os.environ.get('BOT_MODE', 'polling') == 'webhook':
+            from webhook import WebhookConfig
+            serve_webhook(gspd.get_token(), WebhookConfig.from_env(), dispatch, gspd.get_base_url())
+        else:
+            asyncio.run(poll_updates(gspd.get_token(), dispatch, gspd.get_base_url(),
+                                     gspd.build_request(get_updates=True)))
+    finally:
+        for updates in queues:
+            updates.put(None)
+        for process in processes:
+            process.join()
+
+
+def serve_webhook(token, config, dispatch, base_url='https://api.telegram.org/bot'):
+    from werkzeug.serving import make_server
+    from webhook import create_webhook_app
+
+    def enqueue(data):
+        try:
+            dispatch(data, timeout=config.enqueue_timeout)
+        except queue.Full:
+            # Рабочий процесс не успевает: Telegram повторит доставку позже
+            raise RuntimeError("Очередь рабочего процесса переполнена")
+
+    async def set_webhook():
+        async with Bot(token, base_url=base_url) as bot:
+            await bot.set_webhook(
+                url=config.webhook_url,
+                secret_token=config.secret_token,
+                max_connections=config.max_connections,
+                allowed_updates=Update.ALL_TYPES,
+            )
+
+    asyncio.run(set_webhook())
+    server = make_server(config.listen, config.port, create_webhook_app(config, enqueue), threaded=True)
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stop.set())
+    thread = threading.Thread(target=server.serve_forever, name='webhook-server', daemon=True)
+    thread.start()
+    logging.info(f"Вебхук слушает {config.listen}:{config.port}{config.path}")
+    stop.wait()
+    server.shutdown()
+    thread.join()
+
+
+async def poll_updates(token, dispatch, base_url='https://api.telegram.org/bot', request=None):
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    offset = None
+    async with Bot(token, base_url=base_url, get_updates_request=request) as bot:
+        await bot.delete_webhook()
+        while not stop.is_set():
+            poll = asyncio.ensure_future(
+                bot.get_updates(offset=offset, timeout=30, read_timeout=40,
+                                allowed_updates=Update.ALL_TYPES)
+            )
+            stopped = asyncio.ensure_future(stop.wait())
+            await asyncio.wait((poll, stopped), return_when=asyncio.FIRST_COMPLETED)
+            stopped.cancel()
+            if not poll.done():
+                poll.cancel()
+                break
+            try:
+                updates = poll.result()
+            except TelegramError as e:
+                logging.error(f"Ошибка при получении обновлений: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                await asyncio.to_thread(dispatch, update.to_dict())
+                offset = update.update_id + 1
+        if offset is not None:
+            # Подтверждаем уже разложенные обновления, чтобы после перезапуска они не пришли снова
+            await bot.get_updates(offset=offset, timeout=0)